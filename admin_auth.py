@@ -1,15 +1,15 @@
-from flask_restful import Resource, reqparse, Api
+from flask_restful import Resource, Api
 from flask import Blueprint
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
-from werkzeug.security import check_password_hash
+from flask_jwt_extended import jwt_required, get_jwt
 from models import Admin
-from extensions import db, logger, bcrypt
-from firebase_notification import generate_fcm_token
-from datetime import timedelta
-
-# Extended token expiration times
-ACCESS_EXPIRES = timedelta(days=30)
-REFRESH_EXPIRES = timedelta(days=90)
+from extensions import db, logger
+from throttling import throttled
+from auth import signup_schema, login_schema
+from password_hashing import password_hasher
+from principal import current_principal
+from revocation import revoke_token
+from tokens import issue_tokens, rotate_tokens, revoke_family
+from device_tokens import forget_session_devices
 
 # Create blueprint
 admin_auth_bp = Blueprint('admin_auth_bp', __name__, url_prefix='/admin')
@@ -17,14 +17,7 @@ admin_auth_api = Api(admin_auth_bp)
 
 class AdminSignup(Resource):
     def post(self):
-        register_args = reqparse.RequestParser()
-        register_args.add_argument('name', type=str, required=True, help='Name is required')
-        register_args.add_argument('email', type=str, required=True, help='Email is required')
-        register_args.add_argument('phone_number', type=str, required=True, help='Phone number is required')
-        register_args.add_argument('password', type=str, required=True, help='Password is required')
-        register_args.add_argument('confirmation_password', type=str, required=True, help='Password confirmation is required')
-
-        data = register_args.parse_args()
+        data = signup_schema.parse()
         
         if data["password"] != data["confirmation_password"]:
             return {"message": "Passwords don't match"}, 400
@@ -33,79 +26,75 @@ class AdminSignup(Resource):
             return {"message": "Email already exists"}, 400
         
         # Hash the password using bcrypt
-        hashed_password = bcrypt.generate_password_hash(data["password"]).decode('utf-8')
-        
-        # Generate FCM token automatically
-        fcm_token = generate_fcm_token()
+        hashed_password = password_hasher.hash(data["password"])
         
         new_admin = Admin(
             name=data["name"],
             email=data["email"],
             phone_number=data["phone_number"],
-            password=hashed_password,
-            fcm_token=fcm_token
+            password=hashed_password
         )
         
         db.session.add(new_admin)
         db.session.commit()
         
         return {
-            "message": "Admin signup successful",
-            "fcm_token": fcm_token
+            "message": "Admin signup successful"
         }, 201
 
 class AdminLogin(Resource):
+    @throttled('admin_login')
     def post(self):
-        login_args = reqparse.RequestParser()
-        login_args.add_argument('email', type=str, required=True, help='Email is required')
-        login_args.add_argument('password', type=str, required=True, help='Password is required')
-
-        data = login_args.parse_args()
+        data = login_schema.parse()
         
-        print("Admin login attempt:", data["email"])
         admin = Admin.query.filter_by(email=data["email"]).first()
-        print("Admin found:", admin)
 
-        # Use the check_password method from the Admin model
-        if not admin or not admin.check_password(data["password"]):
+        # Also upgrades the stored hash if it was made with a different BCRYPT_LOG_ROUNDS
+        if not admin or not password_hasher.verify_and_update(admin, data["password"]):
             return {"message": "Invalid email or password"}, 401
         
-        # Generate new FCM token if needed
-        if not admin.fcm_token:
-            admin.fcm_token = generate_fcm_token()
-            db.session.commit()
-        
-        access_token = create_access_token(
-            identity=str(admin.id),
-            expires_delta=ACCESS_EXPIRES,
-            additional_claims={
-                'role': 'admin',
-                'email': admin.email
-            }
-        )
-        refresh_token = create_refresh_token(
-            identity=str(admin.id),
-            expires_delta=REFRESH_EXPIRES
-        )
+        access_token, refresh_token = issue_tokens(admin)
+        db.session.commit()
         
         logger.info(f"Created admin tokens for user {admin.id}")
         
         return {
             "access_token": access_token,
             "refresh_token": refresh_token,
-            "admin_id": admin.id,
-            "fcm_token": admin.fcm_token
+            "admin_id": admin.id
         }, 200
 
+class AdminRefresh(Resource):
+    @jwt_required(refresh=True)
+    def post(self):
+        """Exchange a refresh token for a new access and refresh token; the old refresh token stops working"""
+        principal = current_principal()
+        admin = principal.row if principal and principal.is_admin else None
+        if not admin:
+            return {"message": "Invalid refresh token"}, 401
+
+        # New tokens carry the admin's current superadmin flag
+        tokens = rotate_tokens(admin, get_jwt())
+        if tokens is None:
+            return {"message": "Refresh token has been revoked, please log in again"}, 401
+
+        access_token, refresh_token = tokens
+        return {"access_token": access_token, "refresh_token": refresh_token}, 200
+
 class AdminLogout(Resource):
     @jwt_required()
     def post(self):
         try:
-            user_id = get_jwt_identity()
-            admin = Admin.query.get(user_id)
+            principal = current_principal()
+            user_id = principal.id
+            admin = principal.row if principal.is_admin else None
             
             if admin:
-                admin.fcm_token = None
+                # Revoke this access token and end the session so its refresh token stops working,
+                # and stop pushing to the device that logged out
+                revoke_token(get_jwt())
+                revoke_family(get_jwt().get('fam'))
+                forget_session_devices(get_jwt().get('fam'))
                 db.session.commit()
                 logger.info(f"Admin {user_id} logged out successfully")
                 return {"message": "Successfully logged out"}, 200
@@ -120,4 +109,5 @@ class AdminLogout(Resource):
 # Add resources
 admin_auth_api.add_resource(AdminSignup, '/signup')
 admin_auth_api.add_resource(AdminLogin, '/login')
+admin_auth_api.add_resource(AdminRefresh, '/refresh')
 admin_auth_api.add_resource(AdminLogout, '/logout')
\ No newline at end of file
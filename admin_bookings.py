@@ -1,15 +1,44 @@
 from flask_restful import Resource
-from flask import jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Booking, db
+from flask import jsonify, request
+from flask_jwt_extended import jwt_required
+from principal import current_principal
+from datetime import datetime
+from sqlalchemy.orm.exc import StaleDataError
+from models import Booking, NegotiationHistory, db
 from admin_decorator import admin_required
+from booking_state import InvalidTransition, ADMIN_NEGOTIATION_ACTIONS, apply_admin_negotiation, version_mismatch
+from notifications import enqueue_user_notifications
+from validation import Schema, Field
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Largest number of negotiation actions accepted in one bulk request
+MAX_BULK_NEGOTIATION_ITEMS = 200
+
+bulk_negotiation_schema = Schema({
+    'items': Field(list, required=True, min_length=1, max_length=MAX_BULK_NEGOTIATION_ITEMS),
+})
+bulk_negotiation_item_schema = Schema({
+    'booking_id': Field(int, required=True),
+    'action': Field(str, required=True, choices=ADMIN_NEGOTIATION_ACTIONS),
+    'amount': Field(int, nullable=True, min=0),
+    'notes': Field(str, nullable=True),
+    'version': Field(int, nullable=True),
+})
+
+NEGOTIATION_ACTION_MESSAGES = {
+    'accept': "Your offer for booking #{booking_id} was accepted at {amount}. You can now pay.",
+    'reject': "Your negotiation for booking #{booking_id} was declined.",
+    'counter': "We have countered your offer for booking #{booking_id} with {amount}.",
+}
 
 class AdminBookingManagementResource(Resource):
     @jwt_required()
     @admin_required
     def get(self, booking_type):
         """
-        Get bookings based on type (negotiated, incomplete, completed)
+        Get bookings based on type (negotiated, incomplete, completed, schedule)
         """
         if booking_type == "negotiated":
             # Get bookings with active negotiations
@@ -26,7 +55,116 @@ class AdminBookingManagementResource(Resource):
             bookings = Booking.query.filter(
                 Booking.status.in_(['paid', 'confirmed'])
             ).all()
+        elif booking_type == "schedule":
+            # Get active bookings flying within ?start=&end= (ISO datetimes), optionally for one helicopter
+            try:
+                start = datetime.fromisoformat(request.args['start'])
+                end = datetime.fromisoformat(request.args['end'])
+            except (KeyError, ValueError):
+                return {"message": "start and end are required ISO datetimes"}, 400
+            if end <= start:
+                return {"message": "end must be after start"}, 400
+            helicopter_id = request.args.get('helicopter_id', type=int)
+            bookings = Booking.scheduled_between(
+                start, end, helicopter_id=helicopter_id, query=Booking.active()
+            ).all()
         else:
             return {"message": "Invalid booking type"}, 400
 
-        return jsonify([booking.as_dict() for booking in bookings]) 
\ No newline at end of file
+        return jsonify([booking.as_dict() for booking in bookings])
+
+class AdminBulkNegotiationResource(Resource):
+    @jwt_required()
+    @admin_required
+    def post(self):
+        """
+        Apply many negotiation actions in one transaction.
+
+        Body: {"items": [{"booking_id", "action", "amount", "notes", "version" (optional)}]}.
+        Each item runs in its own savepoint, so a conflicting or invalid item is reported
+        without undoing the others. History rows are bulk inserted and clients are
+        notified in one batch after the commit.
+        """
+        admin_id = current_principal().id
+        items = bulk_negotiation_schema.parse()['items']
+
+        # Each item is validated on its own so one bad item does not fail the request
+        checked = [bulk_negotiation_item_schema.load(item) if isinstance(item, dict)
+                   else (None, {'item': 'must be an object'}) for item in items]
+        booking_ids = {item['booking_id'] for item, errors in checked if not errors}
+        bookings = {booking.id: booking for booking in Booking.query.filter(Booking.id.in_(booking_ids))}
+
+        results = []
+        history = []
+        applied = []
+        for raw_item, (item, errors) in zip(items, checked):
+            if errors:
+                field, problem = next(iter(errors.items()))
+                results.append({'booking_id': raw_item.get('booking_id') if isinstance(raw_item, dict) else None,
+                                'ok': False, 'status': 400, 'message': f"{field} {problem}", 'errors': errors})
+                continue
+            booking_id = item['booking_id']
+            action = item['action']
+            amount = item.get('amount')
+            booking = bookings.get(booking_id)
+            if booking is None:
+                results.append({'booking_id': booking_id, 'ok': False, 'status': 404, 'message': 'Booking not found'})
+                continue
+            if action != 'reject' and amount is None:
+                results.append({'booking_id': booking_id, 'ok': False, 'status': 400,
+                                'message': 'amount is required unless rejecting'})
+                continue
+            if version_mismatch(booking, item.get('version')):
+                results.append({'booking_id': booking_id, 'ok': False, 'status': 409,
+                                'message': 'Booking has changed since it was read', 'booking': booking.to_dict()})
+                continue
+
+            savepoint = db.session.begin_nested()
+            try:
+                old_amount = apply_admin_negotiation(booking, action, amount)
+                db.session.flush()
+                savepoint.commit()
+            except (InvalidTransition, StaleDataError) as e:
+                savepoint.rollback()
+                message = str(e) if isinstance(e, InvalidTransition) else 'Booking was modified by another request'
+                results.append({'booking_id': booking_id, 'ok': False, 'status': 409,
+                                'message': message, 'booking': booking.to_dict()})
+                continue
+
+            history.append({
+                'booking_id': booking_id,
+                'action': action,
+                'old_amount': old_amount,
+                'new_amount': amount,
+                'notes': item.get('notes'),
+                'user_id': admin_id,
+                'user_type': 'admin'
+            })
+            applied.append((booking, action, amount))
+            results.append({'booking_id': booking_id, 'ok': True, 'status': 200})
+
+        if applied:
+            # Queued in the same transaction, so clients hear about exactly the actions that were committed
+            enqueue_user_notifications([
+                (
+                    f"c:{booking.client_id}",
+                    'Negotiation update',
+                    NEGOTIATION_ACTION_MESSAGES[action].format(booking_id=booking.id, amount=amount),
+                    {'type': 'negotiation_update', 'booking_id': booking.id, 'action': action}
+                )
+                for booking, action, amount in applied
+            ])
+
+        try:
+            db.session.bulk_insert_mappings(NegotiationHistory, history)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Bulk negotiation commit failed: {str(e)}")
+            return {"message": f"Bulk negotiation failed: {str(e)}"}, 500
+
+        for result, (booking, _, _) in zip([r for r in results if r['ok']], applied):
+            result['booking'] = booking.to_dict()
+
+        logger.info(f"Admin {admin_id} applied {len(applied)}/{len(items)} bulk negotiation actions")
+        return {'applied': len(applied), 'failed': len(items) - len(applied), 'results': results}, 200
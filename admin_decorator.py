@@ -1,17 +1,14 @@
 from functools import wraps
-from flask_jwt_extended import get_jwt_identity, jwt_required
-from flask import jsonify
-from models import Admin  # Ensure correct import
+from flask_jwt_extended import jwt_required
+from principal import current_principal
 
 def admin_required(fn):
     @wraps(fn)
     @jwt_required()
     def wrapper(*args, **kwargs):
-        current_user_id = get_jwt_identity()
-        admin = Admin.query.get(current_user_id)
-
-        if not admin:
-            return jsonify({"msg": "Admin privileges required."}, 403)
+        # Role comes from the token claims, so this check needs no query
+        if not current_principal().is_admin:
+            return {"msg": "Admin privileges required."}, 403
 
         return fn(*args, **kwargs)
 
@@ -21,11 +18,10 @@ def superadmin_required(fn):
     @wraps(fn)
     @jwt_required()
     def wrapper(*args, **kwargs):
-        current_user_id = get_jwt_identity()
-        admin = Admin.query.get(current_user_id)
+        principal = current_principal()
 
-        if not admin or not admin.is_superadmin:  # Ensure is_superadmin exists in the model
-            return jsonify({"msg": "Superadmin privileges required."}, 403)
+        if not principal.is_admin or not principal.is_superadmin:
+            return {"msg": "Superadmin privileges required."}, 403
 
         return fn(*args, **kwargs)
 
@@ -35,9 +31,7 @@ def admin_or_superadmin_required(fn):
     @wraps(fn)
     @jwt_required()
     def wrapper(*args, **kwargs):
-        current_user_id = get_jwt_identity()
-        admin = Admin.query.get(current_user_id)
-        if not admin:
-            return jsonify({"msg": "Admin or superadmin privileges required."}), 403
+        if not current_principal().is_admin:
+            return {"msg": "Admin or superadmin privileges required."}, 403
         return fn(*args, **kwargs)
     return wrapper
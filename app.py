@@ -2,10 +2,11 @@ from flask import Flask, jsonify
 from flask_migrate import Migrate
 from flask_restful import Api
 from flask_cors import CORS
-from datetime import timedelta
+from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 import logging
+import click
 from extensions import jwt, bcrypt, db, mail
 
 # Configure logging
@@ -27,12 +28,19 @@ CORS(app)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  
 app.config["JSON_COMPACT"] = True
-app.config["JWT_SECRET_KEY"] = "Helicopter stuff"
+# Tokens are signed with the first key of JWT_JWKS_FILE (RS256/EdDSA) when set, otherwise HS256 with
+# JWT_SECRET_KEY. JWT_PUBLIC_JWKS_FILE is where `flask rotate-signing-key` exports the public keys.
+app.config["JWT_SECRET_KEY"] = os.getenv('JWT_SECRET_KEY')
+app.config["JWT_JWKS_FILE"] = os.getenv('JWT_JWKS_FILE')
+app.config["JWT_PUBLIC_JWKS_FILE"] = os.getenv('JWT_PUBLIC_JWKS_FILE')
+# Signs password reset links; required outside debug and testing, like JWT_SECRET_KEY for HS256
+app.config["PASSWORD_RESET_SECRET"] = os.getenv('PASSWORD_RESET_SECRET')
 app.config["JWT_TOKEN_LOCATION"] = ["headers"]
 app.config["JWT_HEADER_NAME"] = "Authorization"
 app.config["JWT_HEADER_TYPE"] = "Bearer"
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=30)
-app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=90)
+# Access tokens are short-lived; clients renew them at /auth/refresh or /admin/refresh
+app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=int(os.getenv('JWT_ACCESS_TOKEN_MINUTES', 15)))
+app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=int(os.getenv('JWT_REFRESH_TOKEN_DAYS', 30)))
 app.config["JWT_ERROR_MESSAGE_KEY"] = "error"
 
 # JWT Error handlers
@@ -69,6 +77,100 @@ app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 app.config['MAIL_MAX_EMAILS'] = None
 app.config['MAIL_ASCII_ATTACHMENTS'] = False
+# Emails are queued in the email_outbox table and sent by EMAIL_WORKERS threads per worker process
+# (0 to only send via `flask send-emails`), each keeping one SMTP connection open between batches
+# of EMAIL_BATCH_SIZE until it has been idle for EMAIL_SMTP_IDLE_SECONDS
+app.config['EMAIL_WORKERS'] = int(os.getenv('EMAIL_WORKERS', 1))
+app.config['EMAIL_BATCH_SIZE'] = int(os.getenv('EMAIL_BATCH_SIZE', 50))
+app.config['EMAIL_MAX_ATTEMPTS'] = int(os.getenv('EMAIL_MAX_ATTEMPTS', 6))
+app.config['EMAIL_RETRY_BASE_SECONDS'] = int(os.getenv('EMAIL_RETRY_BASE_SECONDS', 30))
+app.config['EMAIL_POLL_SECONDS'] = int(os.getenv('EMAIL_POLL_SECONDS', 5))
+app.config['EMAIL_SMTP_IDLE_SECONDS'] = int(os.getenv('EMAIL_SMTP_IDLE_SECONDS', 60))
+app.config['EMAIL_RETENTION_HOURS'] = int(os.getenv('EMAIL_RETENTION_HOURS', 72))
+# Rendered receipts are kept under RECEIPT_ARCHIVE_DIR (default instance/receipts) and may be
+# cached by the client's browser for RECEIPT_CACHE_SECONDS
+app.config['RECEIPT_ARCHIVE_DIR'] = os.getenv('RECEIPT_ARCHIVE_DIR')
+app.config['RECEIPT_CACHE_SECONDS'] = int(os.getenv('RECEIPT_CACHE_SECONDS', 86400))
+
+# Bookings' date and time are wall-clock times in BOOKING_TIMEZONE; flights are compared with the current time there
+app.config['BOOKING_TIMEZONE'] = os.getenv('BOOKING_TIMEZONE', 'Africa/Nairobi')
+
+# Background job configuration
+app.config['SCHEDULER_ENABLED'] = os.getenv('SCHEDULER_ENABLED', 'True') == 'True'
+app.config['BOOKING_EXPIRY_INTERVAL_SECONDS'] = int(os.getenv('BOOKING_EXPIRY_INTERVAL_SECONDS', 600))
+app.config['BOOKING_EXPIRY_BATCH_SIZE'] = int(os.getenv('BOOKING_EXPIRY_BATCH_SIZE', 500))
+app.config['BOOKING_EXPIRY_AGES'] = {
+    'pending': timedelta(hours=int(os.getenv('BOOKING_EXPIRY_PENDING_HOURS', 48))),
+    'pending_payment': timedelta(hours=int(os.getenv('BOOKING_EXPIRY_PENDING_PAYMENT_HOURS', 24))),
+    'negotiation': timedelta(hours=int(os.getenv('BOOKING_EXPIRY_NEGOTIATION_HOURS', 72))),
+}
+app.config['TOKEN_PRUNE_INTERVAL_SECONDS'] = int(os.getenv('TOKEN_PRUNE_INTERVAL_SECONDS', 3600))
+# Pre-flight reminders for paid bookings, REMINDER_OFFSETS_MINUTES before the flight. Reminders due within
+# REMINDER_HORIZON_MINUTES are held in memory and reloaded every REMINDER_REFRESH_SECONDS
+app.config['REMINDER_OFFSETS_MINUTES'] = [int(m) for m in os.getenv('REMINDER_OFFSETS_MINUTES', '1440,120').split(',')]
+app.config['REMINDER_HORIZON_MINUTES'] = int(os.getenv('REMINDER_HORIZON_MINUTES', 360))
+app.config['REMINDER_REFRESH_SECONDS'] = int(os.getenv('REMINDER_REFRESH_SECONDS', 600))
+app.config['REMINDER_BATCH_SIZE'] = int(os.getenv('REMINDER_BATCH_SIZE', 500))
+
+# Accept tokens whose subject is a bare id (issued before typed 'c:'/'a:' subjects).
+# Set to False once every such token has expired (30 days after deploying typed subjects).
+app.config['JWT_ACCEPT_LEGACY_SUBJECTS'] = os.getenv('JWT_ACCEPT_LEGACY_SUBJECTS', 'True') == 'True'
+
+# Password hashing: bcrypt cost, and a pool of BCRYPT_POOL_SIZE threads with room for
+# BCRYPT_QUEUE_LIMIT waiting hashes per worker before logins get a 503
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_POOL_SIZE'] = int(os.getenv('BCRYPT_POOL_SIZE', 4))
+app.config['BCRYPT_QUEUE_LIMIT'] = int(os.getenv('BCRYPT_QUEUE_LIMIT', 32))
+
+# Login and password-reset throttling; THROTTLE_STORE may name a shared bucket store class
+app.config['THROTTLE_ENABLED'] = os.getenv('THROTTLE_ENABLED', 'True') == 'True'
+app.config['THROTTLE_STORE'] = os.getenv('THROTTLE_STORE')
+
+# Token revocation: how often each worker merges revocations made by other workers, how far
+# back each merge re-reads for late commits, and the number of denylisted tokens its Bloom filter is sized for
+app.config['REVOCATION_SYNC_SECONDS'] = int(os.getenv('REVOCATION_SYNC_SECONDS', 5))
+app.config['REVOCATION_SYNC_MARGIN_SECONDS'] = int(os.getenv('REVOCATION_SYNC_MARGIN_SECONDS', 60))
+app.config['REVOCATION_FILTER_CAPACITY'] = int(os.getenv('REVOCATION_FILTER_CAPACITY', 100000))
+
+# Principal cache: PRINCIPAL_CACHE_BACKEND may name a shared backend class (get/set/delete)
+app.config['PRINCIPAL_CACHE_BACKEND'] = os.getenv('PRINCIPAL_CACHE_BACKEND')
+app.config['PRINCIPAL_CACHE_SIZE'] = int(os.getenv('PRINCIPAL_CACHE_SIZE', 10000))
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.getenv('PRINCIPAL_CACHE_TTL', 60))
+
+# Push notifications: a service-account JSON file, or the FIREBASE_* variables when unset
+app.config['FIREBASE_CREDENTIALS'] = os.getenv('FIREBASE_CREDENTIALS')
+
+# Notification outbox: NOTIFICATION_WORKERS dispatcher threads per worker process (0 to only
+# deliver via `flask dispatch-notifications`), each sending up to NOTIFICATION_BATCH_SIZE (max 500)
+# pushes per FCM request, retrying failures with exponential backoff and dead-lettering them
+# after NOTIFICATION_MAX_ATTEMPTS
+app.config['NOTIFICATION_WORKERS'] = int(os.getenv('NOTIFICATION_WORKERS', 2))
+app.config['NOTIFICATION_BATCH_SIZE'] = int(os.getenv('NOTIFICATION_BATCH_SIZE', 500))
+app.config['NOTIFICATION_MAX_ATTEMPTS'] = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 8))
+app.config['NOTIFICATION_RETRY_BASE_SECONDS'] = int(os.getenv('NOTIFICATION_RETRY_BASE_SECONDS', 5))
+app.config['NOTIFICATION_POLL_SECONDS'] = int(os.getenv('NOTIFICATION_POLL_SECONDS', 5))
+app.config['NOTIFICATION_RETENTION_HOURS'] = int(os.getenv('NOTIFICATION_RETENTION_HOURS', 72))
+# Chat pushes for one booking and recipient within NOTIFICATION_COALESCE_SECONDS are merged, and each
+# user or topic gets at most NOTIFICATION_RATE_LIMIT_COUNT pushes per NOTIFICATION_RATE_LIMIT_SECONDS
+# (0 disables the cap); extra pushes wait rather than being dropped
+app.config['NOTIFICATION_COALESCE_SECONDS'] = int(os.getenv('NOTIFICATION_COALESCE_SECONDS', 30))
+NOTIFICATION_RATE_LIMIT_COUNT = int(os.getenv('NOTIFICATION_RATE_LIMIT_COUNT', 10))
+app.config['NOTIFICATION_RATE_LIMIT'] = (
+    (NOTIFICATION_RATE_LIMIT_COUNT, int(os.getenv('NOTIFICATION_RATE_LIMIT_SECONDS', 60)))
+    if NOTIFICATION_RATE_LIMIT_COUNT else None
+)
+# NOTIFICATION_TRANSPORT may name another push transport class, e.g. push_transport.FakeTransport to
+# record pushes in memory instead of sending them; the NOTIFICATION_FAKE_* settings shape that fake
+app.config['NOTIFICATION_TRANSPORT'] = os.getenv('NOTIFICATION_TRANSPORT')
+app.config['NOTIFICATION_FAKE_LATENCY_MS'] = float(os.getenv('NOTIFICATION_FAKE_LATENCY_MS', 0))
+app.config['NOTIFICATION_FAKE_JITTER_MS'] = float(os.getenv('NOTIFICATION_FAKE_JITTER_MS', 0))
+app.config['NOTIFICATION_FAKE_QUOTA'] = int(os.getenv('NOTIFICATION_FAKE_QUOTA', 0)) or None
+app.config['NOTIFICATION_FAKE_ERROR_RATE'] = float(os.getenv('NOTIFICATION_FAKE_ERROR_RATE', 0))
+# FCM topic membership (admin_notifications) is synced every TOPIC_SYNC_INTERVAL_SECONDS in batches
+# of up to TOPIC_SYNC_BATCH_SIZE (max 1000) tokens, giving up on a token after TOPIC_SYNC_MAX_ATTEMPTS
+app.config['TOPIC_SYNC_INTERVAL_SECONDS'] = int(os.getenv('TOPIC_SYNC_INTERVAL_SECONDS', 30))
+app.config['TOPIC_SYNC_BATCH_SIZE'] = int(os.getenv('TOPIC_SYNC_BATCH_SIZE', 1000))
+app.config['TOPIC_SYNC_MAX_ATTEMPTS'] = int(os.getenv('TOPIC_SYNC_MAX_ATTEMPTS', 5))
 
 # Initialize Flask-SQLAlchemy first
 db.init_app(app)
@@ -86,13 +188,54 @@ with app.app_context():
     mail.init_app(app)
     jwt.init_app(app)
     
-    # Initialize JWT loaders
-    from auth import init_jwt
+    # Load JWT signing keys, then initialize JWT loaders
+    from signing_keys import signing_keys
+    signing_keys.configure(app)
+    from auth import init_jwt, init_password_reset
     init_jwt(app)
+    init_password_reset(app)
+
+    # Shared cache of principal snapshots
+    from principal_cache import principal_cache
+    principal_cache.configure(app)
+
+    # bcrypt worker pool
+    from password_hashing import password_hasher
+    password_hasher.configure(app)
+
+    # Login and password-reset rate limits
+    from throttling import throttle
+    throttle.configure(app)
+
+    # Revoked token filter
+    from revocation import revocation_list
+    revocation_list.configure(app)
     
-    # Initialize Firebase
-    from firebase_notification import initialize_firebase
-    initialize_firebase(app)
+    # Firebase is initialised lazily on the first notification sent by each worker
+    from firebase_notification import firebase_client
+    firebase_client.configure(app)
+
+    # Push transport (FCM unless NOTIFICATION_TRANSPORT names another), outbox dispatcher threads and topic sync
+    from push_transport import push_transport
+    push_transport.configure(app)
+    from notifications import notification_dispatcher
+    notification_dispatcher.configure(app)
+    from topic_subscriptions import topic_sync
+    topic_sync.configure(app)
+
+    # Email queue threads and precompiled email templates
+    from email_templates import email_templates
+    email_templates.configure(app)
+    from email_queue import email_dispatcher
+    email_dispatcher.configure(app)
+
+    # Archive of rendered payment receipts
+    from receipts import receipt_archive
+    receipt_archive.configure(app)
+
+    # Pre-flight reminder heap
+    from reminders import reminder_scheduler
+    reminder_scheduler.configure(app)
 
 # Create API instance
 api = Api(app)
@@ -100,12 +243,12 @@ api = Api(app)
 # Import routes after all extensions are initialized
 from bookings import BookingsResource, NegotiatedPaymentResource, NegotiationHistoryResource, FCMTokenResource, BookingStatusResource
 from client import ClientResource
-from helicopter import HelicopterResource
+from helicopter import HelicopterResource, HelicopterAvailabilityResource
 from payments import PaymentsResource, PaymentResource
 from auth import auth_bp
 from admin import admin_auth_bp
 from chat import ChatResource, NegotiationChatsResource, UnreadChatsResource, ChatReadResource
-from admin_bookings import AdminBookingManagementResource
+from admin_bookings import AdminBookingManagementResource, AdminBulkNegotiationResource
 
 # Register blueprints
 from auth import auth_bp
@@ -120,6 +263,7 @@ app.register_blueprint(chat_bp, url_prefix='/booking')
 api.add_resource(BookingsResource, '/booking', '/booking/<int:id>')
 api.add_resource(ClientResource, '/client', '/client/<int:id>')
 api.add_resource(HelicopterResource, '/helicopter', '/helicopter/<int:id>')
+api.add_resource(HelicopterAvailabilityResource, '/helicopter/availability')
 api.add_resource(PaymentsResource, '/payments')
 api.add_resource(PaymentResource, '/booking/<int:id>/payment')
 
@@ -128,6 +272,8 @@ api.add_resource(NegotiatedPaymentResource, '/booking/<int:booking_id>/pay-negot
 api.add_resource(FCMTokenResource, '/fcm-token')
 api.add_resource(NegotiationHistoryResource, '/booking/<int:booking_id>/negotiation-history')
 api.add_resource(BookingStatusResource, '/booking/<int:booking_id>/status')
+from receipts import ReceiptResource
+api.add_resource(ReceiptResource, '/booking/<int:booking_id>/receipt')
 
 # Chat routes
 api.add_resource(ChatResource, '/booking/<int:booking_id>/chat')
@@ -135,11 +281,120 @@ api.add_resource(ChatReadResource, '/booking/<int:booking_id>/chat/read')
 api.add_resource(NegotiationChatsResource, '/negotiation-chats')
 api.add_resource(UnreadChatsResource, '/chat/unread')
 
+# Public JWT verification keys
+from signing_keys import JWKSResource
+api.add_resource(JWKSResource, '/.well-known/jwks.json')
+
+# Worker metrics
+from metrics import MetricsResource, register_metrics
+from principal_cache import principal_cache
+from password_hashing import password_hasher
+from throttling import throttle
+from revocation import revocation_list
+from firebase_notification import firebase_client
+from push_transport import push_transport
+from notifications import notification_dispatcher
+from topic_subscriptions import topic_sync
+from email_queue import email_dispatcher
+from email_templates import email_templates
+register_metrics('principal_cache', principal_cache.metrics)
+register_metrics('password_hasher', password_hasher.metrics)
+register_metrics('throttle', throttle.metrics)
+register_metrics('revocation', revocation_list.metrics)
+register_metrics('firebase', firebase_client.metrics)
+register_metrics('notifications', notification_dispatcher.metrics)
+register_metrics('push_transport', push_transport.metrics)
+register_metrics('topic_subscriptions', topic_sync.metrics)
+register_metrics('email', email_dispatcher.metrics)
+register_metrics('email_templates', email_templates.metrics)
+register_metrics('receipts', receipt_archive.metrics)
+register_metrics('reminders', reminder_scheduler.metrics)
+api.add_resource(MetricsResource, '/admin/metrics')
+
 # Admin booking management routes
 api.add_resource(AdminBookingManagementResource, '/admin/bookings/<string:booking_type>')
+api.add_resource(AdminBulkNegotiationResource, '/admin/bookings/negotiations/bulk')
 
 # Make mail instance available globally
 app.mail = mail
 
+# Background jobs
+from scheduler import scheduler
+from expiry import expire_stale_bookings
+from tokens import prune_refresh_token_families
+from revocation import prune_revoked_tokens
+from notifications import prune_notification_outbox, requeue_dead_notifications
+from topic_subscriptions import sync_topic_subscriptions
+from email_queue import prune_email_outbox, requeue_dead_emails
+from reminders import send_reminders, prune_booking_reminders
+from signing_keys import rotate_jwks_file, write_public_jwks, SUPPORTED_ALGORITHMS
+
+scheduler.add_job('expire_bookings', expire_stale_bookings, app.config['BOOKING_EXPIRY_INTERVAL_SECONDS'])
+scheduler.add_job('prune_refresh_tokens', prune_refresh_token_families, app.config['TOKEN_PRUNE_INTERVAL_SECONDS'])
+scheduler.add_job('prune_revoked_tokens', prune_revoked_tokens, app.config['TOKEN_PRUNE_INTERVAL_SECONDS'])
+scheduler.add_job('prune_notifications', prune_notification_outbox, app.config['TOKEN_PRUNE_INTERVAL_SECONDS'])
+scheduler.add_job('prune_emails', prune_email_outbox, app.config['TOKEN_PRUNE_INTERVAL_SECONDS'])
+scheduler.add_job('prune_reminders', prune_booking_reminders, app.config['TOKEN_PRUNE_INTERVAL_SECONDS'])
+scheduler.add_job('sync_topic_subscriptions', sync_topic_subscriptions, app.config['TOPIC_SYNC_INTERVAL_SECONDS'])
+
+@app.before_first_request
+def start_background_jobs():
+    # Started on first request rather than import so each forked worker runs its own thread
+    if app.config['SCHEDULER_ENABLED']:
+        scheduler.start(app)
+        notification_dispatcher.start(app)
+        email_dispatcher.start(app)
+        reminder_scheduler.start(app)
+
+@app.cli.command('expire-bookings')
+def expire_bookings_command():
+    """Expire stale pending and negotiation bookings once (for cron)"""
+    count = expire_stale_bookings()
+    print(f"Expired {count} bookings")
+
+@app.cli.command('dispatch-notifications')
+def dispatch_notifications_command():
+    """Deliver every due notification in the outbox once"""
+    print(f"Handled {notification_dispatcher.drain()} notifications")
+
+@app.cli.command('requeue-dead-notifications')
+def requeue_dead_notifications_command():
+    """Retry every dead-lettered notification"""
+    print(f"Requeued {requeue_dead_notifications()} notifications")
+
+@app.cli.command('send-emails')
+def send_emails_command():
+    """Send every due email in the queue once, over one SMTP connection"""
+    print(f"Handled {email_dispatcher.drain()} emails")
+
+@app.cli.command('requeue-dead-emails')
+def requeue_dead_emails_command():
+    """Retry every dead-lettered email"""
+    print(f"Requeued {requeue_dead_emails()} emails")
+
+@app.cli.command('sync-topic-subscriptions')
+def sync_topic_subscriptions_command():
+    """Send every pending FCM topic subscription change once"""
+    print(f"Synced {sync_topic_subscriptions()} topic subscriptions")
+
+@app.cli.command('send-reminders')
+def send_reminders_command():
+    """Send every due pre-flight reminder once (for cron)"""
+    print(f"Sent {send_reminders()} reminders")
+
+@app.cli.command('rotate-signing-key')
+@click.option('--algorithm', type=click.Choice(SUPPORTED_ALGORITHMS), default='EdDSA')
+def rotate_signing_key_command(algorithm):
+    """Add a new JWT signing key to JWT_JWKS_FILE and export the public keys"""
+    path = app.config['JWT_JWKS_FILE']
+    if not path:
+        raise click.UsageError('Set JWT_JWKS_FILE first')
+    kid, signs_from = rotate_jwks_file(path, algorithm)
+    print(f"New signing key {kid}; published now, signing from "
+          f"{datetime.fromtimestamp(signs_from).isoformat(timespec='seconds')}")
+    if app.config['JWT_PUBLIC_JWKS_FILE']:
+        write_public_jwks(app.config['JWT_PUBLIC_JWKS_FILE'], path)
+        print(f"Public keys written to {app.config['JWT_PUBLIC_JWKS_FILE']}")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -1,44 +1,50 @@
-from datetime import timedelta
 from flask_jwt_extended import (
-    jwt_required, create_access_token, create_refresh_token,
-    current_user, get_jwt_identity, decode_token, verify_jwt_in_request
+    jwt_required, current_user, get_jwt, get_jwt_identity, decode_token, verify_jwt_in_request
 )
 from flask import Blueprint, request, url_for, current_app
-from flask_restful import Resource, Api, reqparse
+from flask_restful import Resource, Api
 from itsdangerous import URLSafeTimedSerializer
 from models import Client, Admin
-from extensions import jwt, bcrypt, db, logger
-from firebase_notification import generate_fcm_token
-from email_utils import send_password_reset_email  # You need to implement this
+from extensions import jwt, db, logger
+from throttling import throttled
+from validation import Schema, Field
+from password_hashing import password_hasher, HasherBusy
+from principal import principal_from_claims, current_principal, subject_for
+from signing_keys import signing_keys
+from revocation import revocation_list, revoke_token
+from device_tokens import forget_session_devices, forget_user_devices
+from tokens import issue_tokens, rotate_tokens, revoke_family, revoke_all_families
+from email_utils import queue_password_reset_email
+import secrets
 
 auth_bp = Blueprint('auth_bp', __name__, url_prefix='/auth')
 auth_api = Api(auth_bp)
 
-# Extended token expiration times
-ACCESS_EXPIRES = timedelta(days=30)  # Access token now lasts 30 days
-REFRESH_EXPIRES = timedelta(days=90)  # Refresh token now lasts 90 days
-
 def init_jwt(app):
     """Initialize JWT loaders for both client and admin authentication"""
     
     @jwt.user_lookup_loader
     def user_lookup_callback(_jwt_header, jwt_data):
-        identity = jwt_data["sub"]
-        try:
-            # First try to find a client
-            user = Client.query.get(identity)
-            if user:
-                return user
-                
-            # If not found, try to find an admin
-            admin = Admin.query.get(identity)
-            if admin:
-                return admin
-                
-            return None
-        except (ValueError, TypeError):
-            logger.error(f"Invalid user_id format: {identity}")
-            return None
+        # Role and identity come from the signed claims; no query unless the row is needed
+        return principal_from_claims(jwt_data)
+
+    @jwt.encode_key_loader
+    def signing_key_callback(_identity):
+        return signing_keys.signing_key()
+
+    @jwt.additional_headers_loader
+    def token_headers_callback(_identity):
+        # kid of the signing key, so verifiers pick the right public key
+        return signing_keys.headers()
+
+    @jwt.decode_key_loader
+    def verification_key_callback(jwt_header, _jwt_data):
+        return signing_keys.verification_key(jwt_header)
+
+    @jwt.token_in_blocklist_loader
+    def token_revoked_callback(_jwt_header, jwt_data):
+        # Almost always answered by the in-memory filter without a query
+        return revocation_list.is_revoked(jwt_data['jti'])
     
     @jwt.user_identity_loader
     def user_identity_callback(user):
@@ -46,23 +52,37 @@ def init_jwt(app):
         if isinstance(user, (int, str)):
             return user
             
-        # If user is a model instance, return its ID
+        # If user is a model instance, return its typed subject ('c:<id>' or 'a:<id>')
         if isinstance(user, (Client, Admin)):
-            return user.id
+            return subject_for(user)
             
         # Default case
         return None
 
-register_args = reqparse.RequestParser()
-register_args.add_argument('name', type=str, required=True, help='Name is required')
-register_args.add_argument('email', type=str, required=True, help='Email is required')
-register_args.add_argument('phone_number', type=str, required=True, help='Phone number is required')
-register_args.add_argument('password', type=str, required=True, help='Password is required')
-register_args.add_argument('confirmation_password', type=str, required=True, help='Password confirmation is required')
+# Request bodies; lengths follow the Client/Admin columns
+signup_schema = Schema({
+    'name': Field(str, required=True, min_length=1, max_length=60),
+    'email': Field(str, required=True, min_length=1, max_length=90),
+    'phone_number': Field(str, required=True, min_length=1, max_length=14),
+    'password': Field(str, required=True, min_length=1),
+    'confirmation_password': Field(str, required=True),
+})
+login_schema = Schema({
+    'email': Field(str, required=True),
+    'password': Field(str, required=True),
+})
+forgot_password_schema = Schema({
+    'email': Field(str, required=True),
+})
+reset_password_schema = Schema({
+    'token': Field(str, required=True),
+    'new_password': Field(str, required=True, min_length=1),
+    'confirm_password': Field(str, required=True),
+})
 
 class Signup(Resource):
     def post(self):
-        data = register_args.parse_args()
+        data = signup_schema.parse()
         
         if data["password"] != data["confirmation_password"]:
             return {"message": "Passwords don't match"}, 400
@@ -70,17 +90,13 @@ class Signup(Resource):
         if Client.query.filter_by(email=data['email']).first():
             return {"message": "Email already exists"}, 400
         
-        hashed_password = bcrypt.generate_password_hash(data["password"]).decode('utf-8')
-        
-        # Generate FCM token automatically
-        fcm_token = generate_fcm_token()
+        hashed_password = password_hasher.hash(data["password"])
         
         new_user = Client(
             name=data["name"],
             email=data["email"],
             phone_number=data["phone_number"],
-            password=hashed_password,
-            fcm_token=fcm_token
+            password=hashed_password
         )
         
         db.session.add(new_user)
@@ -88,54 +104,30 @@ class Signup(Resource):
         
         return {
             "message": "Signup successful",
-            "client_id": new_user.id,
-            "fcm_token": fcm_token
+            "client_id": new_user.id
         }, 201
 
-login_args = reqparse.RequestParser()
-login_args.add_argument('email', type=str, required=True, help='Email is required')
-login_args.add_argument('password', type=str, required=True, help='Password is required')
-
 class Login(Resource):
+    @throttled('login')
     def post(self):
-        data = login_args.parse_args()
+        data = login_schema.parse()
         
         user = Client.query.filter_by(email=data["email"]).first()
         
-        if not user or not bcrypt.check_password_hash(user.password, data["password"]):
+        # Also upgrades the stored hash if it was made with a different BCRYPT_LOG_ROUNDS
+        if not user or not password_hasher.verify_and_update(user, data["password"]):
             return {"message": "Invalid email or password"}, 401
         
-        # Clear any existing FCM token
-        user.fcm_token = None
-        
-        # Generate new FCM token
-        user.fcm_token = generate_fcm_token()
+        # Create tokens for a new session
+        access_token, refresh_token = issue_tokens(user)
         db.session.commit()
         
-        # Create tokens
-        access_token = create_access_token(
-            identity=str(user.id),  # Convert to string here
-            expires_delta=ACCESS_EXPIRES,
-            additional_claims={
-                'role': 'user',
-                'email': user.email
-            }
-        )
-        refresh_token = create_refresh_token(
-            identity=str(user.id),  # Convert to string here
-            expires_delta=REFRESH_EXPIRES
-        )
-        
         logger.info(f"Created tokens for user {user.id}")
         
-        # Log token creation
-        logger.info(f"Created access token for user {user.id}")
-        
         return {
             "access_token": access_token,
             "refresh_token": refresh_token,
             "client_id": user.id,
-            "fcm_token": user.fcm_token,
             "name": user.name,
             "email": user.email
         }, 200
@@ -145,39 +137,58 @@ class Login(Resource):
         return {
             "client_id": current_user.id,
             "email": current_user.email,
-            "name": current_user.name,
-            "fcm_token": current_user.fcm_token
+            "name": current_user.name
         }, 200
 
+class Refresh(Resource):
+    @jwt_required(refresh=True)
+    def post(self):
+        """Exchange a refresh token for a new access and refresh token; the old refresh token stops working"""
+        principal = current_principal()
+        user = principal.row if principal and principal.is_client else None
+        if not user:
+            return {"message": "Invalid refresh token"}, 401
+
+        tokens = rotate_tokens(user, get_jwt())
+        if tokens is None:
+            return {"message": "Refresh token has been revoked, please log in again"}, 401
+
+        access_token, refresh_token = tokens
+        return {"access_token": access_token, "refresh_token": refresh_token}, 200
+
 class Logout(Resource):
     @jwt_required()
     def post(self):
         try:
-            verify_jwt_in_request()
-            user_id = get_jwt_identity()
-            
-            # Try to find user in both Client and Admin tables
-            user = Client.query.get(user_id)
-            if not user:
-                user = Admin.query.get(user_id)
-            
-            if user:
-                user.fcm_token = None
-                db.session.commit()
+            # Revoke this access token and end the session so its refresh token stops working,
+            # and stop pushing to the device that logged out
+            revoke_token(get_jwt())
+            revoke_family(get_jwt().get('fam'))
+            forget_session_devices(get_jwt().get('fam'))
+            db.session.commit()
                 
             return {"message": "Successfully logged out"}, 200
         except Exception as e:
             logger.error(f"Error during logout: {str(e)}")
             return {"message": "Error during logout"}, 422
 
-# Serializer for generating tokens
+def init_password_reset(app):
+    """Check reset links have a key every worker shares and that survives restarts"""
+    if app.config.get('PASSWORD_RESET_SECRET'):
+        return
+    if not (app.debug or app.testing):
+        raise RuntimeError("PASSWORD_RESET_SECRET is not set")
+    logger.warning("PASSWORD_RESET_SECRET is not set; using a random per-process key for development.")
+    app.config['PASSWORD_RESET_SECRET'] = secrets.token_urlsafe(32)
+
+# Serializer for password reset links; its own key, so they do not depend on how tokens are signed
 def get_serializer():
-    return URLSafeTimedSerializer(current_app.config["JWT_SECRET_KEY"])
+    return URLSafeTimedSerializer(current_app.config["PASSWORD_RESET_SECRET"])
 
 class ForgotPassword(Resource):
+    @throttled('forgot_password')
     def post(self):
-        data = request.get_json()
-        email = data.get("email")
+        email = forgot_password_schema.parse()["email"]
         user = Client.query.filter_by(email=email).first()
         user_type = "client"
         if not user:
@@ -194,15 +205,16 @@ class ForgotPassword(Resource):
         # Add logging to debug URL generation
         logger.info(f"Generated reset URL: {reset_url}")
         
-        send_password_reset_email(user.email, reset_url)
+        queue_password_reset_email(user.email, reset_url)
+        db.session.commit()
         return {"message": "If the email exists, a reset link will be sent."}, 200
 
 class ResetPassword(Resource):
     def post(self):
-        data = request.get_json()
-        token = data.get("token")
-        new_password = data.get("new_password")
-        confirm_password = data.get("confirm_password")
+        data = reset_password_schema.parse()
+        token = data["token"]
+        new_password = data["new_password"]
+        confirm_password = data["confirm_password"]
         if new_password != confirm_password:
             return {"message": "Passwords do not match."}, 400
 
@@ -222,15 +234,21 @@ class ResetPassword(Resource):
 
             # Use the model's set_password method
             user.set_password(new_password)
+            # Log out every existing session, and its devices
+            revoke_all_families(user)
+            forget_user_devices(user)
             db.session.commit()
 
             return {"message": "Password reset successful."}, 200
+        except HasherBusy:
+            raise
         except Exception as e:
             logger.error(f"Password reset error: {str(e)}")
             return {"message": "Invalid or expired token."}, 400
 
 auth_api.add_resource(Signup, '/signup')
 auth_api.add_resource(Login, '/login')
+auth_api.add_resource(Refresh, '/refresh')
 auth_api.add_resource(Logout, '/logout')
 auth_api.add_resource(ForgotPassword, '/forgot-password')
 auth_api.add_resource(ResetPassword, '/reset-password', endpoint='resetpassword')
\ No newline at end of file
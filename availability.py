@@ -0,0 +1,187 @@
+from bisect import bisect_left, insort
+from datetime import timedelta
+import threading
+import time
+import logging
+from models import db, Booking, Helicopter, MAX_FLIGHT_DURATION_MINUTES, booking_now
+
+logger = logging.getLogger(__name__)
+
+# Reload the calendar from the database at most this often, to pick up writes made by other workers
+CALENDAR_REFRESH_SECONDS = 300
+
+MAX_FLIGHT_DURATION = timedelta(minutes=MAX_FLIGHT_DURATION_MINUTES)
+
+class HelicopterCalendar:
+    """Flight windows of one helicopter, kept sorted by start time"""
+
+    def __init__(self):
+        self._entries = []  # (start, end, booking_id), sorted
+        self._by_booking = {}  # booking_id -> (start, end, booking_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, booking_id, start, end):
+        self.remove(booking_id)
+        entry = (start, end, booking_id)
+        insort(self._entries, entry)
+        self._by_booking[booking_id] = entry
+
+    def remove(self, booking_id):
+        entry = self._by_booking.pop(booking_id, None)
+        if entry is not None:
+            index = bisect_left(self._entries, entry)
+            del self._entries[index]
+
+    def overlapping(self, start, end, exclude_id=None):
+        """
+        Booking ids whose window overlaps [start, end).
+
+        No flight is longer than MAX_FLIGHT_DURATION, so only entries starting in
+        (start - MAX_FLIGHT_DURATION, end) need checking.
+        """
+        low = bisect_left(self._entries, (start - MAX_FLIGHT_DURATION,))
+        high = bisect_left(self._entries, (end,))
+        return [
+            booking_id for entry_start, entry_end, booking_id in self._entries[low:high]
+            if entry_end > start and booking_id != exclude_id
+        ]
+
+    def is_free(self, start, end, exclude_id=None):
+        return not self.overlapping(start, end, exclude_id=exclude_id)
+
+class FleetCalendar:
+    """
+    In-memory availability index for the whole fleet.
+
+    Built lazily from upcoming active bookings and kept up to date from committed
+    sessions, so availability searches never touch the database.
+    """
+
+    def __init__(self, refresh_seconds=CALENDAR_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._calendars = {}  # helicopter_id -> HelicopterCalendar
+        self._helicopters = {}  # helicopter_id -> helicopter dict
+        self._booking_helicopter = {}  # booking_id -> helicopter_id
+        self._loaded_at = None
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.load()
+
+    def load(self):
+        """Rebuild the calendar from the database"""
+        helicopters = Helicopter.query.all()
+        upcoming = Booking.active().filter(Booking.ends_at > booking_now()).with_entities(
+            Booking.id, Booking.helicopter_id, Booking.scheduled_at, Booking.ends_at
+        ).all()
+
+        calendars = {helicopter.id: HelicopterCalendar() for helicopter in helicopters}
+        booking_helicopter = {}
+        for booking_id, helicopter_id, start, end in upcoming:
+            calendars.setdefault(helicopter_id, HelicopterCalendar()).add(booking_id, start, end)
+            booking_helicopter[booking_id] = helicopter_id
+
+        with self._lock:
+            self._calendars = calendars
+            self._helicopters = {helicopter.id: helicopter.to_dict() for helicopter in helicopters}
+            self._booking_helicopter = booking_helicopter
+            self._loaded_at = time.monotonic()
+        logger.info(f"Loaded availability calendar: {len(helicopters)} helicopters, {len(upcoming)} bookings")
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def update_booking(self, booking_id, helicopter_id, start, end, status):
+        """Apply a created or changed booking"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._discard(booking_id)
+            if status in Booking.INACTIVE_STATUSES or start is None or end is None:
+                return
+            self._calendars.setdefault(helicopter_id, HelicopterCalendar()).add(booking_id, start, end)
+            self._booking_helicopter[booking_id] = helicopter_id
+
+    def discard_booking(self, booking_id):
+        """Drop a deleted, cancelled or expired booking"""
+        with self._lock:
+            self._discard(booking_id)
+
+    def _discard(self, booking_id):
+        helicopter_id = self._booking_helicopter.pop(booking_id, None)
+        if helicopter_id in self._calendars:
+            self._calendars[helicopter_id].remove(booking_id)
+
+    def update_helicopter(self, helicopter):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._helicopters[helicopter['id']] = helicopter
+            self._calendars.setdefault(helicopter['id'], HelicopterCalendar())
+
+    def discard_helicopter(self, helicopter_id):
+        with self._lock:
+            self._helicopters.pop(helicopter_id, None)
+            calendar = self._calendars.pop(helicopter_id, None)
+            if calendar is not None:
+                for _, _, booking_id in calendar._entries:
+                    self._booking_helicopter.pop(booking_id, None)
+
+    def is_available(self, helicopter_id, start, end, exclude_booking_id=None):
+        self._ensure_loaded()
+        with self._lock:
+            calendar = self._calendars.get(helicopter_id)
+            return calendar is None or calendar.is_free(start, end, exclude_id=exclude_booking_id)
+
+    def available_helicopters(self, start, end, passengers=1):
+        """Helicopters with enough seats and no booking overlapping [start, end)"""
+        self._ensure_loaded()
+        with self._lock:
+            return [
+                helicopter for helicopter_id, helicopter in self._helicopters.items()
+                if helicopter['capacity'] >= passengers
+                and self._calendars.get(helicopter_id, HelicopterCalendar()).is_free(start, end)
+            ]
+
+fleet_calendar = FleetCalendar()
+
+@db.event.listens_for(db.session, 'after_flush')
+def _collect_calendar_changes(session, flush_context):
+    # Snapshot values now: after_commit cannot emit SQL to refresh expired attributes.
+    # Changes are tagged with the enclosing savepoint so a rolled back savepoint drops only its own.
+    savepoint = session.get_nested_transaction()
+    changes = session.info.setdefault('calendar_changes', [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Booking):
+            changes.append((savepoint, 'booking', (obj.id, obj.helicopter_id, obj.scheduled_at, obj.ends_at, obj.status)))
+        elif isinstance(obj, Helicopter):
+            changes.append((savepoint, 'helicopter', obj.to_dict()))
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            changes.append((savepoint, 'booking_deleted', obj.id))
+        elif isinstance(obj, Helicopter):
+            changes.append((savepoint, 'helicopter_deleted', obj.id))
+
+@db.event.listens_for(db.session, 'after_commit')
+def _apply_calendar_changes(session):
+    for _, kind, value in session.info.pop('calendar_changes', []):
+        if kind == 'booking':
+            fleet_calendar.update_booking(*value)
+        elif kind == 'booking_deleted':
+            fleet_calendar.discard_booking(value)
+        elif kind == 'helicopter':
+            fleet_calendar.update_helicopter(value)
+        elif kind == 'helicopter_deleted':
+            fleet_calendar.discard_helicopter(value)
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def _discard_calendar_changes(session, previous_transaction):
+    if previous_transaction.nested:
+        changes = session.info.get('calendar_changes', [])
+        session.info['calendar_changes'] = [change for change in changes if change[0] is not previous_transaction]
+    else:
+        session.info.pop('calendar_changes', None)
@@ -0,0 +1,94 @@
+"""
+Login throughput under concurrent load.
+
+Runs /auth/login against a throwaway SQLite database through the Flask test client,
+with CONCURRENCY request threads for DURATION seconds, and reports logins per second,
+latency percentiles and how many attempts were shed with a 503.
+
+    python benchmarks/login_throughput.py --concurrency 16 --rounds 10 --pool-size 4 --queue-limit 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SCHEDULER_ENABLED', 'False')
+# Throwaway keys; the app refuses to start without them outside debug
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret')
+os.environ.setdefault('PASSWORD_RESET_SECRET', 'benchmark-reset-secret')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--rounds', type=int, default=10, help='BCRYPT_LOG_ROUNDS')
+    parser.add_argument('--pool-size', type=int, default=4, help='BCRYPT_POOL_SIZE')
+    parser.add_argument('--queue-limit', type=int, default=32, help='BCRYPT_QUEUE_LIMIT')
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.rounds)
+    os.environ['BCRYPT_POOL_SIZE'] = str(args.pool_size)
+    os.environ['BCRYPT_QUEUE_LIMIT'] = str(args.queue_limit)
+    import logging
+    logging.disable(logging.WARNING)
+
+    from app import app
+    from extensions import db
+    from models import Client
+    from password_hashing import password_hasher
+
+    db_path = tempfile.mktemp(suffix='.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.create_all()
+        password = password_hasher.hash('benchmark-password')
+        db.session.add_all([
+            Client(name=f'User {i}', email=f'user{i}@bench.local', phone_number=f'07{i:08d}', password=password)
+            for i in range(args.users)
+        ])
+        db.session.commit()
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(n):
+        client = app.test_client()
+        i = n
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = client.post('/auth/login', json={
+                'email': f'user{i % args.users}@bench.local', 'password': 'benchmark-password'
+            })
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            i += args.concurrency
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    ok = statuses.get(200, 0)
+    print(f"rounds={args.rounds} pool={args.pool_size} queue={args.queue_limit} concurrency={args.concurrency}")
+    print(f"logins/s: {ok / wall:.1f}  attempts: {len(latencies)}  statuses: {statuses}")
+    print(f"latency ms: p50={percentile(0.5):.1f} p95={percentile(0.95):.1f} p99={percentile(0.99):.1f}")
+    print(f"hasher: {password_hasher.metrics()}")
+    os.remove(db_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Push notification throughput and delivery lag, end to end.
+
+Drives booking and chat requests through the Flask test client against a throwaway
+SQLite database, so each event is queued in the outbox by the real handlers, and
+delivers them with the real dispatcher threads to push_transport.FakeTransport,
+which simulates FCM latency, quota and per-token errors. Reports events and
+delivered messages per second, and lag from enqueue to delivery.
+
+    python benchmarks/notification_throughput.py --events 2000 --latency-ms 80 --workers 2
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SCHEDULER_ENABLED', 'False')
+# Throwaway keys; the app refuses to start without them outside debug
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret')
+os.environ.setdefault('PASSWORD_RESET_SECRET', 'benchmark-reset-secret')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=2000, help='booking and chat requests to make')
+    parser.add_argument('--producers', type=int, default=4, help='request threads')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--devices', type=int, default=2, help='registered devices per client')
+    parser.add_argument('--booking-share', type=float, default=0.1, help='share of events that are new bookings')
+    parser.add_argument('--workers', type=int, default=2, help='NOTIFICATION_WORKERS')
+    parser.add_argument('--batch-size', type=int, default=500, help='NOTIFICATION_BATCH_SIZE')
+    parser.add_argument('--latency-ms', type=float, default=80, help='simulated FCM request latency')
+    parser.add_argument('--jitter-ms', type=float, default=40)
+    parser.add_argument('--quota', type=int, default=0, help='simulated FCM messages per second (0 for none)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of messages failing transiently')
+    parser.add_argument('--invalid-tokens', type=float, default=0.02, help='share of devices FCM reports unregistered')
+    parser.add_argument('--coalesce-seconds', type=int, default=0, help='NOTIFICATION_COALESCE_SECONDS')
+    parser.add_argument('--timeout', type=float, default=120.0, help='give up waiting for delivery after this long')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'NOTIFICATION_TRANSPORT': 'push_transport.FakeTransport',
+        'NOTIFICATION_FAKE_LATENCY_MS': str(args.latency_ms),
+        'NOTIFICATION_FAKE_JITTER_MS': str(args.jitter_ms),
+        'NOTIFICATION_FAKE_QUOTA': str(args.quota),
+        'NOTIFICATION_FAKE_ERROR_RATE': str(args.error_rate),
+        'NOTIFICATION_WORKERS': str(args.workers),
+        'NOTIFICATION_BATCH_SIZE': str(args.batch_size),
+        'NOTIFICATION_COALESCE_SECONDS': str(args.coalesce_seconds),
+        'NOTIFICATION_RATE_LIMIT_COUNT': '0',
+        'NOTIFICATION_RETRY_BASE_SECONDS': '1',
+        'NOTIFICATION_POLL_SECONDS': '1',
+    })
+    import logging
+    logging.disable(logging.WARNING)
+
+    from app import app
+    from extensions import db
+    from models import Admin, Client, Helicopter, Booking, DeviceToken, NotificationOutbox
+    from notifications import notification_dispatcher
+    from push_transport import push_transport
+    from tokens import issue_tokens
+
+    db_path = tempfile.mktemp(suffix='.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    rng = random.Random(1)
+    fake = push_transport.backend
+
+    with app.app_context():
+        db.create_all()
+        admin = Admin(name='Bench Admin', email='admin@bench.local', phone_number='0700000000',
+                      password='x', is_superadmin=True)
+        helicopter = Helicopter(model='Bench', capacity=6)
+        clients = [
+            Client(name=f'User {i}', email=f'user{i}@bench.local', phone_number=f'07{i:08d}', password='x')
+            for i in range(args.clients)
+        ]
+        db.session.add_all([admin, helicopter] + clients)
+        db.session.commit()
+        for client in clients:
+            for n in range(args.devices):
+                token = f'device-{client.id}-{n}'
+                db.session.add(DeviceToken(token=token, subject=f'c:{client.id}'))
+                if rng.random() < args.invalid_tokens:
+                    fake.token_errors[token] = 'unregistered'
+        admin_headers = {'Authorization': f'Bearer {issue_tokens(admin)[0]}'}
+        client_headers = [{'Authorization': f'Bearer {issue_tokens(client)[0]}'} for client in clients]
+        helicopter_id = helicopter.id
+        db.session.commit()
+
+    bookings = []  # (client index, booking id)
+    bookings_lock = threading.Lock()
+    statuses = {}
+    counter = iter(range(args.events))
+    counter_lock = threading.Lock()
+
+    def create_booking(http, n, index):
+        response = http.post('/booking', headers=client_headers[index], json={
+            'helicopter_id': helicopter_id, 'date': f'{2030 + n // 300}-{n // 25 % 12 + 1:02d}-{n % 25 + 1:02d}',
+            'time': '10:00:00', 'purpose': 'Benchmark', 'num_passengers': 2, 'original_amount': 50000,
+        })
+        if response.status_code == 201:
+            with bookings_lock:
+                bookings.append((index, response.get_json()['booking']['id']))
+        return response.status_code
+
+    def producer(seed):
+        http = app.test_client()
+        local = random.Random(seed)
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            if not bookings or local.random() < args.booking_share:
+                status = create_booking(http, n, local.randrange(args.clients))
+            else:
+                index, booking_id = local.choice(bookings)
+                headers = admin_headers if local.random() < 0.5 else client_headers[index]
+                status = http.post(f'/booking/{booking_id}/chat', headers=headers,
+                                   json={'message': f'Benchmark message {n}'}).status_code
+            with counter_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    notification_dispatcher.start(app)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=producer, args=(n,)) for n in range(args.producers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    produced = time.perf_counter() - started
+
+    with app.app_context():
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            outstanding = NotificationOutbox.query.filter(NotificationOutbox.status.in_(['pending', 'sending'])).count()
+            if not outstanding:
+                break
+            db.session.remove()
+            time.sleep(0.05)
+        delivered = time.perf_counter() - started
+        notification_dispatcher.stop()
+        rows = NotificationOutbox.query.all()
+        lags = sorted((row.sent_at - row.created_at).total_seconds() for row in rows if row.status == 'sent')
+        dead = sum(row.status == 'dead' for row in rows)
+        pruned = DeviceToken.query.count()
+
+    def percentile(p):
+        return lags[min(len(lags) - 1, int(len(lags) * p))] * 1000 if lags else 0.0
+
+    print(f"workers={args.workers} batch={args.batch_size} latency={args.latency_ms}ms "
+          f"quota={args.quota or 'none'} error_rate={args.error_rate} producers={args.producers}")
+    print(f"events: {args.events} in {produced:.2f}s ({args.events / produced:.0f}/s)  statuses: {statuses}")
+    print(f"delivered: {len(fake.messages)} messages in {fake.requests} requests, "
+          f"{len(fake.messages) / delivered:.0f} msg/s  outstanding: {outstanding}  dead: {dead}")
+    print(f"lag ms: p50={percentile(0.5):.0f} p95={percentile(0.95):.0f} p99={percentile(0.99):.0f} "
+          f"max={lags[-1] * 1000 if lags else 0:.0f}")
+    print(f"devices left: {pruned}/{args.clients * args.devices}")
+    print(f"dispatcher: {notification_dispatcher.metrics()}")
+    os.remove(db_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Pre-flight reminder scheduling over a large future schedule.
+
+Fills a throwaway SQLite database with paid bookings spread over the coming
+days, then times what the reminder scheduler does: the startup refresh (one
+range query per offset on the (status, scheduled_at) index), and sending every
+reminder that falls due over the next horizon in batches. For comparison it
+times one poll that reads every upcoming paid booking, which is what a job
+checking the whole table each minute would pay.
+
+Flights are booked in BOOKING_TIMEZONE wall-clock time. A probe booking checks
+that its 2h reminder falls due exactly two hours before departure on that clock,
+not shifted by the zone's offset from UTC.
+
+    python benchmarks/reminder_scheduling.py --bookings 200000 --days 90
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SCHEDULER_ENABLED', 'False')
+# Throwaway keys; the app refuses to start without them outside debug
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret')
+os.environ.setdefault('PASSWORD_RESET_SECRET', 'benchmark-reset-secret')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--bookings', type=int, default=200000, help='paid bookings in the future')
+    parser.add_argument('--days', type=int, default=90, help='spread the bookings over this many days')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=500, help='REMINDER_BATCH_SIZE')
+    parser.add_argument('--horizon-minutes', type=int, default=360, help='REMINDER_HORIZON_MINUTES')
+    parser.add_argument('--timezone', default='Africa/Nairobi', help='BOOKING_TIMEZONE')
+    args = parser.parse_args()
+    import logging
+    logging.disable(logging.WARNING)
+
+    from app import app
+    from extensions import db
+    from zoneinfo import ZoneInfo
+    from models import Client, Helicopter, Booking, BookingReminder, EmailOutbox
+    from reminders import reminder_scheduler, REMINDER_STATUSES
+
+    db_path = tempfile.mktemp(suffix='.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    reminder_scheduler.batch_size = args.batch_size
+    reminder_scheduler.horizon = timedelta(minutes=args.horizon_minutes)
+    reminder_scheduler.timezone = ZoneInfo(args.timezone)
+    now = reminder_scheduler.now().replace(microsecond=0)
+    utc_offset = now - datetime.utcnow().replace(microsecond=0)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Helicopter(model='Bench', capacity=6))
+        db.session.bulk_insert_mappings(Client, [
+            {'name': f'User {i}', 'email': f'user{i}@bench.local', 'phone_number': f'07{i:08d}', 'password': 'x'}
+            for i in range(args.clients)
+        ])
+        step = args.days * 86400 / args.bookings
+        rows = []
+        for n in range(args.bookings):
+            at = now + timedelta(seconds=int(n * step) + 60)
+            rows.append({
+                'client_id': n % args.clients + 1, 'helicopter_id': 1, 'date': at.date(), 'time': at.time(),
+                'scheduled_at': at, 'ends_at': at + timedelta(hours=1), 'duration_minutes': 60,
+                'purpose': 'Benchmark', 'num_passengers': 2, 'final_amount': 50000, 'version': 1,
+                'status': 'paid' if n % 10 else 'pending',
+            })
+        db.session.bulk_insert_mappings(Booking, rows)
+        # Departs 2h30m from now on the booking clock, so its 2h reminder is due in 30 minutes
+        departure = now + timedelta(hours=2, minutes=30)
+        probe = Booking(client_id=1, helicopter_id=1, date=departure.date(), time=departure.time(),
+                        purpose='Probe', num_passengers=2, final_amount=50000, status='paid')
+        probe.sync_schedule()
+        db.session.add(probe)
+        db.session.commit()
+        paid = sum(row['status'] == 'paid' for row in rows) + 1
+
+        started = time.perf_counter()
+        upcoming = db.session.query(Booking.id, Booking.scheduled_at).filter(
+            Booking.status.in_(REMINDER_STATUSES), Booking.scheduled_at > now
+        ).all()
+        full_poll = time.perf_counter() - started
+
+        loaded = reminder_scheduler.refresh(now)
+        refresh = reminder_scheduler.refresh_seconds_last
+        probe_due = [entry[0] for entry in reminder_scheduler._heap if entry[2] == probe.id and entry[3] == 120]
+        assert probe_due == [now + timedelta(minutes=30)], f"2h reminder due at {probe_due}, expected now + 30 minutes"
+
+        # Walk the clock across the horizon, sending whatever has fallen due every few minutes
+        started = time.perf_counter()
+        sent = 0
+        probe_sent_at = None
+        for minute in range(0, args.horizon_minutes + 1, 5):
+            sent += reminder_scheduler.send_due(now + timedelta(minutes=minute))
+            if probe_sent_at is None and BookingReminder.query.filter_by(booking_id=probe.id, offset_minutes=120).count():
+                probe_sent_at = minute
+        sending = time.perf_counter() - started
+        assert probe_sent_at == 30, f"2h reminder sent after {probe_sent_at} minutes, expected 30"
+        ledger = BookingReminder.query.count()
+        emails = EmailOutbox.query.count()
+        metrics = reminder_scheduler.metrics()
+
+    print(f"bookings: {args.bookings} over {args.days} days ({paid} paid), horizon {args.horizon_minutes} min")
+    print(f"timezone: {args.timezone} (UTC{utc_offset.total_seconds() / 3600:+.0f}h); "
+          f"2h reminder of a flight 2h30m away sent after {probe_sent_at} minutes")
+    print(f"full poll of upcoming paid bookings: {len(upcoming)} rows in {full_poll * 1000:.0f}ms")
+    print(f"refresh: {loaded} reminders loaded in {refresh * 1000:.0f}ms")
+    print(f"sent: {sent} reminders in {metrics['batches']} batches, {sending:.2f}s "
+          f"({sent / sending if sending else 0:.0f}/s), ledger rows {ledger}, emails queued {emails}")
+    print(f"scheduler: {metrics}")
+    os.remove(db_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Request validation overhead per call.
+
+Times parsing a booking body inside a request context with the old approaches
+(a module-level reqparse parser, a parser rebuilt on every request as AdminLogin
+used to do, and the hand-written required-field loop with strptime) against the
+compiled Schema that the handlers now use.
+
+    python benchmarks/validation_overhead.py --iterations 20000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SCHEDULER_ENABLED', 'False')
+# Throwaway keys; the app refuses to start without them outside debug
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret')
+os.environ.setdefault('PASSWORD_RESET_SECRET', 'benchmark-reset-secret')
+
+BODY = {
+    'helicopter_id': 1, 'date': '2030-01-01', 'time': '10:00:00', 'purpose': 'Scenic tour',
+    'num_passengers': 3, 'original_amount': 45000, 'duration_minutes': 90,
+}
+
+def build_reqparse():
+    from flask_restful import reqparse
+    parser = reqparse.RequestParser()
+    parser.add_argument('helicopter_id', type=int, required=True)
+    parser.add_argument('date', type=str, required=True)
+    parser.add_argument('time', type=str, required=True)
+    parser.add_argument('purpose', type=str, required=True)
+    parser.add_argument('num_passengers', type=int, required=True)
+    parser.add_argument('original_amount', type=int, required=True)
+    parser.add_argument('duration_minutes', type=int)
+    return parser
+
+def hand_written():
+    from flask import request
+    data = request.get_json()
+    for field in ['helicopter_id', 'date', 'time', 'purpose', 'num_passengers', 'original_amount']:
+        if field not in data:
+            return {'message': f'{field} is required'}, 400
+    duration_minutes = data.get('duration_minutes')
+    if duration_minutes is not None and (not isinstance(duration_minutes, int) or not 0 < duration_minutes <= 720):
+        return {'message': 'invalid duration_minutes'}, 400
+    data['time'] = datetime.strptime(data['time'], '%H:%M:%S').time()
+    data['date'] = datetime.strptime(data['date'], '%Y-%m-%d').date()
+    return data
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+    from app import app
+    from bookings import booking_schema
+
+    module_parser = build_reqparse()
+    candidates = [
+        ('reqparse (module-level)', lambda: module_parser.parse_args()),
+        ('reqparse (rebuilt per request)', lambda: build_reqparse().parse_args()),
+        ('hand-written checks', hand_written),
+        ('compiled Schema', booking_schema.parse),
+    ]
+
+    print(f"{'approach':<32}{'us/call':>10}")
+    for name, parse in candidates:
+        # A fresh request context per call, as in a real request, so body caching does not help
+        contexts = [app.test_request_context('/booking', method='POST', json=BODY) for _ in range(args.iterations)]
+        elapsed = 0.0
+        for context in contexts:
+            with context:
+                started = time.perf_counter()
+                parse()
+                elapsed += time.perf_counter() - started
+        print(f"{name:<32}{elapsed / args.iterations * 1e6:>10.2f}")
+
+if __name__ == '__main__':
+    main()
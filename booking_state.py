@@ -0,0 +1,119 @@
+from sqlalchemy.orm.exc import StaleDataError
+from models import db, Booking
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Allowed booking.status changes; staying in the same status is always allowed
+STATUS_TRANSITIONS = {
+    'pending': {'negotiation', 'pending_payment', 'paid', 'cancelled', 'expired'},
+    'negotiation': {'pending_payment', 'cancelled', 'expired'},
+    'pending_payment': {'paid', 'cancelled', 'expired'},
+    'paid': {'confirmed'},
+    'confirmed': set(),
+    'cancelled': set(),
+    'expired': set(),
+}
+
+# Allowed booking.negotiation_status changes; staying in the same status is always allowed
+NEGOTIATION_TRANSITIONS = {
+    'none': {'requested'},
+    'requested': {'counter_offer', 'accepted', 'rejected'},
+    'counter_offer': {'accepted', 'rejected'},
+    'accepted': set(),
+    'rejected': set(),
+}
+
+# The only status a client may set through a plain booking update; payment and
+# negotiation outcomes are reached through their own flows
+CLIENT_STATUS_CHANGES = {'cancelled'}
+
+# Admin negotiation action -> (status, negotiation_status)
+ADMIN_NEGOTIATION_ACTIONS = {
+    'accept': ('pending_payment', 'accepted'),
+    'reject': ('cancelled', 'rejected'),
+    'counter': ('negotiation', 'counter_offer'),
+}
+
+class InvalidTransition(Exception):
+    """Raised when a booking cannot move to the requested state"""
+
+    def __init__(self, field, current, target):
+        self.field = field
+        self.current = current
+        self.target = target
+        super().__init__(f"Cannot change {field} from '{current}' to '{target}'")
+
+def _check(field, transitions, current, target):
+    if target is None or target == current:
+        return
+    if target not in transitions.get(current, set()):
+        raise InvalidTransition(field, current, target)
+
+def can_transition(booking, status=None, negotiation_status=None):
+    try:
+        _check('status', STATUS_TRANSITIONS, booking.status, status)
+        _check('negotiation_status', NEGOTIATION_TRANSITIONS, booking.negotiation_status, negotiation_status)
+        return True
+    except InvalidTransition:
+        return False
+
+def apply_transition(booking, status=None, negotiation_status=None):
+    """Move a booking to a new status and/or negotiation status, validating both first"""
+    _check('status', STATUS_TRANSITIONS, booking.status, status)
+    _check('negotiation_status', NEGOTIATION_TRANSITIONS, booking.negotiation_status, negotiation_status)
+    if status is not None:
+        booking.status = status
+    if negotiation_status is not None:
+        booking.negotiation_status = negotiation_status
+
+def client_may_set(booking, status=None, negotiation_status=None):
+    """Whether a client may make this status change through a plain booking update"""
+    if negotiation_status is not None and negotiation_status != booking.negotiation_status:
+        return False
+    return status is None or status == booking.status or status in CLIENT_STATUS_CHANGES
+
+def apply_admin_negotiation(booking, action, amount):
+    """Apply an admin accept/reject/counter, returning the amount it replaced"""
+    if action not in ADMIN_NEGOTIATION_ACTIONS:
+        raise ValueError('Invalid negotiation action')
+    if action != 'reject' and amount is None:
+        raise ValueError('An amount is required unless rejecting')
+    status, negotiation_status = ADMIN_NEGOTIATION_ACTIONS[action]
+    apply_transition(booking, status=status, negotiation_status=negotiation_status)
+    old_amount = booking.final_amount
+    if action != 'reject':
+        booking.final_amount = amount
+    return old_amount
+
+def version_mismatch(booking, expected_version):
+    """True when the client sent a version that is no longer current"""
+    if expected_version is None:
+        return False
+    return str(expected_version).strip('"') != str(booking.version)
+
+def commit_with_retry(booking, mutate, attempts=3):
+    """
+    Apply mutate(booking) and commit, re-reading and re-applying when another
+    request committed first. Used where the change must not be lost, e.g. after
+    a payment has been taken; InvalidTransition propagates if it no longer applies.
+    """
+    for attempt in range(attempts):
+        mutate(booking)
+        try:
+            db.session.commit()
+            return booking
+        except StaleDataError:
+            db.session.rollback()
+            logger.warning(f"Booking {booking.id} changed concurrently, retrying ({attempt + 1}/{attempts})")
+            db.session.refresh(booking)
+    raise StaleDataError(f"Booking {booking.id} kept changing after {attempts} attempts")
+
+def conflict_response(booking_id, message='Booking was modified by another request'):
+    """Roll back and return a 409 carrying the booking's current state"""
+    db.session.rollback()
+    current = Booking.query.get(booking_id)
+    return {
+        'message': message,
+        'booking': current.to_dict() if current else None
+    }, 409
@@ -1,32 +1,48 @@
 from flask_restful import Resource
 from flask import request, jsonify, current_app
-from datetime import datetime
-from models import db, Booking, Payment, Client, Admin, NegotiationHistory
-from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request, get_jwt
+from datetime import datetime, timedelta
+from models import (
+    db, Booking, Payment, Client, Admin, NegotiationHistory, Helicopter,
+    DEFAULT_FLIGHT_DURATION_MINUTES, MAX_FLIGHT_DURATION_MINUTES
+)
+from flask_jwt_extended import jwt_required, get_jwt
+from principal import current_principal
 from mpesa import format_phone_number, initiate_mpesa_payment, wait_for_payment_confirmation
-from firebase_notification import send_notification_to_user, send_notification_to_topic
-from email_utils import send_payment_receipt_email, send_booking_confirmation_email
-import re
+from notifications import notify_admins, ADMIN_TOPIC
+from device_tokens import register_device_token
+from topic_subscriptions import subscribe_tokens
+from email_utils import queue_payment_receipt_email
+from availability import fleet_calendar
+from booking_state import (
+    InvalidTransition, apply_transition, apply_admin_negotiation, can_transition, client_may_set,
+    commit_with_retry, conflict_response, version_mismatch
+)
+from validation import Schema, Field
+from sqlalchemy.orm.exc import StaleDataError
 import logging
 import time
 
 logger = logging.getLogger(__name__)
 
-def is_admin(user):
-    """Check if a user is an admin"""
-    if isinstance(user, Admin):
-        return True
-    elif isinstance(user, (int, str)):
-        return Admin.query.filter_by(id=user).first() is not None
-    return False
-
-def notify_admin(message):
-    """Send notification to all admins"""
-    send_notification_to_topic(
-        topic="admin_notifications",
-        title="Admin Notification",
-        body=message
-    )
+def check_schedule(helicopter_id, date_obj, time_obj, duration_minutes, num_passengers, exclude_booking_id=None):
+    """
+    Check a helicopter can take a flight, returning an error response or None.
+
+    The in-memory calendar answers most conflicts without a query; a free slot is
+    confirmed against the database since other workers may have booked it.
+    """
+    helicopter = Helicopter.query.get(helicopter_id)
+    if not helicopter:
+        return {'message': 'Helicopter not found'}, 404
+    if num_passengers > helicopter.capacity:
+        return {'message': f'Helicopter capacity is {helicopter.capacity} passengers'}, 400
+
+    start = datetime.combine(date_obj, time_obj)
+    end = start + timedelta(minutes=duration_minutes)
+    if not fleet_calendar.is_available(helicopter_id, start, end, exclude_booking_id=exclude_booking_id) \
+            or Booking.conflicting(helicopter_id, start, end, exclude_id=exclude_booking_id).first():
+        return {'message': 'Helicopter is already booked for the requested time'}, 409
+    return None
 
 def initiate_payment(booking, phone_number):
     """Initiate payment process with improved error handling"""
@@ -110,6 +126,53 @@ def confirm_payment(checkout_request_id, max_attempts=24, delay=5):
         'details': 'Payment verification timed out'
     }
 
+# The only columns the regular update path writes; prices, payment and bookkeeping columns have their own flows
+EDITABLE_FIELDS = ('helicopter_id', 'date', 'time', 'duration_minutes', 'num_passengers', 'purpose')
+
+PHONE_NUMBER_PATTERN = r'^\+?1?\d{9,15}$'
+
+# Request bodies
+booking_schema = Schema({
+    'helicopter_id': Field(int, required=True),
+    'date': Field('date', required=True),
+    'time': Field('time', required=True),
+    'purpose': Field(str, required=True, min_length=1),
+    'num_passengers': Field(int, required=True, min=1),
+    'original_amount': Field(int, required=True, min=0),
+    'duration_minutes': Field(int, nullable=True, min=1, max=MAX_FLIGHT_DURATION_MINUTES),
+})
+booking_update_schema = Schema({
+    'version': Field(int, nullable=True),
+    'helicopter_id': Field(int),
+    'date': Field('date'),
+    'time': Field('time'),
+    'purpose': Field(str, min_length=1),
+    'num_passengers': Field(int, min=1),
+    'duration_minutes': Field(int, min=1, max=MAX_FLIGHT_DURATION_MINUTES),
+    'status': Field(str, nullable=True),
+    'negotiation_status': Field(str, nullable=True),
+})
+direct_payment_schema = Schema({
+    'phone_number': Field(str, required=True, min_length=1),
+})
+admin_negotiation_schema = Schema({
+    'negotiation_action': Field(str, required=True, choices=('accept', 'reject', 'counter')),
+    # Only a reject may leave the price out; apply_admin_negotiation enforces that per action
+    'final_amount': Field(int, required=True, nullable=True, min=0),
+    'notes': Field(str, required=True, nullable=True),
+})
+client_negotiation_schema = Schema({
+    'negotiated_amount': Field(int, required=True, min=0),
+    'notes': Field(str, required=True, nullable=True),
+})
+negotiated_payment_schema = Schema({
+    'phone_number': Field(str, required=True, pattern=PHONE_NUMBER_PATTERN,
+                          pattern_message='is not a valid phone number'),
+})
+fcm_token_schema = Schema({
+    'token': Field(str, required=True, min_length=1),
+})
+
 class BookingsResource(Resource):
     @jwt_required()
     def get(self, id=None):
@@ -118,14 +181,12 @@ class BookingsResource(Resource):
             auth_header = request.headers.get('Authorization')
             logger.info(f"Auth header: {auth_header}")
             
-            verify_jwt_in_request()
-            user_id = get_jwt_identity()
+            principal = current_principal()
+            user_id = principal.id
             logger.info(f"User ID from token: {user_id}")
             
             if id is None:
-                # Check if user is admin
-                admin = Admin.query.get(user_id)
-                if admin:
+                if principal.is_admin:
                     logger.info(f"Admin user {user_id} fetching all bookings")
                     bookings = Booking.query.all()
                 else:
@@ -134,8 +195,7 @@ class BookingsResource(Resource):
                 return jsonify([booking.as_dict() for booking in bookings])
             
             booking = Booking.query.get_or_404(id)
-            admin = Admin.query.get(user_id)
-            if not admin and booking.client_id != user_id:
+            if not principal.can_access(booking):
                 return {"error": "Unauthorized"}, 403
             
             return jsonify(booking.as_dict())
@@ -145,20 +205,24 @@ class BookingsResource(Resource):
 
     @jwt_required()
     def post(self):
-        current_user_id = get_jwt_identity()
-        data = request.get_json()
-        required_fields = ['helicopter_id', 'date', 'time', 'purpose', 'num_passengers', 'original_amount']
-        for field in required_fields:
-            if field not in data:
-                return {'message': f'{field} is required'}, 400
+        current_user_id = current_principal().id
+        data = booking_schema.parse()
+        duration_minutes = data.get('duration_minutes')
+        time_obj = data['time']
+        date_obj = data['date']
+        error = check_schedule(
+            data['helicopter_id'], date_obj, time_obj,
+            duration_minutes or DEFAULT_FLIGHT_DURATION_MINUTES, data['num_passengers']
+        )
+        if error:
+            return error
         try:
-            time_obj = datetime.strptime(data['time'], '%H:%M:%S').time()
-            date_obj = datetime.strptime(data['date'], '%Y-%m-%d').date()
             booking = Booking(
                 client_id=current_user_id,
                 helicopter_id=data['helicopter_id'],
                 date=date_obj,
                 time=time_obj,
+                duration_minutes=duration_minutes or DEFAULT_FLIGHT_DURATION_MINUTES,
                 purpose=data['purpose'],
                 num_passengers=data['num_passengers'],
                 original_amount=data['original_amount'],
@@ -167,8 +231,9 @@ class BookingsResource(Resource):
                 negotiation_status='none'
             )
             db.session.add(booking)
+            db.session.flush()
+            notify_admins(f"New booking #{booking.id} created")
             db.session.commit()
-            notify_admin(f"New booking #{booking.id} created")
             return {
                 'message': 'Booking created successfully. Please proceed with payment or negotiation.',
                 'booking': booking.to_dict()
@@ -179,40 +244,53 @@ class BookingsResource(Resource):
 
     @jwt_required()
     def put(self, id):
-        current_user_id = get_jwt_identity()
+        principal = current_principal()
+        current_user_id = principal.id
         booking = Booking.query.get_or_404(id)
-        if not is_admin(current_user_id) and booking.client_id != current_user_id:
+        if not principal.can_access(booking):
             return {"error": "Unauthorized"}, 403
-        data = request.get_json()
+        data = request.get_json(silent=True)
 
         # Payment
-        if "payment" in data and data["payment"]:
-            return self._handle_direct_payment(booking, data)
+        if isinstance(data, dict) and data.get("payment"):
+            body = direct_payment_schema.validate(data)
+            handler = lambda: self._handle_direct_payment(booking, body)
 
         # Admin negotiation
-        if is_admin(current_user_id) and "negotiation_action" in data:
-            return self._handle_admin_negotiation_action(booking, data, current_user_id)
+        elif principal.is_admin and isinstance(data, dict) and "negotiation_action" in data:
+            body = admin_negotiation_schema.validate(data)
+            handler = lambda: self._handle_admin_negotiation_action(booking, body, current_user_id)
 
         # Client negotiation request
-        if "negotiation_request" in data:
-            return self._handle_client_negotiation_request(booking, data, current_user_id)
+        elif isinstance(data, dict) and "negotiation_request" in data:
+            body = client_negotiation_schema.validate(data)
+            handler = lambda: self._handle_client_negotiation_request(booking, body, current_user_id)
 
         # Client counter offer
-        if "counter_offer" in data:
-            return self._handle_client_counter_offer(booking, data, current_user_id)
+        elif isinstance(data, dict) and "counter_offer" in data:
+            body = client_negotiation_schema.validate(data)
+            handler = lambda: self._handle_client_counter_offer(booking, body, current_user_id)
 
         # Regular update
-        return self._handle_regular_update(booking, data)
+        else:
+            body = booking_update_schema.validate(data)
+            handler = lambda: self._handle_regular_update(booking, body, principal.is_admin)
+
+        # Reject edits made against a stale copy (version in the body or an If-Match header)
+        expected_version = data.get('version') or request.headers.get('If-Match')
+        if version_mismatch(booking, expected_version):
+            return conflict_response(booking.id, 'Booking has changed since it was read')
+
+        return handler()
 
     def _handle_direct_payment(self, booking, data):
+        booking_id = booking.id
         try:
-            if not data.get('phone_number'):
-                return {'message': 'Phone number is required'}, 400
             if booking.status == 'paid':
                 return {'message': 'Booking is already paid'}, 400
             if booking.status == 'cancelled':
                 return {'message': 'Cannot process payment for a cancelled booking'}, 400
-            if booking.status not in ['pending_payment', 'pending']:
+            if booking.status not in ['pending_payment', 'pending'] or not can_transition(booking, status='paid'):
                 return {'message': 'Booking is not in a payable state'}, 400
 
             formatted_phone = format_phone_number(data['phone_number'])
@@ -240,31 +318,41 @@ class BookingsResource(Resource):
             # Now confirm payment using the real CheckoutRequestID
             payment_status = confirm_payment(checkout_request_id)
             if payment_status['status'] == 'success':
-                payment.payment_status = 'success'
-                booking.status = 'paid'
-                db.session.commit()
-                logger.info("About to send payment receipt email...")
+                # The payment has been taken, so re-apply rather than fail if the booking moved on meanwhile
+                # The receipt is queued in the same transaction and sent in the background
                 client = Client.query.get(booking.client_id)
-                logger.info(f"Client email: {getattr(client, 'email', None)}")
-                send_payment_receipt_email(booking, payment, client)
+                def mark_paid(booking):
+                    payment.payment_status = 'success'
+                    booking.payment_id = payment.id
+                    apply_transition(booking, status='paid')
+                    queue_payment_receipt_email(booking, payment, client)
+                commit_with_retry(booking, mark_paid)
                 return {'message': 'Payment successful', 'booking': booking.to_dict()}, 200
             else:
                 payment.payment_status = 'failed'
                 db.session.commit()
                 return {'message': f'Payment failed: {payment_status}', 'booking': booking.to_dict()}, 400
+        except InvalidTransition as e:
+            logger.error(f"Payment taken for booking {booking_id} that can no longer be paid: {str(e)}")
+            return conflict_response(booking_id, str(e))
+        except StaleDataError:
+            return conflict_response(booking_id)
         except Exception as e:
             db.session.rollback()
             return {'message': f'Payment failed: {str(e)}'}, 500
 
     def _handle_admin_negotiation_action(self, booking, data, admin_id):
+        booking_id = booking.id
         try:
-            required_fields = ['negotiation_action', 'final_amount', 'notes']
-            if not all(field in data for field in required_fields):
-                return {'message': 'Missing required fields'}, 400
+            try:
+                old_amount = apply_admin_negotiation(booking, data['negotiation_action'], data['final_amount'])
+            except ValueError as e:
+                return {'message': str(e)}, 400
 
             negotiation = NegotiationHistory(
                 booking_id=booking.id,
                 action=data['negotiation_action'],
+                old_amount=old_amount,
                 new_amount=data['final_amount'],
                 notes=data['notes'],
                 user_id=admin_id,
@@ -272,37 +360,27 @@ class BookingsResource(Resource):
             )
             db.session.add(negotiation)
 
-            if data['negotiation_action'] == 'accept':
-                booking.status = 'pending_payment'
-                booking.negotiation_status = 'accepted'
-                booking.final_amount = data['final_amount']
-            elif data['negotiation_action'] == 'reject':
-                booking.status = 'cancelled'
-                booking.negotiation_status = 'rejected'
-            elif data['negotiation_action'] == 'counter':
-                booking.status = 'negotiation'
-                booking.negotiation_status = 'counter_offer'
-                booking.final_amount = data['final_amount']
-            else:
-                return {'message': 'Invalid negotiation action'}, 400
-
             db.session.commit()
             # ...notify client...
             return {'message': 'Negotiation action processed successfully', 'booking': booking.to_dict()}, 200
+        except InvalidTransition as e:
+            return conflict_response(booking_id, str(e))
+        except StaleDataError:
+            return conflict_response(booking_id)
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error handling negotiation action: {str(e)}")
             return {'message': str(e)}, 500
 
     def _handle_client_counter_offer(self, booking, data, client_id):
+        booking_id = booking.id
         try:
-            required_fields = ['negotiated_amount', 'notes']
-            if not all(field in data for field in required_fields):
-                return {'message': 'Missing required fields'}, 400
+            apply_transition(booking, status='negotiation', negotiation_status='counter_offer')
 
             negotiation = NegotiationHistory(
                 booking_id=booking.id,
                 action='counter',
+                old_amount=booking.final_amount,
                 new_amount=data['negotiated_amount'],
                 notes=data['notes'],
                 user_id=client_id,
@@ -310,27 +388,29 @@ class BookingsResource(Resource):
             )
             db.session.add(negotiation)
 
-            booking.status = 'negotiation'
-            booking.negotiation_status = 'counter_offer'
             booking.final_amount = data['negotiated_amount']
 
             db.session.commit()
             # ...notify admin...
             return {'message': 'Counter offer submitted successfully', 'booking': booking.to_dict()}, 200
+        except InvalidTransition as e:
+            return conflict_response(booking_id, str(e))
+        except StaleDataError:
+            return conflict_response(booking_id)
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error handling client counter offer: {str(e)}")
             return {'message': str(e)}, 500
 
     def _handle_client_negotiation_request(self, booking, data, client_id):
+        booking_id = booking.id
         try:
-            required_fields = ['negotiated_amount', 'notes']
-            if not all(field in data for field in required_fields):
-                return {'message': 'Missing required fields'}, 400
+            apply_transition(booking, status='negotiation', negotiation_status='requested')
 
             negotiation = NegotiationHistory(
                 booking_id=booking.id,
                 action='request',
+                old_amount=booking.final_amount,
                 new_amount=data['negotiated_amount'],
                 notes=data['notes'],
                 user_id=client_id,
@@ -338,150 +418,69 @@ class BookingsResource(Resource):
             )
             db.session.add(negotiation)
 
-            booking.status = 'negotiation'
-            booking.negotiation_status = 'requested'
             booking.final_amount = data['negotiated_amount']
 
             db.session.commit()
             # ...notify admin...
             return {'message': 'Negotiation request submitted successfully', 'booking': booking.to_dict()}, 200
+        except InvalidTransition as e:
+            return conflict_response(booking_id, str(e))
+        except StaleDataError:
+            return conflict_response(booking_id)
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error handling client negotiation request: {str(e)}")
             return {'message': str(e)}, 500
 
-    def _handle_regular_update(self, booking, data):
+    def _handle_regular_update(self, booking, data, is_admin=False):
         """Handle regular booking updates"""
+        booking_id = booking.id
+        # Clients pay and negotiate through their own actions; here they may only cancel
+        if not is_admin and not client_may_set(booking, data.get('status'), data.get('negotiation_status')):
+            return {'message': 'Clients can only cancel a booking this way'}, 403
         try:
+            # State changes go through the transition table; bookkeeping columns are never client-editable
+            apply_transition(booking, status=data.pop('status', None),
+                             negotiation_status=data.pop('negotiation_status', None))
+            data = {field: data[field] for field in EDITABLE_FIELDS if field in data}
+
+            # Re-check availability when any schedule field changes (already parsed by the schema)
+            schedule_fields = ('date', 'time', 'duration_minutes', 'helicopter_id', 'num_passengers')
+            if any(field in data for field in schedule_fields):
+                error = check_schedule(
+                    data.get('helicopter_id', booking.helicopter_id),
+                    data.get('date', booking.date),
+                    data.get('time', booking.time),
+                    data.get('duration_minutes', booking.duration_minutes),
+                    data.get('num_passengers', booking.num_passengers),
+                    exclude_booking_id=booking.id
+                )
+                if error:
+                    return error
+
             # Update booking fields
             for key, value in data.items():
-                if hasattr(booking, key):
-                    setattr(booking, key, value)
+                setattr(booking, key, value)
             
             db.session.commit()
             return {'message': 'Booking updated successfully', 'booking': booking.to_dict()}, 200
-            
+
+        except InvalidTransition as e:
+            return conflict_response(booking_id, str(e))
+        except StaleDataError:
+            return conflict_response(booking_id)
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error updating booking: {str(e)}")
             return {'message': str(e)}, 500
 
-class PaymentResource(Resource):
-    @jwt_required()
-    def post(self):
-        try:
-            verify_jwt_in_request()
-            user_id = get_jwt_identity()
-            
-            data = request.get_json()
-            
-            # Validate required fields
-            required_fields = ['booking_id', 'phone_number']
-            if not all(field in data for field in required_fields):
-                return {"error": "Missing required fields"}, 400
-            
-            booking_id = data['booking_id']
-            phone_number = data['phone_number']
-            
-            # Get booking
-            booking = Booking.query.get_or_404(booking_id)
-            
-            # Check if user is authorized
-            if not is_admin(user_id) and booking.client_id != user_id:
-                return {"error": "Unauthorized"}, 403
-            
-            # Check if booking is already paid
-            if booking.status == 'paid':
-                return {'message': 'Booking is already paid'}, 400
-                
-            # Check if booking is cancelled
-            if booking.status == 'cancelled':
-                return {'message': 'Cannot process payment for a cancelled booking'}, 400
-                
-            # Check if booking is expired
-            if booking.status == 'expired':
-                return {'message': 'Cannot process payment for an expired booking'}, 400
-                
-            # Check if booking is pending payment
-            if booking.status != 'pending_payment':
-                return {'message': 'Booking is not in pending payment status'}, 400
-                
-            # Format phone number for M-Pesa
-            formatted_phone = format_phone_number(phone_number)
-            
-            # Initiate M-Pesa payment
-            try:
-                logger.info(f"Initiating M-Pesa payment for booking {booking.id} with phone {formatted_phone}")
-                mpesa_response = initiate_mpesa_payment(booking.final_amount, formatted_phone)
-                
-                # Check for M-Pesa specific error codes
-                if mpesa_response.get('ResponseCode') != '0':
-                    error_msg = mpesa_response.get('ResponseDescription', 'Unknown M-Pesa error')
-                    logger.error(f"M-Pesa error: {error_msg}")
-                    return {'message': f'Payment initiation failed: {error_msg}'}, 400
-                
-                # Get checkout request ID
-                checkout_request_id = mpesa_response.get('CheckoutRequestID')
-                if not checkout_request_id:
-                    logger.error("No CheckoutRequestID in M-Pesa response")
-                    return {'message': 'Payment initiation failed: No checkout request ID received'}, 500
-                
-                # Update booking with checkout request ID
-                booking.checkout_request_id = checkout_request_id
-                booking.payment_phone = formatted_phone
-                booking.payment_status = 'pending'
-                db.session.commit()
-                
-                # Wait for payment confirmation
-                logger.info(f"Waiting for payment confirmation for booking {booking.id}")
-                payment_status = wait_for_payment_confirmation(checkout_request_id)
-                
-                # Handle payment status
-                if payment_status.get('status') == 'success':
-                    # Update booking status
-                    booking.status = 'paid'
-                    booking.payment_status = 'completed'
-                    booking.payment_date = datetime.now()
-                    db.session.commit()
-                    
-                    # Send payment receipt email
-                    client = Client.query.get(booking.client_id)
-                    send_payment_receipt_email(booking, booking, client)
-                    
-                    # Notify admin
-                    notify_admin(f"Payment received for booking #{booking.id}")
-                    
-                    return {'message': 'Payment successful', 'booking': booking.to_dict()}, 200
-                elif payment_status.get('status') == 'failed':
-                    # Update booking payment status
-                    booking.payment_status = 'failed'
-                    db.session.commit()
-                    
-                    error_details = payment_status.get('details', {})
-                    error_message = error_details.get('ResultDesc', 'Payment failed')
-                    
-                    return {'message': f'Payment failed: {error_message}'}, 400
-                else:
-                    # Payment is still pending or error occurred
-                    return {'message': 'Payment is still pending. Please check your phone for the M-Pesa prompt.'}, 200
-                    
-            except Exception as e:
-                logger.error(f"Error processing M-Pesa payment: {str(e)}")
-                return {'message': f'Payment processing error: {str(e)}'}, 500
-                
-        except Exception as e:
-            logger.error(f"Unexpected error in PaymentResource.post: {str(e)}")
-            db.session.rollback()
-            return {'message': f'Unexpected error: {str(e)}'}, 500
-
 class NegotiatedPaymentResource(Resource):
     @jwt_required()
     def post(self, booking_id):
-        current_user_id = str(get_jwt_identity())  # Convert to string for comparison
         booking = Booking.query.get_or_404(booking_id)
         
         # Verify authorization
-        if current_user_id != str(booking.client_id):  # Convert both to string for comparison
+        if not current_principal().owns(booking):
             return {'message': 'Unauthorized'}, 403
             
         # Verify booking status
@@ -489,15 +488,7 @@ class NegotiatedPaymentResource(Resource):
             return {'message': 'Booking is not in the correct state for payment'}, 400
             
         # Get request data
-        data = request.get_json()
-        if not data or 'phone_number' not in data:
-            return {'message': 'Phone number is required'}, 400
-            
-        phone_number = data['phone_number']
-        
-        # Validate phone number format
-        if not re.match(r'^\+?1?\d{9,15}$', phone_number):
-            return {'message': 'Invalid phone number format'}, 400
+        phone_number = negotiated_payment_schema.parse()['phone_number']
             
         try:
             # Initiate payment
@@ -510,20 +501,16 @@ class NegotiatedPaymentResource(Resource):
             
             # Check if payment was successful
             if payment_status['status'] == 'success':
-                # Update payment status
-                payment.payment_status = 'success'
-                booking.payment_id = payment.id  # Link payment to booking
-                
-                # Update booking status
-                booking.status = 'paid'
-                db.session.commit()
-                
-                # Send payment receipt email
+                # Update payment and booking status, re-applying if the booking changed meanwhile
+                # The receipt is queued in the same transaction and sent in the background
                 client = Client.query.get(booking.client_id)
-                send_payment_receipt_email(booking, payment, client)
-                
-                # Notify admin
-                notify_admin(f"Payment received for booking #{booking.id}")
+                def mark_paid(booking):
+                    payment.payment_status = 'success'
+                    booking.payment_id = payment.id  # Link payment to booking
+                    apply_transition(booking, status='paid')
+                    notify_admins(f"Payment received for booking #{booking.id}")
+                    queue_payment_receipt_email(booking, payment, client)
+                commit_with_retry(booking, mark_paid)
                 
                 return {
                     'message': 'Payment successful',
@@ -540,7 +527,12 @@ class NegotiatedPaymentResource(Resource):
                     'booking': booking.to_dict(),
                     'payment': payment.to_dict()
                 }, 400
-                
+
+        except InvalidTransition as e:
+            logger.error(f"Payment taken for booking {booking_id} that can no longer be paid: {str(e)}")
+            return conflict_response(booking_id, str(e))
+        except StaleDataError:
+            return conflict_response(booking_id)
         except Exception as e:
             db.session.rollback()
             return {'message': f'Payment failed: {str(e)}'}, 500
@@ -548,39 +540,26 @@ class NegotiatedPaymentResource(Resource):
 class FCMTokenResource(Resource):
     @jwt_required()
     def post(self):
+        data = fcm_token_schema.parse()
         try:
-            current_user_id = get_jwt_identity()
-            logger.info(f"Updating FCM token for user {current_user_id}")
+            principal = current_principal()
+            user_id = principal.id
+            logger.info(f"Registering FCM token for user {user_id}")
             
-            data = request.get_json()
-            if not data or "token" not in data:
-                return {"error": "FCM token is required"}, 400
+            token = data["token"]
             
-            # Convert string ID to int for database query
-            user_id = int(current_user_id)
-            token = str(data["token"])
-            
-            # Update token for client or admin
-            client = Client.query.filter_by(id=user_id).first()
-            if client:
-                # Store token for client
-                client.fcm_token = token
-                logger.info(f"Updated FCM token for client {user_id}: {token}")
+            # Each device registers its own token, tied to this login session so logout silences it
+            if principal.is_client and principal.row:
+                register_device_token(principal.row, token, get_jwt().get('fam'))
+                logger.info(f"Registered device token for client {user_id}")
             else:
-                admin = Admin.query.filter_by(id=user_id).first()
+                admin = principal.row if principal.is_admin else None
                 if admin:
-                    # Store token for admin
-                    admin.fcm_token = token
-                    logger.info(f"Updated FCM token for admin {user_id}: {token}")
+                    register_device_token(admin, token, get_jwt().get('fam'))
+                    logger.info(f"Registered device token for admin {user_id}")
                     
-                    # Subscribe admin to admin notifications topic
-                    send_notification_to_topic(
-                        topic="admin_notifications",
-                        title="Admin Notifications",
-                        body="You are now subscribed to admin notifications",
-                        data={"type": "admin_subscription"}
-                    )
-                    logger.info(f"Subscribed admin {user_id} to admin notifications topic")
+                    # Joins the admin topic at the next topic sync
+                    subscribe_tokens([token], ADMIN_TOPIC)
                 else:
                     logger.error(f"User not found: {user_id}")
                     return {"error": "User not found"}, 404
@@ -589,6 +568,7 @@ class FCMTokenResource(Resource):
             return {"message": "FCM token updated successfully"}, 200
             
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error updating FCM token: {str(e)}")
             return {"error": "Error updating FCM token"}, 500
 
@@ -596,11 +576,10 @@ class BookingStatusResource(Resource):
     @jwt_required()
     def get(self, booking_id):
         try:
-            current_user_id = get_jwt_identity()
             booking = Booking.query.get_or_404(booking_id)
             
             # Verify authorization
-            if not is_admin(current_user_id) and booking.client_id != current_user_id:
+            if not current_principal().can_access(booking):
                 return {"error": "Unauthorized"}, 403
             
             # Get associated payment if it exists
@@ -631,72 +610,13 @@ class BookingStatusResource(Resource):
 class NegotiationHistoryResource(Resource):
     @jwt_required()
     def get(self, booking_id):
-        current_user_id = get_jwt_identity()
         booking = Booking.query.get_or_404(booking_id)
         
         # Verify authorization
-        if not is_admin(current_user_id) and booking.client_id != current_user_id:
+        if not current_principal().can_access(booking):
             return {"error": "Unauthorized"}, 403
             
         history = NegotiationHistory.query.filter_by(booking_id=booking_id)\
             .order_by(NegotiationHistory.created_at.asc()).all()
             
         return jsonify([item.to_dict() for item in history])
-
-class PaymentConfirmationResource(Resource):
-    @jwt_required()
-    def get(self, checkout_request_id):
-        """Check payment status endpoint"""
-        try:
-            verify_jwt_in_request()
-            user_id = get_jwt_identity()
-            
-            # Find booking by checkout request ID
-            booking = Booking.query.filter_by(checkout_request_id=checkout_request_id).first()
-            if not booking:
-                return {"error": "Booking not found"}, 404
-                
-            # Check authorization
-            if not is_admin(user_id) and booking.client_id != user_id:
-                return {"error": "Unauthorized"}, 403
-                
-            # Check payment status
-            payment = Payment.query.get(booking.payment_id)
-            checkout_request_id = payment.checkout_request_id  # This is the string from M-Pesa
-            payment_verification = wait_for_payment_confirmation(checkout_request_id)
-            
-            if payment_verification['status'] == 'success':
-                # Update booking status
-                booking.status = 'paid'
-                booking.payment_status = 'completed'
-                # booking.payment_date = datetime.now()  # Uncomment if your model supports this
-                db.session.commit()
-                
-                # Send notifications
-                client = Client.query.get(booking.client_id)
-                if client:
-                    send_payment_receipt_email(booking, booking, client)
-                    send_booking_confirmation_email(booking, client)
-                    notify_admin(f"Payment completed for booking #{booking.id}")
-                
-                return {
-                    'status': 'success',
-                    'message': 'Payment confirmed',
-                    'booking': booking.as_dict()
-                }, 200
-                
-            elif payment_verification['status'] == 'pending':
-                return {
-                    'status': 'pending',
-                    'message': 'Payment still processing'
-                }, 202
-                
-            else:  # failed or error
-                return {
-                    'status': 'failed',
-                    'message': payment_verification.get('details', 'Payment failed')
-                }, 400
-                
-        except Exception as e:
-            logger.error(f"Payment confirmation error: {str(e)}")
-            return {"error": str(e)}, 500
\ No newline at end of file
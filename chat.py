@@ -1,9 +1,12 @@
 from flask import Blueprint, jsonify
-from flask_restful import Api, Resource, reqparse
+from flask_restful import Api, Resource
 from models import db, ChatMessage, Booking, Client, Admin
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from principal import current_principal
+from validation import Schema, Field
 from datetime import datetime
-from firebase_notification import send_notification_to_user, send_notification_to_topic
+from notifications import enqueue_coalesced, ADMIN_TOPIC
+from device_tokens import device_tokens_for
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,58 +14,42 @@ logger = logging.getLogger(__name__)
 chat_bp = Blueprint('chat_bp', __name__)
 chat_api = Api(chat_bp)
 
-def is_admin(user_id):
-    """Check if the user is an admin by checking if they exist in the Admin table"""
-    try:
-        # Convert user_id to integer if it's a string
-        admin_id = int(user_id) if isinstance(user_id, str) else user_id
-        
-        # First check if this user exists in the Client table
-        client = Client.query.get(admin_id)
-        if client is not None:
-            return False  # If they're in the Client table, they're not an admin
-        
-        # Then check the Admin table
-        admin = Admin.query.get(admin_id)
-        return admin is not None
-    except (ValueError, TypeError):
-        logger.error(f"Invalid user_id format: {user_id}")
-        return False
-
-chat_args = reqparse.RequestParser()
-chat_args.add_argument('message', type=str, required=True, help='Message is required')
+chat_message_schema = Schema({
+    'message': Field(str, required=True, min_length=1),
+})
 
 class ChatResource(Resource):
     @jwt_required()
     def post(self, booking_id):
         """Send a chat message"""
-        data = chat_args.parse_args()
-        user_id = get_jwt_identity()
+        data = chat_message_schema.parse()
+        principal = current_principal()
+        user_id = principal.id
         
         # Verify authorization
         booking = Booking.query.get_or_404(booking_id)
-        if not is_admin(user_id) and booking.client_id != int(user_id):
+        if not principal.can_access(booking):
             return {"error": "Unauthorized"}, 403
         
         # Determine if the sender is an admin
-        sender_type = 'admin' if is_admin(user_id) else 'client'
+        sender_type = principal.type
         logger.debug(f"Message sender type: {sender_type}, user_id: {user_id}")
         
-        # Get sender name and role
+        # Get sender name and role (one lookup of the principal's own row)
         if sender_type == "admin":
-            admin = Admin.query.get(user_id)
-            logger.debug(f"Admin info - ID: {admin.id}, Name: {admin.name}, Is Superadmin: {admin.is_superadmin if admin else False}")
-            sender_name = admin.name if admin else "Admin"
+            admin = principal.snapshot
+            logger.debug(f"Admin info - ID: {user_id}, Is Superadmin: {principal.is_superadmin}")
+            sender_name = admin['name'] if admin else "Admin"
             # Don't include 'Admin' in the name if it's already in the role
             if sender_name == "Super Admin" or sender_name == "Admin":
                 sender_name = "System"
-            sender_role = "Super Admin" if admin and admin.is_superadmin else "Admin"
+            sender_role = "Super Admin" if principal.is_superadmin else "Admin"
             display_name = f"{sender_role}: {sender_name}"
             logger.debug(f"Admin display info - Name: {sender_name}, Role: {sender_role}, Display: {display_name}")
         else:
-            client = Client.query.get(user_id)
-            logger.debug(f"Client info - ID: {client.id if client else None}, Name: {client.name if client else 'Unknown'}")
-            sender_name = client.name if client else "User"
+            client = principal.snapshot
+            logger.debug(f"Client info - ID: {user_id}, Name: {client['name'] if client else 'Unknown'}")
+            sender_name = client['name'] if client else "User"
             display_name = sender_name
             logger.debug(f"Client display info - Name: {sender_name}, Display: {display_name}")
         
@@ -75,14 +62,14 @@ class ChatResource(Resource):
         )
         logger.debug(f"Creating chat message - Booking: {booking_id}, Sender: {user_id}, Type: {sender_type}, Message: {data['message']}")
         db.session.add(chat_message)
-        db.session.commit()
-        logger.debug(f"Chat message created with ID: {chat_message.id}")
         
-        # Send notifications based on sender type
+        # Queue notifications based on sender type; they are committed with the message, and a
+        # burst of messages on one booking reaches each recipient as a single "N new messages" push
         if sender_type == 'admin':
-            # Send notification to client
-            client = Client.query.get(booking.client_id)
-            if client and client.fcm_token:
+            # Send notification to each of the client's devices
+            client_subject = f"c:{booking.client_id}"
+            devices = device_tokens_for([client_subject]).get(client_subject, [])
+            if devices:
                 # Ensure all values in notification data are strings
                 notification_data = {
                     'type': 'chat_message',
@@ -93,13 +80,18 @@ class ChatResource(Resource):
                     'timestamp': datetime.utcnow().isoformat(),
                     'role': 'user'  # For client view
                 }
-                logger.debug(f"Sending client notification - Data: {notification_data}")
-                send_notification_to_user(
-                    client.fcm_token,
-                    f"New message from {display_name}",
-                    data['message'],
-                    notification_data
-                )
+                logger.debug(f"Queueing client notification - Data: {notification_data}")
+                for device in devices:
+                    enqueue_coalesced(
+                        f"chat:{booking_id}:device:{device.id}",
+                        'token',
+                        device.token,
+                        f"New message from {display_name}",
+                        data['message'],
+                        notification_data,
+                        summary_title=f"Booking #{booking_id}",
+                        subject=client_subject
+                    )
         else:
             # Send notification to all admins
             # Ensure all values in notification data are strings
@@ -112,14 +104,20 @@ class ChatResource(Resource):
                 'timestamp': datetime.utcnow().isoformat(),
                 'role': 'admin'  # For admin view
             }
-            logger.debug(f"Sending admin notification - Data: {notification_data}")
-            send_notification_to_topic(
-                'admin_notifications',
+            logger.debug(f"Queueing admin notification - Data: {notification_data}")
+            enqueue_coalesced(
+                f"chat:{booking_id}:admins",
+                'topic',
+                ADMIN_TOPIC,
                 f"New message from {sender_name}",
                 data['message'],
-                notification_data
+                notification_data,
+                summary_title=f"Booking #{booking_id}"
             )
         
+        db.session.commit()
+        logger.debug(f"Chat message created with ID: {chat_message.id}")
+        
         return {
             'message': 'Message sent successfully',
             'chat_message': {
@@ -136,11 +134,9 @@ class ChatResource(Resource):
     @jwt_required()
     def get(self, booking_id):
         """Get chat messages for a booking"""
-        user_id = get_jwt_identity()
-        
         # Verify authorization
         booking = Booking.query.get_or_404(booking_id)
-        if not is_admin(user_id) and booking.client_id != int(user_id):
+        if not current_principal().can_access(booking):
             return {"error": "Unauthorized"}, 403
         
         # Get chat messages for the booking
@@ -177,13 +173,14 @@ class ChatReadResource(Resource):
     def put(self, booking_id):
         """Mark all messages in a booking as read"""
         try:
-            current_user_id = get_jwt_identity()
+            principal = current_principal()
+            current_user_id = principal.id
             logger.info(f"Marking messages as read for booking {booking_id} by user {current_user_id}")
             
             booking = Booking.query.get_or_404(booking_id)
             
             # Verify authorization
-            if not is_admin(current_user_id) and booking.client_id != int(current_user_id):
+            if not principal.can_access(booking):
                 logger.error(f"Unauthorized access attempt to booking {booking_id} by user {current_user_id}")
                 return {"error": "Unauthorized"}, 403
                 
@@ -214,10 +211,11 @@ class NegotiationChatsResource(Resource):
     @jwt_required()
     def get(self):
         """Get all bookings with active negotiations"""
-        current_user_id = get_jwt_identity()
+        principal = current_principal()
+        current_user_id = principal.id
         
         # Get all bookings with active negotiations
-        if is_admin(current_user_id):
+        if principal.is_admin:
             # Admin sees all bookings with active negotiations
             bookings = Booking.query.filter(
                 Booking.negotiation_status.in_(['requested', 'counter_offer'])
@@ -236,11 +234,12 @@ class UnreadChatsResource(Resource):
     def get(self):
         """Get count of unread chat messages for the current user"""
         try:
-            current_user_id = get_jwt_identity()
+            principal = current_principal()
+            current_user_id = principal.id
             logger.info(f"Getting unread count for user {current_user_id}")
             
             # Check if user is admin or client
-            is_admin_user = is_admin(current_user_id)
+            is_admin_user = principal.is_admin
             logger.info(f"User {current_user_id} is_admin: {is_admin_user}")
             
             if is_admin_user:
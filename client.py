@@ -2,6 +2,18 @@ from models import Client,db
 from flask_restful import Resource
 from flask import Flask,make_response,request,jsonify
 from flask_jwt_extended import jwt_required
+from validation import Schema, Field
+
+client_schema = Schema({
+    'name': Field(str, required=True, min_length=1),
+    'email': Field(str, required=True, min_length=1),
+    'phone_number': Field(str, required=True, min_length=1),
+})
+client_update_schema = Schema({
+    'name': Field(str, min_length=1),
+    'email': Field(str, min_length=1),
+    'phone_number': Field(str, min_length=1),
+})
 
 
 class ClientResource(Resource):
@@ -17,11 +29,8 @@ class ClientResource(Resource):
         return make_response(jsonify(client_id),200)
     
     @jwt_required()
-    def post():
-        data = request.get_json()
-
-        if not data or "name" not in data or "email" not in data or "phone_number" not in data:
-            return jsonify({"message": "Missing required fields"}),200
+    def post(self):
+        data = client_schema.parse()
 
         new_client = Client(
             # id = data["id"],
@@ -39,12 +48,11 @@ class ClientResource(Resource):
     
     @jwt_required()
     def put(self,id):
+        data = client_update_schema.parse()
         up_client = Client.query.get(id)
 
         if not up_client:
             return jsonify("The id does not exist")
-        
-        data = request.get_json()
 
         up_client.name = data.get("name" ,up_client.name)
         up_client.email = data.get("email",up_client.email)
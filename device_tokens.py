@@ -0,0 +1,61 @@
+from datetime import datetime
+import logging
+from models import db, DeviceToken, TopicSubscription
+from principal import subject_for
+from topic_subscriptions import unsubscribe_tokens
+
+logger = logging.getLogger(__name__)
+
+def register_device_token(user, token, session_id=None):
+    """
+    Record token as one of user's devices, tied to the login session that sent it;
+    the caller commits. A token already registered moves to its newest owner, as
+    happens when someone else logs in on the same device, and leaves the previous
+    owner's topics.
+    """
+    subject = subject_for(user)
+    device = DeviceToken.query.filter_by(token=token).first()
+    if device is None:
+        device = DeviceToken(token=token)
+        db.session.add(device)
+    elif device.subject != subject:
+        unsubscribe_tokens([token])
+    device.subject = subject
+    device.session_id = session_id
+    device.last_seen_at = datetime.utcnow()
+    return device
+
+def forget_session_devices(session_id):
+    """Stop pushing to devices registered by one login session, e.g. on logout; the caller commits"""
+    if session_id is None:
+        return 0
+    return _forget(DeviceToken.query.filter_by(session_id=session_id))
+
+def forget_user_devices(user):
+    """Stop pushing to every device of a Client or Admin; the caller commits"""
+    return _forget(DeviceToken.query.filter_by(subject=subject_for(user)))
+
+def _forget(query):
+    # The devices may still be valid, so their topic memberships have to be undone at FCM too
+    tokens = [token for (token,) in query.with_entities(DeviceToken.token)]
+    if not tokens:
+        return 0
+    unsubscribe_tokens(tokens)
+    return query.delete(synchronize_session=False)
+
+def forget_invalid_tokens(tokens):
+    """Delete tokens FCM reported as unregistered or invalid; the caller commits"""
+    deleted = DeviceToken.query.filter(DeviceToken.token.in_(list(tokens))).delete(synchronize_session=False)
+    TopicSubscription.query.filter(TopicSubscription.token.in_(list(tokens))).delete(synchronize_session=False)
+    if deleted:
+        logger.info(f"Deleted {deleted} device tokens rejected by FCM")
+    return deleted
+
+def device_tokens_for(subjects):
+    """subject -> list of DeviceToken, in one query"""
+    devices = {}
+    if not subjects:
+        return devices
+    for device in DeviceToken.query.filter(DeviceToken.subject.in_(list(subjects))):
+        devices.setdefault(device.subject, []).append(device)
+    return devices
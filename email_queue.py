@@ -0,0 +1,372 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message, BadHeaderError
+from jinja2 import TemplateError
+import json
+import random
+import smtplib
+import threading
+import time
+import uuid
+import logging
+from models import db, EmailOutbox
+from extensions import mail
+from email_templates import email_templates
+
+logger = logging.getLogger(__name__)
+
+EMAIL_WORKERS = 1
+EMAIL_BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+LEASE_SECONDS = 300
+POLL_SECONDS = 5
+# An SMTP connection unused for this long is closed rather than left to the server's timeout
+SMTP_IDLE_SECONDS = 60
+RETENTION_HOURS = 72
+
+def enqueue_email(recipient, subject, template=None, context=None, body=None):
+    """
+    Queue an email in the current transaction; the caller commits.
+
+    template is rendered with context (a JSON-serialisable dict) when the email is
+    sent; body is sent as plain text. No-op without a recipient.
+    """
+    if not recipient:
+        return None
+    row = EmailOutbox(
+        recipient=recipient,
+        subject=subject,
+        template=template,
+        context=json.dumps(context) if context is not None else None,
+        body=body,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.session.add(row)
+    db.session.info['emails_enqueued'] = True
+    return row
+
+# Errors with the SMTP session rather than one message; the rest of the batch would fail the same way
+CONNECTION_ERRORS = (
+    smtplib.SMTPConnectError, smtplib.SMTPHeloError, smtplib.SMTPAuthenticationError,
+    smtplib.SMTPServerDisconnected,
+)
+
+def is_connection_error(error):
+    return isinstance(error, CONNECTION_ERRORS) or (
+        isinstance(error, OSError) and not isinstance(error, (smtplib.SMTPException, TemplateError))
+    )
+
+def is_permanent_error(error):
+    """True for errors that will fail the same way on retry (rejected address, bad message, bad template)"""
+    if is_connection_error(error):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPNotSupportedError, BadHeaderError, AssertionError, TemplateError, ValueError)):
+        return True
+    # 5xx replies are permanent, 4xx ones (greylisting, mailbox busy) are worth retrying
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+class SMTPConnection:
+    """
+    One worker's reusable SMTP session (a flask_mail Connection).
+
+    Opened on first use, so the TLS and login handshake happens once per worker
+    rather than once per email, and closed after SMTP_IDLE_SECONDS unused. A
+    session the server has dropped is reopened once before a send fails.
+    """
+
+    def __init__(self, idle_seconds=SMTP_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.opened = 0
+        self._connection = None
+        self._used_at = None
+
+    def _open(self):
+        self._connection = mail.connect()
+        self._connection.__enter__()
+        self._used_at = time.monotonic()
+        self.opened += 1
+
+    def close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def close_if_idle(self):
+        if self._connection is not None and time.monotonic() - self._used_at > self.idle_seconds:
+            self.close()
+
+    def send(self, message):
+        if self._connection is None:
+            self._open()
+        try:
+            self._connection.send(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self._open()
+            self._connection.send(message)
+        self._used_at = time.monotonic()
+
+class EmailDispatcher:
+    """
+    Sends queued emails on background threads, each holding its own SMTP connection.
+
+    Claiming works as in NotificationDispatcher: a conditional UPDATE leases a
+    batch of due rows, so threads and processes can share the queue and a crashed
+    worker's rows are retried when the lease runs out. Each batch is rendered in
+    one pass per template and sent over the thread's open connection. Transient
+    SMTP errors are retried with exponential backoff; rejected addresses and bad
+    messages are dead-lettered.
+    """
+
+    def __init__(self):
+        self.workers = EMAIL_WORKERS
+        self.batch_size = EMAIL_BATCH_SIZE
+        self.max_attempts = MAX_ATTEMPTS
+        self.retry_base_seconds = RETRY_BASE_SECONDS
+        self.retry_max_seconds = RETRY_MAX_SECONDS
+        self.lease_seconds = LEASE_SECONDS
+        self.poll_seconds = POLL_SECONDS
+        self.idle_seconds = SMTP_IDLE_SECONDS
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopped = False
+        self._app = None
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.batches = 0
+        self.batch_seconds = 0.0
+        self.connections_opened = 0
+
+    def configure(self, app):
+        self.workers = app.config.get('EMAIL_WORKERS', EMAIL_WORKERS)
+        self.batch_size = app.config.get('EMAIL_BATCH_SIZE', EMAIL_BATCH_SIZE)
+        self.max_attempts = app.config.get('EMAIL_MAX_ATTEMPTS', MAX_ATTEMPTS)
+        self.retry_base_seconds = app.config.get('EMAIL_RETRY_BASE_SECONDS', RETRY_BASE_SECONDS)
+        self.poll_seconds = app.config.get('EMAIL_POLL_SECONDS', POLL_SECONDS)
+        self.idle_seconds = app.config.get('EMAIL_SMTP_IDLE_SECONDS', SMTP_IDLE_SECONDS)
+
+    def start(self, app):
+        """Start the worker threads; call after forking so each worker process gets its own"""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if any(thread.is_alive() for thread in self._threads):
+                return
+            self._app = app
+            self._stopped = False
+            self._threads = [
+                threading.Thread(target=self._run, name=f'heli-email-{n}', daemon=True)
+                for n in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+        logger.info(f"Email dispatcher started with {self.workers} workers")
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        connection = SMTPConnection(self.idle_seconds)
+        while not self._stopped:
+            with self._app.app_context():
+                try:
+                    handled = self.dispatch_once(connection)
+                except Exception as e:
+                    logger.error(f"Email dispatch failed: {str(e)}")
+                    db.session.rollback()
+                    handled = 0
+                finally:
+                    db.session.remove()
+            if not handled:
+                connection.close_if_idle()
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+        connection.close()
+
+    def _claim(self, now):
+        """Lease up to batch_size due rows to this call and return them"""
+        due = (
+            ((EmailOutbox.status == 'pending') & (EmailOutbox.next_attempt_at <= now)) |
+            ((EmailOutbox.status == 'sending') & (EmailOutbox.locked_until < now))
+        )
+        ids = [row_id for (row_id,) in db.session.query(EmailOutbox.id).filter(due).order_by(
+            EmailOutbox.next_attempt_at
+        ).limit(self.batch_size)]
+        if not ids:
+            return []
+        claim = uuid.uuid4().hex
+        EmailOutbox.query.filter(EmailOutbox.id.in_(ids), due).update({
+            EmailOutbox.status: 'sending',
+            EmailOutbox.claimed_by: claim,
+            EmailOutbox.locked_until: now + timedelta(seconds=self.lease_seconds),
+        }, synchronize_session=False)
+        db.session.commit()
+        return EmailOutbox.query.filter_by(claimed_by=claim, status='sending').all()
+
+    def dispatch_once(self, connection, now=None):
+        """Claim and send one batch over connection; returns the number of rows handled"""
+        rows = self._claim(now or datetime.utcnow())
+        if rows:
+            self._deliver(rows, connection)
+            db.session.commit()
+        return len(rows)
+
+    def drain(self):
+        """Send everything currently due over one connection, e.g. from cron when no workers run"""
+        connection = SMTPConnection(self.idle_seconds)
+        total = 0
+        try:
+            while True:
+                handled = self.dispatch_once(connection)
+                total += handled
+                if not handled:
+                    return total
+        finally:
+            connection.close()
+
+    def _render(self, rows):
+        """row id -> HTML (or the exception it raised) for every templated row, one batch render per template"""
+        by_template = {}
+        for row in rows:
+            if row.template:
+                by_template.setdefault(row.template, []).append(row)
+        rendered = {}
+        for template, template_rows in by_template.items():
+            try:
+                contexts = [json.loads(row.context or '{}') for row in template_rows]
+                rendered.update(zip((row.id for row in template_rows), email_templates.render_batch(template, contexts)))
+            except Exception:
+                # Find the row at fault without failing the rest of the batch
+                for row in template_rows:
+                    try:
+                        rendered[row.id] = email_templates.render(row.template, json.loads(row.context or '{}'))
+                    except Exception as e:
+                        rendered[row.id] = e
+        return rendered
+
+    def _message(self, row, html=None):
+        message = Message(subject=row.subject, recipients=[row.recipient],
+                          sender=current_app.config['MAIL_DEFAULT_SENDER'])
+        if row.template:
+            if isinstance(html, Exception):
+                raise html
+            message.html = html
+        else:
+            message.body = row.body
+        return message
+
+    def _deliver(self, rows, connection):
+        started = time.perf_counter()
+        opened = connection.opened
+        rendered = self._render(rows)
+        sent = 0
+        for index, row in enumerate(rows):
+            row.attempts += 1
+            row.locked_until = None
+            try:
+                message = self._message(row, rendered.get(row.id))
+            except Exception as e:
+                self._failed(row, e)
+                continue
+            try:
+                connection.send(message)
+            except Exception as e:
+                self._failed(row, e)
+                if is_connection_error(e):
+                    # The server is unreachable or refusing us; retry the rest later instead of reconnecting per email
+                    connection.close()
+                    for rest in rows[index + 1:]:
+                        rest.attempts += 1
+                        rest.locked_until = None
+                        self._failed(rest, e)
+                    break
+                continue
+            row.status = 'sent'
+            row.sent_at = datetime.utcnow()
+            row.last_error = None
+            sent += 1
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.sent += sent
+            self.batches += 1
+            self.batch_seconds += elapsed
+            self.connections_opened += connection.opened - opened
+        logger.info(f"Sent {sent}/{len(rows)} emails in one batch ({elapsed * 1000:.0f}ms)")
+
+    def _failed(self, row, error):
+        row.last_error = str(error)[:1000]
+        if is_permanent_error(error) or row.attempts >= self.max_attempts:
+            row.status = 'dead'
+            logger.warning(f"Dead-lettered email {row.id} to {row.recipient} after {row.attempts} attempts: {row.last_error}")
+            with self._lock:
+                self.dead += 1
+            return
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (row.attempts - 1))
+        row.status = 'pending'
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=random.uniform(delay / 2, delay))
+        logger.info(f"Email {row.id} failed (attempt {row.attempts}), retrying: {row.last_error}")
+        with self._lock:
+            self.retried += 1
+
+    def metrics(self):
+        batches = self.batches or 1
+        return {
+            'workers': self.workers,
+            'sent': self.sent,
+            'retried': self.retried,
+            'dead': self.dead,
+            'batches': self.batches,
+            'avg_batch_ms': round(self.batch_seconds / batches * 1000, 1),
+            'connections_opened': self.connections_opened,
+        }
+
+email_dispatcher = EmailDispatcher()
+
+def requeue_dead_emails():
+    """Give every dead-lettered email a fresh set of attempts"""
+    count = EmailOutbox.query.filter_by(status='dead').update({
+        EmailOutbox.status: 'pending',
+        EmailOutbox.attempts: 0,
+        EmailOutbox.next_attempt_at: datetime.utcnow(),
+    }, synchronize_session=False)
+    db.session.commit()
+    email_dispatcher.wake()
+    return count
+
+def prune_email_outbox(now=None):
+    """Delete sent and dead-lettered emails older than EMAIL_RETENTION_HOURS"""
+    retention_hours = current_app.config.get('EMAIL_RETENTION_HOURS', RETENTION_HOURS)
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=retention_hours)
+    deleted = EmailOutbox.query.filter(
+        EmailOutbox.status.in_(['sent', 'dead']),
+        EmailOutbox.updated_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} sent emails")
+    return deleted
+
+@db.event.listens_for(db.session, 'after_commit')
+def _wake_email_dispatcher(session):
+    # Only once the rows are committed, so workers never look for rows they cannot see yet
+    if session.info.pop('emails_enqueued', None):
+        email_dispatcher.wake()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_enqueued_emails(session):
+    session.info.pop('emails_enqueued', None)
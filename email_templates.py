@@ -0,0 +1,232 @@
+from html.parser import HTMLParser
+from flask import current_app
+from markupsafe import escape
+import hashlib
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_STYLE_BLOCK = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+_CSS_RULE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_SIMPLE_SELECTOR = re.compile(r'^([a-z][a-z0-9]*)?(?:\.([\w-]+))?$', re.I)
+# A template made only of text and {{ dotted.name }} expressions can skip Jinja entirely
+_EXPRESSION = re.compile(r'\{\{\s*([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)\s*\}\}')
+_JINJA_SYNTAX = re.compile(r'\{[{%#]')
+
+def _parse_selector(selector):
+    """[(tag, class), ...] for 'tag', '.class', 'tag.class' and descendant chains of them; None if unsupported"""
+    parts = []
+    for part in selector.split():
+        match = _SIMPLE_SELECTOR.match(part)
+        if not match or not any(match.groups()):
+            return None
+        parts.append((match.group(1) and match.group(1).lower(), match.group(2)))
+    return parts or None
+
+def _parse_css(css):
+    """(specificity, order, selector parts, declarations) for every rule the inliner understands"""
+    rules = []
+    for order, (selectors, body) in enumerate(_CSS_RULE.findall(_CSS_COMMENT.sub('', css))):
+        declarations = ' '.join(line.strip() for line in body.strip().splitlines() if line.strip())
+        if not declarations:
+            continue
+        for selector in selectors.split(','):
+            parts = _parse_selector(selector.strip())
+            if parts is None:
+                continue
+            specificity = (sum(1 for _, cls in parts if cls), sum(1 for tag, _ in parts if tag))
+            rules.append((specificity, order, parts, declarations.rstrip(';').replace('"', "'") + ';'))
+    rules.sort(key=lambda rule: (rule[0], rule[1]))
+    return rules
+
+def _matches(part, tag, classes):
+    part_tag, part_class = part
+    return (part_tag is None or part_tag == tag) and (part_class is None or part_class in classes)
+
+class _Inliner(HTMLParser):
+    """Collects, for each start tag in the source, the declarations of the CSS rules it matches"""
+
+    VOID = {'meta', 'br', 'hr', 'img', 'input', 'link'}
+
+    def __init__(self, rules):
+        super().__init__(convert_charrefs=False)
+        self.rules = rules
+        self.stack = []  # (tag, classes) of open elements
+        self.edits = []  # (line, column, start tag text, declarations)
+
+    def handle_starttag(self, tag, attrs):
+        classes = set((dict(attrs).get('class') or '').split())
+        declarations = []
+        for _, _, parts, body in self.rules:
+            if not _matches(parts[-1], tag, classes):
+                continue
+            ancestors = iter(reversed(self.stack))
+            if all(any(_matches(part, *ancestor) for ancestor in ancestors) for part in reversed(parts[:-1])):
+                declarations.append(body)
+        if declarations and tag not in ('html', 'head', 'style', 'meta'):
+            line, column = self.getpos()
+            self.edits.append((line, column, self.get_starttag_text(), ' '.join(declarations)))
+        if tag not in self.VOID:
+            self.stack.append((tag, classes))
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                return
+
+def inline_css(html):
+    """
+    Copy the rules of the <style> block onto matching elements as style attributes,
+    most specific last, ahead of any inline style already there. The block stays
+    for clients that honour it. Selectors other than tags, classes and descendant
+    chains of them are left to the block.
+    """
+    css = ' '.join(_STYLE_BLOCK.findall(html))
+    rules = _parse_css(css)
+    if not rules:
+        return html
+    inliner = _Inliner(rules)
+    inliner.feed(html)
+    inliner.close()
+
+    line_starts = [0]
+    for line in html.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+    result, position = [], 0
+    for line, column, tag_text, declarations in inliner.edits:
+        start = line_starts[line - 1] + column
+        existing = re.search(r'\sstyle\s*=\s*"([^"]*)"', tag_text)
+        if existing:
+            new_tag = tag_text.replace(existing.group(0), f' style="{declarations} {existing.group(1)}"', 1)
+        else:
+            closing = '/>' if tag_text.endswith('/>') else '>'
+            new_tag = f'{tag_text[:-len(closing)]} style="{declarations}"{closing}'
+        result.append(html[position:start])
+        result.append(new_tag)
+        position = start + len(tag_text)
+    result.append(html[position:])
+    return ''.join(result)
+
+def _getter(path):
+    names = tuple(path.split('.'))
+
+    def get(context):
+        # Jinja semantics: attribute or key, and an undefined value renders as ''
+        value = context
+        for name in names:
+            if isinstance(value, dict):
+                if name not in value:
+                    return ''
+                value = value[name]
+            elif hasattr(value, name):
+                value = getattr(value, name)
+            else:
+                return ''
+        return escape(value)
+
+    if len(names) == 2:
+        first, second = names
+
+        def get_two(context):
+            # The common case (booking.id, client.name) without the loop
+            try:
+                return escape(context[first][second])
+            except (KeyError, TypeError):
+                return get(context)
+        return get_two
+    return get
+
+class CompiledTemplate:
+    """
+    An email template with its CSS already inlined.
+
+    Templates that only print {{ dotted.names }} are turned into one format string
+    of their static text plus a getter per field, so rendering only looks up and
+    escapes the per-message values; anything else is compiled by Jinja once and
+    reused.
+    """
+
+    def __init__(self, name, source, environment, uptodate=None):
+        self.name = name
+        self.uptodate = uptodate
+        self.source = inline_css(source)
+        # Changes whenever the rendered markup would, so derived files can be keyed by it
+        self.version = hashlib.sha256(self.source.encode()).hexdigest()[:16]
+        pieces = _EXPRESSION.split(self.source)
+        statics, paths = pieces[0::2], pieces[1::2]
+        if any(_JINJA_SYNTAX.search(static) for static in statics):
+            self.getters = None
+            self.jinja_template = environment.from_string(self.source)
+        else:
+            # Static text becomes one format string with a slot per field
+            self.getters = [_getter(path) for path in paths]
+            self.format = ''.join(
+                static.replace('{', '{{').replace('}', '}}') + ('{}' if index < len(paths) else '')
+                for index, static in enumerate(statics)
+            ).format
+            self.jinja_template = None
+
+    def render(self, context):
+        if self.jinja_template is not None:
+            return self.jinja_template.render(**context)
+        return self.format(*[get(context) for get in self.getters])
+
+    def render_batch(self, contexts):
+        if self.jinja_template is not None:
+            render = self.jinja_template.render
+            return [render(**context) for context in contexts]
+        # One template lookup and one bound format for the whole batch
+        fill, getters = self.format, self.getters
+        return [fill(*[get(context) for get in getters]) for context in contexts]
+
+class EmailTemplates:
+    """
+    Email templates compiled once per worker process.
+
+    The first render of a template reads it through the app's Jinja loader,
+    inlines its CSS and compiles it; later renders only fill in the per-message
+    fields. With TEMPLATES_AUTO_RELOAD (or debug) on, a changed file is
+    recompiled on its next use.
+    """
+
+    def __init__(self):
+        self.auto_reload = False
+        self._lock = threading.Lock()
+        self._templates = {}
+        self.compiled = 0
+        self.rendered = 0
+
+    def configure(self, app):
+        self.auto_reload = bool(app.config.get('TEMPLATES_AUTO_RELOAD') or app.debug)
+        with self._lock:
+            self._templates.clear()
+
+    def get(self, name):
+        template = self._templates.get(name)
+        if template is not None and (not self.auto_reload or template.uptodate is None or template.uptodate()):
+            return template
+        with self._lock:
+            environment = current_app.jinja_env
+            source, _, uptodate = environment.loader.get_source(environment, name)
+            template = self._templates[name] = CompiledTemplate(name, source, environment, uptodate)
+            self.compiled += 1
+        logger.info(f"Compiled email template {name}")
+        return template
+
+    def render(self, name, context):
+        self.rendered += 1
+        return self.get(name).render(context)
+
+    def render_batch(self, name, contexts):
+        """HTML for each context, in order, from one lookup of the compiled template"""
+        self.rendered += len(contexts)
+        return self.get(name).render_batch(contexts)
+
+    def metrics(self):
+        return {'templates': len(self._templates), 'compiled': self.compiled, 'rendered': self.rendered}
+
+email_templates = EmailTemplates()
@@ -1,67 +1,55 @@
-from flask import current_app, render_template
-from flask_mail import Message
 from datetime import datetime
-from extensions import mail  # <-- Add this import
+from email_queue import enqueue_email
 
-def send_payment_receipt_email(booking, payment, client):
-    """Send payment receipt email to client"""
-    print("send_payment_receipt_email called")
-    try:
-        with current_app.app_context():
-            msg = Message(
-                subject=f"Payment Receipt - Booking #{booking.id}",
-                recipients=[client.email],
-                sender=current_app.config['MAIL_DEFAULT_SENDER']
-            )
-            # Use your HTML template for a styled, detailed email
-            msg.html = render_template(
-                'payment_receipt.html',
-                booking=booking,
-                payment=payment,
-                client=client,
-                date=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            )
-            mail.send(msg)
-            current_app.logger.info(f"Payment receipt email sent to {client.email}")
-            print(f"Payment receipt email sent to {client.email}")
-            return True
-    except Exception as e:
-        current_app.logger.error(f"Failed to send payment receipt email: {str(e)}")
-        print(f"Failed to send payment receipt email: {str(e)}")
-        return False
+BOOKING_FIELDS = ('id', 'date', 'time', 'purpose', 'num_passengers', 'final_amount')
+PAYMENT_FIELDS = ('id', 'amount', 'payment_status', 'phone_number')
+CLIENT_FIELDS = ('name',)
 
-def send_booking_confirmation_email(booking, client):
-    """Send booking confirmation email to client"""
-    try:
-        with current_app.app_context():
-            msg = Message(
-                subject=f"Booking Confirmation - Booking #{booking.id}",
-                recipients=[client.email],
-                sender=current_app.config['MAIL_DEFAULT_SENDER']
-            )
-            
-            msg.html = render_template(
-                'booking_confirmation.html',
-                booking=booking,
-                client=client,
-                date=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            )
-            
-            # Use current_app.mail instead of importing mail
-            mail.send(msg)
-            current_app.logger.info(f"Booking confirmation email sent to {client.email}")
-            return True
-    except Exception as e:
-        current_app.logger.error(f"Failed to send booking confirmation email: {str(e)}")
-        return False
+def _snapshot(obj, fields):
+    """The fields a template prints, as they are now; dates and times as the template would show them"""
+    values = {}
+    for field in fields:
+        if not hasattr(obj, field):
+            continue  # rendered empty, as an undefined attribute always was
+        value = getattr(obj, field)
+        values[field] = value if value is None or isinstance(value, (int, float, str)) else str(value)
+    return values
 
-def send_password_reset_email(email, reset_url):
-    from flask_mail import Message
-    from flask import current_app
-    msg = Message(
-        subject="Password Reset Request",
-        recipients=[email],
+def payment_receipt_context(booking, payment, client, date=None):
+    """What payment_receipt.html prints; date defaults to now"""
+    return {
+        'booking': _snapshot(booking, BOOKING_FIELDS),
+        'payment': _snapshot(payment, PAYMENT_FIELDS),
+        'client': _snapshot(client, CLIENT_FIELDS),
+        'date': (date or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+def queue_payment_receipt_email(booking, payment, client):
+    """Queue a payment receipt email to client; the caller commits"""
+    return enqueue_email(
+        client.email,
+        f"Payment Receipt - Booking #{booking.id}",
+        template='payment_receipt.html',
+        context=payment_receipt_context(booking, payment, client)
+    )
+
+def queue_booking_confirmation_email(booking, client):
+    """Queue a booking confirmation email to client; the caller commits"""
+    return enqueue_email(
+        client.email,
+        f"Booking Confirmation - Booking #{booking.id}",
+        template='booking_confirmation.html',
+        context={
+            'booking': _snapshot(booking, BOOKING_FIELDS),
+            'client': _snapshot(client, CLIENT_FIELDS),
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    )
+
+def queue_password_reset_email(email, reset_url):
+    """Queue a password reset link email; the caller commits"""
+    return enqueue_email(
+        email,
+        "Password Reset Request",
         body=f"Click the link to reset your password: {reset_url}"
     )
-    mail = current_app.extensions.get('mail')
-    mail.send(msg)
\ No newline at end of file
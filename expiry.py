@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import tuple_, update
+import logging
+from models import db, Booking, NegotiationHistory
+from availability import fleet_calendar
+from notifications import enqueue_user_notifications, notify_admins
+
+logger = logging.getLogger(__name__)
+
+# How long a booking may sit untouched in each status before it expires
+DEFAULT_EXPIRY_AGES = {
+    'pending': timedelta(hours=48),
+    'pending_payment': timedelta(hours=24),
+    'negotiation': timedelta(hours=72),
+}
+EXPIRY_BATCH_SIZE = 500
+
+# NegotiationHistory.user_id for changes made by the system rather than a user
+SYSTEM_USER_ID = 0
+
+def _expire_batch(status, cutoff, now, batch_size):
+    """Expire up to batch_size bookings in one status, returning (id, client_id) of those expired"""
+    candidates = db.session.query(Booking.id, Booking.client_id, Booking.final_amount, Booking.version).filter(
+        Booking.status == status,
+        Booking.updated_at < cutoff
+    ).order_by(Booking.updated_at).limit(batch_size).all()
+    if not candidates:
+        return []
+
+    expired_ids = _mark_expired(candidates, status, now)
+    expired = [row for row in candidates if row.id in expired_ids]
+
+    db.session.bulk_insert_mappings(NegotiationHistory, [
+        {
+            'booking_id': row.id,
+            'user_id': SYSTEM_USER_ID,
+            'user_type': 'system',
+            'action': 'expire',
+            'old_amount': row.final_amount,
+            'new_amount': row.final_amount,
+            'notes': f"Expired after no activity while '{status}'",
+            'created_at': now,
+            'updated_at': now,
+        }
+        for row in expired
+    ])
+    expired = [(row.id, row.client_id) for row in expired]
+    if expired:
+        _notify_expired(expired)
+    db.session.commit()
+    return expired
+
+def _mark_expired(candidates, status, now):
+    """
+    Expire the candidates still in status at the version that was read, returning
+    the ids this call changed. A booking another worker expired or edited since
+    the SELECT is left out, so it gets no second history entry or notification.
+    """
+    values = {Booking.status: 'expired', Booking.version: Booking.version + 1, Booking.updated_at: now}
+    if db.engine.dialect.full_returning:
+        statement = update(Booking).where(
+            tuple_(Booking.id, Booking.version).in_([(row.id, row.version) for row in candidates]),
+            Booking.status == status
+        ).values(values).returning(Booking.id).execution_options(synchronize_session=False)
+        return {booking_id for (booking_id,) in db.session.execute(statement)}
+
+    # Without RETURNING each booking gets its own UPDATE, whose rowcount says whether this call changed it
+    expired_ids = set()
+    for row in candidates:
+        result = db.session.execute(update(Booking).where(
+            Booking.id == row.id,
+            Booking.status == status,
+            Booking.version == row.version
+        ).values(values).execution_options(synchronize_session=False))
+        if result.rowcount:
+            expired_ids.add(row.id)
+    return expired_ids
+
+def _notify_expired(expired):
+    """Queue one push per affected client and one summary to admins; committed with the batch"""
+    by_client = {}
+    for booking_id, client_id in expired:
+        by_client.setdefault(client_id, []).append(booking_id)
+    notifications = []
+    for client_id, booking_ids in by_client.items():
+        numbers = ', '.join(f"#{booking_id}" for booking_id in booking_ids)
+        notifications.append((
+            f"c:{client_id}",
+            'Booking expired',
+            f"Booking {numbers} expired due to inactivity",
+            {'type': 'booking_expired', 'booking_ids': ','.join(map(str, booking_ids))}
+        ))
+    enqueue_user_notifications(notifications)
+    notify_admins(
+        f"{len(expired)} stale bookings were expired",
+        title='Bookings expired',
+        data={'type': 'bookings_expired', 'count': str(len(expired))}
+    )
+
+def expire_stale_bookings(now=None, ages=None, batch_size=None):
+    """
+    Expire bookings that have sat in a pending or negotiation status for too long.
+
+    Works in batches per status so each transaction stays short, records a
+    NegotiationHistory entry for every booking it expired and queues its
+    notifications in the same transaction as each batch.
+
+    Returns:
+        int: number of bookings expired
+    """
+    now = now or datetime.utcnow()
+    ages = ages or current_app.config.get('BOOKING_EXPIRY_AGES', DEFAULT_EXPIRY_AGES)
+    batch_size = batch_size or current_app.config.get('BOOKING_EXPIRY_BATCH_SIZE', EXPIRY_BATCH_SIZE)
+
+    expired = []
+    for status, age in ages.items():
+        cutoff = now - age
+        while True:
+            batch = _expire_batch(status, cutoff, now, batch_size)
+            # Bulk UPDATEs bypass session events, so free the slots explicitly
+            for booking_id, _ in batch:
+                fleet_calendar.discard_booking(booking_id)
+            expired.extend(batch)
+            if len(batch) < batch_size:
+                break
+
+    if expired:
+        logger.info(f"Expired {len(expired)} stale bookings")
+    return len(expired)
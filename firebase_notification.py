@@ -1,62 +1,22 @@
-import firebase_admin
-from firebase_admin import credentials, messaging
-from flask import current_app
-import uuid
 import os
-from dotenv import load_dotenv
 import logging
-import json
 import base64
+import threading
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-try:
-    env_path = os.path.join(os.getcwd(), '.env')
-    if os.path.exists(env_path):
-        load_dotenv(env_path, override=True)
-        logger.info(f"Loaded .env file from: {env_path}")
-    else:
-        env_path = os.path.join(os.path.dirname(os.getcwd()), '.env')
-        if os.path.exists(env_path):
-            load_dotenv(env_path, override=True)
-            logger.info(f"Loaded .env file from: {env_path}")
-        else:
-            # Check if required environment variables are available despite no .env file
-            required_vars = [
-                "FIREBASE_TYPE",
-                "FIREBASE_PROJECT_ID",
-                "FIREBASE_PRIVATE_KEY_ID",
-                "FIREBASE_PRIVATE_KEY",
-                "FIREBASE_CLIENT_EMAIL",
-                "FIREBASE_CLIENT_ID",
-                "FIREBASE_AUTH_URI",
-                "FIREBASE_TOKEN_URI",
-                "FIREBASE_AUTH_PROVIDER_X509_CERT_URL",
-                "FIREBASE_CLIENT_X509_CERT_URL"
-            ]
-            missing_vars = [var for var in required_vars if not os.getenv(var)]
-            if missing_vars:
-                logger.warning(f"Could not find .env file in current or parent directory")
-                logger.warning(f"Missing required environment variables: {', '.join(missing_vars)}")
-            else:
-                logger.info("No .env file found, but all required environment variables are available")
-except Exception as e:
-    logger.error(f"Error loading .env file: {str(e)}")
-
-# Flag to track Firebase initialization
-firebase_initialized = False
-
-def get_required_env_var(var_name):
-    """Get a required environment variable or raise an error"""
-    value = os.getenv(var_name)
-    if not value:
-        error_msg = f"Missing required environment variable: {var_name}"
-        logger.error(error_msg)
-        raise ValueError(error_msg)
-    return value
+FIREBASE_ENV_VARS = {
+    "type": "FIREBASE_TYPE",
+    "project_id": "FIREBASE_PROJECT_ID",
+    "private_key_id": "FIREBASE_PRIVATE_KEY_ID",
+    "private_key": "FIREBASE_PRIVATE_KEY",
+    "client_email": "FIREBASE_CLIENT_EMAIL",
+    "client_id": "FIREBASE_CLIENT_ID",
+    "auth_uri": "FIREBASE_AUTH_URI",
+    "token_uri": "FIREBASE_TOKEN_URI",
+    "auth_provider_x509_cert_url": "FIREBASE_AUTH_PROVIDER_X509_CERT_URL",
+    "client_x509_cert_url": "FIREBASE_CLIENT_X509_CERT_URL",
+}
 
 def format_private_key(private_key):
     """Format the private key to ensure proper newline handling"""
@@ -129,135 +89,165 @@ def format_private_key(private_key):
         logger.error(f"Error formatting private key: {str(e)}")
         return None
 
-def initialize_firebase(app):
-    """Initialize Firebase with credentials from environment variables"""
-    global firebase_initialized
-    try:
-        # Check if already initialized
-        if firebase_initialized:
-            logger.info("Firebase already initialized")
-            return
-            
-        # List of required environment variables
-        required_vars = [
-            "FIREBASE_TYPE",
-            "FIREBASE_PROJECT_ID",
-            "FIREBASE_PRIVATE_KEY_ID",
-            "FIREBASE_PRIVATE_KEY",
-            "FIREBASE_CLIENT_EMAIL",
-            "FIREBASE_CLIENT_ID",
-            "FIREBASE_AUTH_URI",
-            "FIREBASE_TOKEN_URI",
-            "FIREBASE_AUTH_PROVIDER_X509_CERT_URL",
-            "FIREBASE_CLIENT_X509_CERT_URL"
-        ]
-        
-        missing_vars = [var for var in required_vars if not os.getenv(var)]
-        if missing_vars:
-            logger.warning(f"Firebase not initialized: Missing environment variables: {', '.join(missing_vars)}")
-            logger.warning("Firebase notifications will be disabled")
-            return
-
-        # Get all required environment variables
-        private_key = get_required_env_var("FIREBASE_PRIVATE_KEY")
-        formatted_key = format_private_key(private_key)
-        
-        if not formatted_key:
-            logger.error("Failed to format private key correctly")
-            return
-
-        firebase_config = {
-            "type": get_required_env_var("FIREBASE_TYPE"),
-            "project_id": get_required_env_var("FIREBASE_PROJECT_ID"),
-            "private_key_id": get_required_env_var("FIREBASE_PRIVATE_KEY_ID"),
-            "private_key": formatted_key,
-            "client_email": get_required_env_var("FIREBASE_CLIENT_EMAIL"),
-            "client_id": get_required_env_var("FIREBASE_CLIENT_ID"),
-            "auth_uri": get_required_env_var("FIREBASE_AUTH_URI"),
-            "token_uri": get_required_env_var("FIREBASE_TOKEN_URI"),
-            "auth_provider_x509_cert_url": get_required_env_var("FIREBASE_AUTH_PROVIDER_X509_CERT_URL"),
-            "client_x509_cert_url": get_required_env_var("FIREBASE_CLIENT_X509_CERT_URL")
-        }
-        
-        # Initialize with the credentials
-        cred = credentials.Certificate(firebase_config)
-        firebase_admin.initialize_app(cred)
-        firebase_initialized = True
-        logger.info("Firebase initialized successfully")
-        
-    except Exception as e:
-        logger.warning(f"Firebase not initialized: {str(e)}")
-        logger.warning("Firebase notifications will be disabled")
-
-def generate_fcm_token():
-    """Generate a unique FCM token"""
-    return str(uuid.uuid4())
-
-def send_notification_to_user(user_fcm_token, title, body, data=None):
-    """Send notification to a specific user"""
-    logger.info(f"Attempting to send notification - Title: {title}, Body: {body}, Data: {data}")
-    
-    if not firebase_initialized:
-        logger.warning("Firebase not initialized. Notification not sent.")
-        return False
-
-    if not user_fcm_token:
-        logger.warning("No FCM token provided for user notification")
-        return False
-
-    try:
-        # Ensure data is a dictionary of strings
-        if data:
-            data = {str(k): str(v) for k, v in data.items()}
-        else:
-            data = {}
-            
-        logger.info(f"Sending FCM message to token: {user_fcm_token}")
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            token=user_fcm_token,
-            data=data
-        )
-        response = messaging.send(message)
-        logger.info(f"Successfully sent message: {response}")
+class FirebaseClient:
+    """
+    The one Firebase app every notification in this process goes through.
+
+    Nothing is imported or initialised until the first send, so startup stays
+    cheap and a gunicorn --preload master never holds Firebase state. The app is
+    named after the pid and rebuilt in a forked child, so workers never share the
+    master's HTTP sessions. Missing credentials disable sending until restart
+    instead of being retried on every send.
+    """
+
+    def __init__(self):
+        self.credentials_file = None
+        self.initializations = 0
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Also runs in a freshly forked child, where the parent's lock may have been held mid-initialisation
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._app = None
+        self._messaging = None
+        self._disabled = False
+
+    def configure(self, app):
+        """FIREBASE_CREDENTIALS may name a service-account JSON file; otherwise the FIREBASE_* env vars are used"""
+        self.credentials_file = app.config.get('FIREBASE_CREDENTIALS')
+
+    def _credentials(self, credentials):
+        if self.credentials_file:
+            return credentials.Certificate(self.credentials_file)
+        missing = [var for var in FIREBASE_ENV_VARS.values() if not os.getenv(var)]
+        if missing:
+            raise ValueError(f"Missing environment variables: {', '.join(missing)}")
+        config = {key: os.getenv(var) for key, var in FIREBASE_ENV_VARS.items()}
+        config["private_key"] = format_private_key(config["private_key"])
+        if not config["private_key"]:
+            raise ValueError("Failed to format private key correctly")
+        return credentials.Certificate(config)
+
+    def _initialize(self):
+        import firebase_admin
+        from firebase_admin import credentials, messaging
+        name = f"heli-{os.getpid()}"
+        try:
+            app = firebase_admin.get_app(name)
+        except ValueError:
+            app = firebase_admin.initialize_app(self._credentials(credentials), name=name)
+        self.initializations += 1
+        logger.info(f"Firebase initialized in process {os.getpid()}")
+        return app, messaging
+
+    def get(self):
+        """(firebase app, messaging module), or None if Firebase is not configured"""
+        if os.getpid() != self._pid:
+            self._reset()
+        app = self._app
+        if app is not None:
+            return app, self._messaging
+        if self._disabled:
+            return None
+        with self._lock:
+            if self._app is None and not self._disabled:
+                try:
+                    self._app, self._messaging = self._initialize()
+                except Exception as e:
+                    self._disabled = True
+                    logger.warning(f"Firebase not initialized: {str(e)}")
+                    logger.warning("Firebase notifications will be disabled")
+                    return None
+        return (self._app, self._messaging) if self._app is not None else None
+
+    @property
+    def initialized(self):
+        return self._app is not None
+
+    def metrics(self):
+        return {'initialized': self.initialized, 'disabled': self._disabled, 'initializations': self.initializations}
+
+firebase_client = FirebaseClient()
+
+class FirebaseUnavailable(Exception):
+    """Firebase credentials are missing or invalid in this worker"""
+
+def _message(messaging, title, body, data, **target):
+    # FCM data payloads must be string -> string
+    return messaging.Message(
+        notification=messaging.Notification(title=title, body=body),
+        data={str(k): str(v) for k, v in (data or {}).items()},
+        **target
+    )
+
+# FCM accepts at most this many messages per send_each call
+FCM_BATCH_LIMIT = 500
+
+def send_batch(notifications):
+    """
+    Send up to FCM_BATCH_LIMIT pushes in one send_each call.
+
+    Args:
+        notifications (list): dicts with title, body, data and either token or topic
+
+    Returns:
+        list: one exception (or None on success) per notification, in order
+
+    Raises FirebaseUnavailable when Firebase is not configured; errors for the
+    whole request (e.g. network) propagate, per-message ones are returned.
+    """
+    client = firebase_client.get()
+    if client is None:
+        raise FirebaseUnavailable("Firebase is not configured")
+    app, messaging = client
+    messages = [
+        _message(messaging, n['title'], n['body'], n.get('data'),
+                 **({'token': n['token']} if n.get('token') else {'topic': n['topic']}))
+        for n in notifications
+    ]
+    response = messaging.send_each(messages, app=app)
+    return [None if result.success else result.exception for result in response.responses]
+
+def is_permanent_error(error):
+    """True for errors that will fail the same way on retry (bad token, bad payload, no credentials)"""
+    if isinstance(error, (FirebaseUnavailable, ValueError)):
         return True
-    except Exception as e:
-        logger.error(f"Error sending user notification: {str(e)}")
-        return False
-
-def send_notification_to_topic(topic, title, body, data=None):
-    """Send notification to a topic"""
-    if not firebase_initialized:
-        logger.warning("Firebase not initialized. Topic notification not sent.")
-        return False
-
-    try:
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            topic=topic,
-            data=data or {}
-        )
-        messaging.send(message)
+    from firebase_admin import exceptions, messaging
+    return isinstance(error, (
+        messaging.UnregisteredError, messaging.SenderIdMismatchError,
+        exceptions.InvalidArgumentError, exceptions.NotFoundError, exceptions.PermissionDeniedError,
+    ))
+
+# FCM accepts at most this many tokens per topic (un)subscribe call
+FCM_TOPIC_BATCH_LIMIT = 1000
+# Per-token topic management errors meaning the token itself is bad, not the request
+INVALID_TOKEN_REASONS = ('NOT_FOUND', 'INVALID_ARGUMENT')
+
+def update_topic_membership(tokens, topic, subscribe=True):
+    """
+    Subscribe (or unsubscribe) up to FCM_TOPIC_BATCH_LIMIT tokens to a topic in one call.
+
+    Returns:
+        list: (index into tokens, reason) for every token FCM could not update
+
+    Raises FirebaseUnavailable when Firebase is not configured; errors for the
+    whole request propagate.
+    """
+    client = firebase_client.get()
+    if client is None:
+        raise FirebaseUnavailable("Firebase is not configured")
+    app, messaging = client
+    update = messaging.subscribe_to_topic if subscribe else messaging.unsubscribe_from_topic
+    response = update(list(tokens), topic, app=app)
+    return [(error.index, error.reason) for error in response.errors]
+
+def is_invalid_token_error(error):
+    """True when FCM rejected the device token itself, so it should never be used again"""
+    from firebase_admin import exceptions, messaging
+    if isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
         return True
-    except Exception as e:
-        logger.error(f"Error sending topic notification: {str(e)}")
-        return False
-
-def subscribe_to_topic(tokens, topic):
-    """Subscribe tokens to a topic"""
-    if not firebase_initialized:
-        logger.warning("Firebase not initialized. Topic subscription not performed.")
-        return None
-
-    try:
-        response = messaging.subscribe_to_topic(tokens, topic)
-        return response
-    except Exception as e:
-        logger.error(f"Error subscribing to topic: {str(e)}")
-        return None
\ No newline at end of file
+    # FCM reports malformed tokens as INVALID_ARGUMENT, the same code it uses for bad payloads
+    return isinstance(error, exceptions.InvalidArgumentError) and 'registration token' in str(error).lower()
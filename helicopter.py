@@ -1,8 +1,22 @@
-from models import Helicopter, db
+from models import Helicopter, db, DEFAULT_FLIGHT_DURATION_MINUTES, MAX_FLIGHT_DURATION_MINUTES
 from flask_restful import Resource
 from flask import make_response, request, jsonify
 from flask_jwt_extended import jwt_required
+from datetime import datetime, timedelta
 from admin_decorator import superadmin_required, admin_required, admin_or_superadmin_required
+from availability import fleet_calendar
+from validation import Schema, Field
+
+helicopter_schema = Schema({
+    'model': Field(str, required=True, min_length=1),
+    'capacity': Field(int, required=True, min=1),
+    'image_url': Field(str, required=True),
+})
+helicopter_update_schema = Schema({
+    'model': Field(str, min_length=1),
+    'capacity': Field(int, min=1),
+    'image_url': Field(str),
+})
 
 class HelicopterResource(Resource):
     @jwt_required()
@@ -19,10 +33,7 @@ class HelicopterResource(Resource):
     @jwt_required()
     @admin_or_superadmin_required
     def post(self):
-        data = request.get_json()
-
-        if not data or "model" not in data or "capacity" not in data or "image_url" not in data:
-            return jsonify({"message": "Missing required fields: 'model', 'capacity', and 'image_url'"}, 400)
+        data = helicopter_schema.parse()
 
         new_helicopter = Helicopter(
             model=data["model"],
@@ -40,13 +51,12 @@ class HelicopterResource(Resource):
     @jwt_required()
     @admin_or_superadmin_required
     def put(self, id):
+        data = helicopter_update_schema.parse()
         try:
             up_helicopter = Helicopter.query.get(id)
             if not up_helicopter:
                 return jsonify({"message": "The helicopter ID does not exist"}, 404)
 
-            data = request.get_json()
-
             if "model" in data:
                 up_helicopter.model = data["model"]
             if "capacity" in data:
@@ -75,4 +85,24 @@ class HelicopterResource(Resource):
             return jsonify({"message": f"Helicopter ID {id} was successfully deleted"}, 200)
         except Exception as e:
             db.session.rollback()
-            return jsonify({"message": "An error occurred", "error": str(e)}, 500)
\ No newline at end of file
+            return jsonify({"message": "An error occurred", "error": str(e)}, 500)
+
+class HelicopterAvailabilityResource(Resource):
+    @jwt_required()
+    def get(self):
+        """Helicopters free at ?date=&time= with room for ?passengers= (optional ?duration_minutes=)"""
+        try:
+            date_obj = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+            time_obj = datetime.strptime(request.args['time'], '%H:%M:%S').time()
+        except (KeyError, ValueError):
+            return {"message": "date (YYYY-MM-DD) and time (HH:MM:SS) are required"}, 400
+
+        passengers = request.args.get('passengers', 1, type=int)
+        duration_minutes = request.args.get('duration_minutes', DEFAULT_FLIGHT_DURATION_MINUTES, type=int)
+        if passengers < 1 or not 0 < duration_minutes <= MAX_FLIGHT_DURATION_MINUTES:
+            return {"message": "Invalid passengers or duration_minutes"}, 400
+
+        start = datetime.combine(date_obj, time_obj)
+        end = start + timedelta(minutes=duration_minutes)
+        helicopters = fleet_calendar.available_helicopters(start, end, passengers)
+        return make_response(jsonify(helicopters), 200)
@@ -0,0 +1,20 @@
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required
+from admin_decorator import superadmin_required
+
+# name -> zero-argument callable returning a dict of counters for this worker
+metrics_providers = {}
+
+def register_metrics(name, provider):
+    """Expose a component's counters under GET /admin/metrics"""
+    metrics_providers[name] = provider
+
+def collect_metrics():
+    return {name: provider() for name, provider in metrics_providers.items()}
+
+class MetricsResource(Resource):
+    @jwt_required()
+    @superadmin_required
+    def get(self):
+        """In-process counters for the worker that serves the request"""
+        return collect_metrics(), 200
@@ -0,0 +1,25 @@
+"""notification subject
+
+Revision ID: 1e5b9c3d7f42
+Revises: 6c9e3a1f8d24
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e5b9c3d7f42'
+down_revision = '6c9e3a1f8d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('notification_outbox', sa.Column('subject', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('notification_outbox') as batch_op:
+        batch_op.drop_column('subject')
@@ -0,0 +1,37 @@
+"""refresh token families
+
+Revision ID: 5d2e8b4f9c31
+Revises: e7a93f15b2c8
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8b4f9c31'
+down_revision = 'e7a93f15b2c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('refresh_token_families',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('subject', sa.String(length=32), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('revoked_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_refresh_token_families_subject', 'refresh_token_families', ['subject'], unique=False)
+    op.create_index('ix_refresh_token_families_expires_at', 'refresh_token_families', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_refresh_token_families_expires_at', table_name='refresh_token_families')
+    op.drop_index('ix_refresh_token_families_subject', table_name='refresh_token_families')
+    op.drop_table('refresh_token_families')
@@ -0,0 +1,36 @@
+"""booking reminders
+
+Revision ID: 6c9e3a1f8d24
+Revises: b8e5d2a7f4c3
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c9e3a1f8d24'
+down_revision = 'b8e5d2a7f4c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_bookings_status_scheduled_at', 'bookings', ['status', 'scheduled_at'], unique=False)
+    op.create_table('booking_reminders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('booking_id', sa.Integer(), nullable=False),
+    sa.Column('offset_minutes', sa.Integer(), nullable=False),
+    sa.Column('scheduled_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['booking_id'], ['bookings.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('booking_id', 'offset_minutes', 'scheduled_at', name='uq_booking_reminders_booking_offset_scheduled_at')
+    )
+
+
+def downgrade():
+    op.drop_table('booking_reminders')
+    op.drop_index('ix_bookings_status_scheduled_at', table_name='bookings')
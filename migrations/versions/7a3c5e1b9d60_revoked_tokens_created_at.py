@@ -0,0 +1,24 @@
+"""revoked tokens created_at index
+
+Revision ID: 7a3c5e1b9d60
+Revises: 1e5b9c3d7f42
+Create Date: 2026-10-19 22:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3c5e1b9d60'
+down_revision = '1e5b9c3d7f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_revoked_tokens_created_at', 'revoked_tokens', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_revoked_tokens_created_at', table_name='revoked_tokens')
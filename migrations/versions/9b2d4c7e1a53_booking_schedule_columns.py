@@ -0,0 +1,72 @@
+"""booking schedule columns
+
+Revision ID: 9b2d4c7e1a53
+Revises: 4048379fcf06
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d4c7e1a53'
+down_revision = '4048379fcf06'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+bookings = sa.table(
+    'bookings',
+    sa.column('id', sa.Integer),
+    sa.column('date', sa.Date),
+    sa.column('time', sa.Time),
+    sa.column('duration_minutes', sa.Integer),
+    sa.column('scheduled_at', sa.DateTime),
+    sa.column('ends_at', sa.DateTime),
+)
+
+
+def upgrade():
+    op.add_column('bookings', sa.Column('scheduled_at', sa.DateTime(), nullable=True))
+    op.add_column('bookings', sa.Column('duration_minutes', sa.Integer(), nullable=False, server_default='60'))
+    op.add_column('bookings', sa.Column('ends_at', sa.DateTime(), nullable=True))
+
+    # Backfill in id order, one batch at a time, so large tables are not loaded at once
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(bookings.c.id, bookings.c.date, bookings.c.time, bookings.c.duration_minutes)
+            .where(bookings.c.id > last_id)
+            .order_by(bookings.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            scheduled_at = datetime.combine(row.date, row.time)
+            connection.execute(
+                bookings.update()
+                .where(bookings.c.id == row.id)
+                .values(
+                    scheduled_at=scheduled_at,
+                    ends_at=scheduled_at + timedelta(minutes=row.duration_minutes or 60)
+                )
+            )
+        last_id = rows[-1].id
+
+    op.create_index('ix_bookings_scheduled_at', 'bookings', ['scheduled_at'], unique=False)
+    op.create_index('ix_bookings_helicopter_schedule', 'bookings', ['helicopter_id', 'scheduled_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_bookings_helicopter_schedule', table_name='bookings')
+    op.drop_index('ix_bookings_scheduled_at', table_name='bookings')
+    with op.batch_alter_table('bookings') as batch_op:
+        batch_op.drop_column('ends_at')
+        batch_op.drop_column('duration_minutes')
+        batch_op.drop_column('scheduled_at')
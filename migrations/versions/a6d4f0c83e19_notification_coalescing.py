@@ -0,0 +1,29 @@
+"""notification coalescing
+
+Revision ID: a6d4f0c83e19
+Revises: 3b7e9d2c6a10
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d4f0c83e19'
+down_revision = '3b7e9d2c6a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('notification_outbox', sa.Column('collapse_key', sa.String(length=100), nullable=True))
+    op.add_column('notification_outbox', sa.Column('coalesced', sa.Integer(), nullable=False, server_default='1'))
+    op.create_index('ix_notification_outbox_collapse_key', 'notification_outbox', ['collapse_key'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_notification_outbox_collapse_key', table_name='notification_outbox')
+    with op.batch_alter_table('notification_outbox') as batch_op:
+        batch_op.drop_column('coalesced')
+        batch_op.drop_column('collapse_key')
@@ -0,0 +1,25 @@
+"""booking version
+
+Revision ID: c41f8a2e6d07
+Revises: 9b2d4c7e1a53
+Create Date: 2026-10-19 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f8a2e6d07'
+down_revision = '9b2d4c7e1a53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('bookings', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('bookings') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,59 @@
+"""device tokens
+
+Revision ID: d3f8b1a5c7e2
+Revises: a6d4f0c83e19
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f8b1a5c7e2'
+down_revision = 'a6d4f0c83e19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('device_tokens',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('token', sa.String(length=255), nullable=False),
+    sa.Column('subject', sa.String(length=32), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=True),
+    sa.Column('last_seen_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token')
+    )
+    op.create_index('ix_device_tokens_subject', 'device_tokens', ['subject'], unique=False)
+    op.create_index('ix_device_tokens_session_id', 'device_tokens', ['session_id'], unique=False)
+
+    # Keep tokens registered by real devices. The 36-character values are random UUIDs that
+    # login used to generate, which FCM never accepted.
+    op.execute("""
+        INSERT INTO device_tokens (token, subject, last_seen_at, created_at, updated_at)
+        SELECT fcm_token, 'a:' || id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM admins WHERE fcm_token IS NOT NULL AND length(fcm_token) > 36
+    """)
+    op.execute("""
+        INSERT INTO device_tokens (token, subject, last_seen_at, created_at, updated_at)
+        SELECT fcm_token, 'c:' || id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM clients WHERE fcm_token IS NOT NULL AND length(fcm_token) > 36
+        AND fcm_token NOT IN (SELECT token FROM device_tokens)
+    """)
+    with op.batch_alter_table('clients') as batch_op:
+        batch_op.drop_column('fcm_token')
+    with op.batch_alter_table('admins') as batch_op:
+        batch_op.drop_column('fcm_token')
+
+
+def downgrade():
+    # Only the schema is restored; devices register their token again after logging in
+    op.add_column('admins', sa.Column('fcm_token', sa.String(length=255), nullable=True))
+    op.add_column('clients', sa.Column('fcm_token', sa.String(length=255), nullable=True))
+    op.drop_index('ix_device_tokens_session_id', table_name='device_tokens')
+    op.drop_index('ix_device_tokens_subject', table_name='device_tokens')
+    op.drop_table('device_tokens')
@@ -0,0 +1,24 @@
+"""booking status index
+
+Revision ID: e7a93f15b2c8
+Revises: c41f8a2e6d07
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a93f15b2c8'
+down_revision = 'c41f8a2e6d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_bookings_status_updated_at', 'bookings', ['status', 'updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_bookings_status_updated_at', table_name='bookings')
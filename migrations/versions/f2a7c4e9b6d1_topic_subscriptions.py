@@ -0,0 +1,47 @@
+"""topic subscriptions
+
+Revision ID: f2a7c4e9b6d1
+Revises: d3f8b1a5c7e2
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a7c4e9b6d1'
+down_revision = 'd3f8b1a5c7e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('topic_subscriptions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('token', sa.String(length=255), nullable=False),
+    sa.Column('topic', sa.String(length=100), nullable=False),
+    sa.Column('subscribed', sa.Boolean(), nullable=False),
+    sa.Column('synced_at', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('claimed_by', sa.String(length=32), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token', 'topic', name='uq_topic_subscriptions_token_topic')
+    )
+    op.create_index('ix_topic_subscriptions_synced_at', 'topic_subscriptions', ['synced_at'], unique=False)
+
+    # Admin devices were never actually subscribed; queue them for the first sync
+    op.execute("""
+        INSERT INTO topic_subscriptions (token, topic, subscribed, attempts, created_at, updated_at)
+        SELECT token, 'admin_notifications', TRUE, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM device_tokens WHERE subject LIKE 'a:%'
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_topic_subscriptions_synced_at', table_name='topic_subscriptions')
+    op.drop_table('topic_subscriptions')
@@ -1,12 +1,29 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy_serializer import SerializerMixin
 from datetime import time, date
-from extensions import bcrypt, db
+from zoneinfo import ZoneInfo
+from flask import current_app, has_app_context
+from extensions import db
+from password_hashing import password_hasher
 
 # db = SQLAlchemy()
 
+# Flight duration assumed when a booking does not specify one
+DEFAULT_FLIGHT_DURATION_MINUTES = 60
+# Upper bound on a single flight; lets schedule queries bound the index scan on both sides
+MAX_FLIGHT_DURATION_MINUTES = 24 * 60
+# Booking date and time, and so scheduled_at and ends_at, are wall-clock times in this zone
+DEFAULT_BOOKING_TIMEZONE = 'Africa/Nairobi'
+
+def booking_now(timezone=None):
+    """The current wall-clock time in BOOKING_TIMEZONE, naive, to compare with scheduled_at and ends_at"""
+    if timezone is None:
+        name = current_app.config.get('BOOKING_TIMEZONE') if has_app_context() else None
+        timezone = ZoneInfo(name or DEFAULT_BOOKING_TIMEZONE)
+    return datetime.now(timezone).replace(tzinfo=None)
+
 class BaseModel(db.Model, SerializerMixin):
     __abstract__ = True
 
@@ -36,14 +53,13 @@ class Client(BaseModel):
     phone_number = db.Column(db.String(14), unique=True, nullable=False)
     email = db.Column(db.String(90), unique=True, nullable=True)
     password = db.Column(db.String(128), nullable=False)
-    fcm_token = db.Column(db.String(255))  # Firebase Cloud Messaging token
     bookings = db.relationship('Booking', backref='client', lazy=True, cascade="all, delete-orphan")
 
     def set_password(self, password):
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password = password_hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password, password)
+        return password_hasher.check(self.password, password)
 
 class Admin(BaseModel):
     __tablename__ = "admins"
@@ -53,15 +69,14 @@ class Admin(BaseModel):
     email = db.Column(db.String(90), unique=True, nullable=True)
     password = db.Column(db.String(128), nullable=False)  # Use this directly
     is_superadmin = db.Column(db.Boolean, default=False)
-    fcm_token = db.Column(db.String(255))  # Firebase Cloud Messaging token
 
     def set_password(self, password):
         """Hash and set the password"""
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password = password_hasher.hash(password)
 
     def check_password(self, password):
         """Check if the password matches"""
-        return bcrypt.check_password_hash(self.password, password)
+        return password_hasher.check(self.password, password)
 
     def __repr__(self):
         return f"Admin (id={self.id})"
@@ -149,6 +164,11 @@ class Booking(BaseModel):
     payment_id = db.Column(db.Integer, db.ForeignKey('payments.id', ondelete="CASCADE"), nullable=True)
     has_unread_messages = db.Column(db.Boolean, default=False)  # Track unread messages
     last_message_at = db.Column(db.DateTime)  # Track last message timestamp
+    scheduled_at = db.Column(db.DateTime, index=True)  # Derived from date + time
+    duration_minutes = db.Column(db.Integer, nullable=False, default=DEFAULT_FLIGHT_DURATION_MINUTES,
+                                 server_default=str(DEFAULT_FLIGHT_DURATION_MINUTES))
+    ends_at = db.Column(db.DateTime)  # Derived from scheduled_at + duration
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Optimistic lock counter
     chat_messages = db.relationship(
         'ChatMessage',
         back_populates='booking',
@@ -156,6 +176,55 @@ class Booking(BaseModel):
         cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        db.Index('ix_bookings_helicopter_schedule', 'helicopter_id', 'scheduled_at'),
+        db.Index('ix_bookings_status_updated_at', 'status', 'updated_at'),
+        db.Index('ix_bookings_status_scheduled_at', 'status', 'scheduled_at'),
+    )
+    # Every UPDATE matches on the version it read; a concurrent change raises StaleDataError
+    __mapper_args__ = {'version_id_col': version}
+
+    # Bookings in these states no longer hold their slot on the schedule
+    INACTIVE_STATUSES = ('cancelled', 'expired')
+
+    def sync_schedule(self):
+        """Recompute scheduled_at and ends_at (BOOKING_TIMEZONE wall-clock) from date, time and duration"""
+        if isinstance(self.date, date) and isinstance(self.time, time):
+            self.scheduled_at = datetime.combine(self.date, self.time)
+            duration = self.duration_minutes or DEFAULT_FLIGHT_DURATION_MINUTES
+            self.ends_at = self.scheduled_at + timedelta(minutes=duration)
+
+    @classmethod
+    def active(cls):
+        """Query for bookings that still hold their slot"""
+        return cls.query.filter(cls.status.notin_(cls.INACTIVE_STATUSES))
+
+    @classmethod
+    def scheduled_between(cls, start, end, helicopter_id=None, query=None):
+        """
+        Bookings whose flight window overlaps [start, end).
+
+        The lower bound on scheduled_at is derived from MAX_FLIGHT_DURATION_MINUTES so
+        the query is a range scan on the schedule index rather than a table scan.
+        """
+        query = query if query is not None else cls.query
+        query = query.filter(
+            cls.scheduled_at < end,
+            cls.scheduled_at > start - timedelta(minutes=MAX_FLIGHT_DURATION_MINUTES),
+            cls.ends_at > start
+        )
+        if helicopter_id is not None:
+            query = query.filter(cls.helicopter_id == helicopter_id)
+        return query.order_by(cls.scheduled_at)
+
+    @classmethod
+    def conflicting(cls, helicopter_id, start, end, exclude_id=None):
+        """Active bookings on a helicopter that overlap [start, end)"""
+        query = cls.scheduled_between(start, end, helicopter_id=helicopter_id, query=cls.active())
+        if exclude_id is not None:
+            query = query.filter(cls.id != exclude_id)
+        return query
+
     def as_dict(self):
         return {
             'id': self.id,
@@ -172,10 +241,19 @@ class Booking(BaseModel):
             'payment': self.payment.to_dict() if self.payment else None,
             'has_unread_messages': self.has_unread_messages,
             'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'scheduled_at': self.scheduled_at.isoformat() if self.scheduled_at else None,
+            'duration_minutes': self.duration_minutes,
+            'ends_at': self.ends_at.isoformat() if self.ends_at else None,
+            'version': self.version,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
 
+@db.event.listens_for(Booking, 'before_insert')
+@db.event.listens_for(Booking, 'before_update')
+def _sync_booking_schedule(mapper, connection, target):
+    target.sync_schedule()
+
 class NegotiationHistory(BaseModel):
     __tablename__ = "negotiation_history"
 
@@ -198,4 +276,132 @@ class NegotiationHistory(BaseModel):
             'action': self.action,
             'notes': self.notes,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class RefreshTokenFamily(BaseModel):
+    """
+    One row per login session. Each refresh rotates the session to the next
+    generation; presenting an older generation means the token was replayed,
+    so the whole session is revoked.
+    """
+    __tablename__ = "refresh_token_families"
+
+    subject = db.Column(db.String(32), nullable=False, index=True)  # 'c:<id>' or 'a:<id>'
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime)
+
+class RevokedToken(BaseModel):
+    """A JWT revoked before its expiry, e.g. by logout; rows are pruned once the token would have expired"""
+    __tablename__ = "revoked_tokens"
+    __table_args__ = (
+        # Other workers' revocation syncs read recent rows by creation time
+        db.Index('ix_revoked_tokens_created_at', 'created_at'),
+    )
+
+    jti = db.Column(db.String(36), nullable=False, unique=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class DeviceToken(BaseModel):
+    """
+    An FCM registration token for one of a user's devices. Tokens are tied to the
+    login session that registered them, so logging out silences that device, and
+    are deleted as soon as FCM reports them unregistered or invalid.
+    """
+    __tablename__ = "device_tokens"
+
+    token = db.Column(db.String(255), nullable=False, unique=True)
+    subject = db.Column(db.String(32), nullable=False, index=True)  # 'c:<id>' or 'a:<id>'
+    session_id = db.Column(db.Integer, index=True)  # RefreshTokenFamily that registered it
+    last_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class TopicSubscription(BaseModel):
+    """
+    A device token's wanted membership of an FCM topic. subscribed is the state we
+    want; synced_at stays null until FCM has been told, and the topic sync job
+    sends pending rows in batches. Unsubscribed rows are deleted once synced.
+    """
+    __tablename__ = "topic_subscriptions"
+    __table_args__ = (
+        db.UniqueConstraint('token', 'topic', name='uq_topic_subscriptions_token_topic'),
+    )
+
+    token = db.Column(db.String(255), nullable=False)
+    topic = db.Column(db.String(100), nullable=False)
+    subscribed = db.Column(db.Boolean, nullable=False, default=True)
+    synced_at = db.Column(db.DateTime, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_until = db.Column(db.DateTime)
+    claimed_by = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+
+class NotificationOutbox(BaseModel):
+    """
+    A push notification waiting to be delivered, written in the same transaction
+    as the change it announces and sent later by the notification dispatcher.
+
+    status: 'pending' (due at next_attempt_at), 'sending' (claimed until locked_until),
+    'sent', or 'dead' (gave up after a permanent error or too many attempts).
+    """
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        db.Index('ix_notification_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    target_type = db.Column(db.String(10), nullable=False)  # 'token' or 'topic'
+    target = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(32))  # 'c:<id>' or 'a:<id>' for pushes to a user's device; rate limits key on it
+    title = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    data = db.Column(db.Text)  # JSON object of strings
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    claimed_by = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    collapse_key = db.Column(db.String(100), index=True)  # pending rows with the same key are merged
+    coalesced = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # events merged into this push
+
+class EmailOutbox(BaseModel):
+    """
+    An email waiting to be sent, written in the same transaction as the change it
+    announces and sent later by the email dispatcher over a pooled SMTP connection.
+
+    template and context (JSON) are rendered when the email is sent; body is used
+    for plain-text emails without a template. status works as in NotificationOutbox.
+    """
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    template = db.Column(db.String(100))
+    context = db.Column(db.Text)  # JSON object
+    body = db.Column(db.Text)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    claimed_by = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+
+class BookingReminder(BaseModel):
+    """
+    A pre-flight reminder that has been queued for a booking, one per reminder
+    offset and flight time. The unique key stops two workers reminding twice,
+    and a rescheduled flight (new scheduled_at) is reminded again.
+    """
+    __tablename__ = "booking_reminders"
+    __table_args__ = (
+        db.UniqueConstraint('booking_id', 'offset_minutes', 'scheduled_at',
+                            name='uq_booking_reminders_booking_offset_scheduled_at'),
+    )
+
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id', ondelete="CASCADE"), nullable=False)
+    offset_minutes = db.Column(db.Integer, nullable=False)  # minutes before the flight
+    scheduled_at = db.Column(db.DateTime, nullable=False)  # the flight time reminded of
@@ -0,0 +1,404 @@
+from datetime import datetime, timedelta
+from flask import current_app
+import json
+import random
+import threading
+import time
+import uuid
+import logging
+from models import db, NotificationOutbox
+from throttling import throttle
+from firebase_notification import is_permanent_error, is_invalid_token_error, FCM_BATCH_LIMIT
+from push_transport import push_transport
+from device_tokens import device_tokens_for, forget_invalid_tokens
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOPIC = 'admin_notifications'
+DISPATCHER_WORKERS = 2
+DISPATCH_BATCH_SIZE = FCM_BATCH_LIMIT
+MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+LEASE_SECONDS = 60
+POLL_SECONDS = 5
+RETENTION_HOURS = 72
+# Pushes with the same collapse key within this window are merged into one
+COALESCE_SECONDS = 30
+# Tries at merging into a pending push that other requests keep changing before queueing a new one
+MERGE_ATTEMPTS = 3
+# Each recipient (user, or topic) gets at most this many pushes per period
+PUSH_RATE_LIMIT = (10, 60)
+
+def _encode_data(data):
+    # FCM data payloads must be string -> string
+    return json.dumps({str(k): str(v) for k, v in data.items()}) if data else None
+
+def _enqueue(target_type, target, title, body, data, collapse_key=None, next_attempt_at=None, subject=None):
+    row = NotificationOutbox(
+        target_type=target_type,
+        target=target,
+        subject=subject,
+        title=title,
+        body=body,
+        data=_encode_data(data),
+        status='pending',
+        attempts=0,
+        next_attempt_at=next_attempt_at or datetime.utcnow(),
+        collapse_key=collapse_key,
+        coalesced=1
+    )
+    db.session.add(row)
+    db.session.info['notifications_enqueued'] = True
+    return row
+
+def enqueue_notification(token, title, body, data=None):
+    """Queue a push to one device in the current transaction; the caller commits. No-op without a token"""
+    if not token:
+        return None
+    return _enqueue('token', token, title, body, data)
+
+def enqueue_user_notifications(notifications):
+    """
+    Queue pushes to every registered device of each recipient; the caller commits.
+
+    Args:
+        notifications (list): (subject, title, body, data) tuples, subject being 'c:<id>' or 'a:<id>'
+    """
+    devices = device_tokens_for({subject for subject, _, _, _ in notifications})
+    return [
+        _enqueue('token', device.token, title, body, data, subject=subject)
+        for subject, title, body, data in notifications
+        for device in devices.get(subject, ())
+    ]
+
+def enqueue_user_notification(subject, title, body, data=None):
+    """Queue a push to every registered device of one Client or Admin subject; the caller commits"""
+    return enqueue_user_notifications([(subject, title, body, data)])
+
+def enqueue_topic_notification(topic, title, body, data=None):
+    """Queue a push to every device subscribed to topic; the caller commits"""
+    return _enqueue('topic', topic, title, body, data)
+
+def notify_admins(body, title="Admin Notification", data=None):
+    """Queue a push to all admins; the caller commits"""
+    return enqueue_topic_notification(ADMIN_TOPIC, title, body, data)
+
+def enqueue_coalesced(collapse_key, target_type, target, title, body, data=None, summary_title=None, subject=None):
+    """
+    Queue a push that is merged with others sharing collapse_key; the caller commits.
+
+    The first push of a burst goes out right away. Any more within
+    NOTIFICATION_COALESCE_SECONDS of it are folded into one held push, sent when
+    the window closes, that reads "N new messages" and carries the latest data
+    plus a count. subject is the user the target device belongs to, if any, so
+    the push counts against that user's rate limit.
+    """
+    if not target:
+        return None
+    now = datetime.utcnow()
+    window = timedelta(seconds=current_app.config.get('NOTIFICATION_COALESCE_SECONDS', COALESCE_SECONDS))
+    for _ in range(MERGE_ATTEMPTS):
+        latest = NotificationOutbox.query.filter_by(collapse_key=collapse_key).order_by(
+            NotificationOutbox.id.desc()
+        ).first()
+        if latest is None or latest.status != 'pending':
+            break
+        # Merged only while the row is still pending and unchanged: a dispatcher that has just claimed it
+        # sends what it read, so this message then gets a row of its own rather than being lost
+        count = latest.coalesced + 1
+        merged = NotificationOutbox.query.filter_by(
+            id=latest.id, status='pending', coalesced=latest.coalesced
+        ).update({
+            NotificationOutbox.coalesced: count,
+            NotificationOutbox.title: summary_title or title,
+            NotificationOutbox.body: f"{count} new messages",
+            NotificationOutbox.data: _encode_data({**(data or {}), 'count': count}),
+        }, synchronize_session=False)
+        db.session.expire(latest)
+        if merged:
+            return latest
+
+    next_attempt_at = None
+    if latest is not None and latest.created_at > now - window:
+        # One went out recently; hold this one so the rest of the burst can join it
+        next_attempt_at = latest.created_at + window
+    return _enqueue(target_type, target, title, body, data, collapse_key, next_attempt_at, subject)
+
+class NotificationDispatcher:
+    """
+    Delivers queued notifications on a small pool of background threads.
+
+    Workers claim due rows with a conditional UPDATE, so several threads and
+    processes can share one outbox. A claim is a lease: rows left 'sending' by a
+    crashed worker are picked up again once it runs out, so delivery is at least
+    once. Transient FCM errors are retried with exponential backoff and jitter;
+    permanent ones, and rows out of attempts, are dead-lettered.
+
+    Each claimed batch goes to FCM as one send_each request, and the per-message
+    results are mapped back to their rows by position.
+    """
+
+    def __init__(self):
+        self.workers = DISPATCHER_WORKERS
+        self.batch_size = DISPATCH_BATCH_SIZE
+        self.max_attempts = MAX_ATTEMPTS
+        self.retry_base_seconds = RETRY_BASE_SECONDS
+        self.retry_max_seconds = RETRY_MAX_SECONDS
+        self.lease_seconds = LEASE_SECONDS
+        self.poll_seconds = POLL_SECONDS
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._app = None
+        self._stopped = False
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.batches = 0
+        self.batched_messages = 0
+        self.batch_seconds = 0.0
+        self.max_batch_seconds = 0.0
+        self.rate_limit = PUSH_RATE_LIMIT
+        self.rate_limited = 0
+        self.tokens_pruned = 0
+
+    def configure(self, app):
+        self.workers = app.config.get('NOTIFICATION_WORKERS', DISPATCHER_WORKERS)
+        self.batch_size = min(FCM_BATCH_LIMIT, app.config.get('NOTIFICATION_BATCH_SIZE', DISPATCH_BATCH_SIZE))
+        self.max_attempts = app.config.get('NOTIFICATION_MAX_ATTEMPTS', MAX_ATTEMPTS)
+        self.retry_base_seconds = app.config.get('NOTIFICATION_RETRY_BASE_SECONDS', RETRY_BASE_SECONDS)
+        self.poll_seconds = app.config.get('NOTIFICATION_POLL_SECONDS', POLL_SECONDS)
+        self.rate_limit = app.config.get('NOTIFICATION_RATE_LIMIT', PUSH_RATE_LIMIT)
+
+    def start(self, app):
+        """Start the worker threads; call after forking so each worker process gets its own"""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if any(thread.is_alive() for thread in self._threads):
+                return
+            self._app = app
+            self._stopped = False
+            self._threads = [
+                threading.Thread(target=self._run, name=f'heli-notifications-{n}', daemon=True)
+                for n in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+        logger.info(f"Notification dispatcher started with {self.workers} workers")
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def wake(self):
+        """Have an idle worker look for new rows now instead of at its next poll"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped:
+            with self._app.app_context():
+                try:
+                    handled = self.dispatch_once()
+                except Exception as e:
+                    logger.error(f"Notification dispatch failed: {str(e)}")
+                    db.session.rollback()
+                    handled = 0
+                finally:
+                    db.session.remove()
+            if not handled:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def _claim(self, now):
+        """Lease up to batch_size due rows to this call and return them"""
+        due = (
+            ((NotificationOutbox.status == 'pending') & (NotificationOutbox.next_attempt_at <= now)) |
+            ((NotificationOutbox.status == 'sending') & (NotificationOutbox.locked_until < now))
+        )
+        ids = [row_id for (row_id,) in db.session.query(NotificationOutbox.id).filter(due).order_by(
+            NotificationOutbox.next_attempt_at
+        ).limit(self.batch_size)]
+        if not ids:
+            return []
+        claim = uuid.uuid4().hex
+        # Re-checking `due` makes the claim atomic when another worker selected the same ids
+        NotificationOutbox.query.filter(NotificationOutbox.id.in_(ids), due).update({
+            NotificationOutbox.status: 'sending',
+            NotificationOutbox.claimed_by: claim,
+            NotificationOutbox.locked_until: now + timedelta(seconds=self.lease_seconds),
+        }, synchronize_session=False)
+        db.session.commit()
+        return NotificationOutbox.query.filter_by(claimed_by=claim, status='sending').all()
+
+    def dispatch_once(self, now=None):
+        """Claim and deliver one batch; returns the number of rows handled"""
+        now = now or datetime.utcnow()
+        rows = self._claim(now)
+        if rows:
+            allowed = self._within_rate_limit(rows, now)
+            if allowed:
+                self._deliver(allowed)
+            db.session.commit()
+        return len(rows)
+
+    def _within_rate_limit(self, rows, now):
+        """Rows whose recipient is under its push rate; the rest wait for the bucket without using an attempt"""
+        if not self.rate_limit:
+            return rows
+        allowed = []
+        decided = {}
+        for row in rows:
+            # Pushes to a user are capped per user, however many devices they have. One notification
+            # fanned out to several of their devices is a single push, so it takes a single token
+            if row.subject:
+                bucket, notification = f"push:user:{row.subject}", (row.subject, row.title, row.body, row.data)
+            else:
+                bucket, notification = f"push:{row.target_type}:{row.target}", row.id
+            if notification not in decided:
+                # Shares THROTTLE_STORE, so a shared store caps recipients across all workers
+                decided[notification] = throttle.store.consume(bucket, *self.rate_limit)
+            retry_after = decided[notification]
+            if not retry_after:
+                allowed.append(row)
+                continue
+            row.status = 'pending'
+            row.locked_until = None
+            row.next_attempt_at = now + timedelta(seconds=retry_after)
+        deferred = len(rows) - len(allowed)
+        if deferred:
+            with self._lock:
+                self.rate_limited += deferred
+        return allowed
+
+    def drain(self):
+        """Deliver everything currently due, e.g. from cron when no workers run"""
+        total = 0
+        while True:
+            handled = self.dispatch_once()
+            total += handled
+            if not handled:
+                return total
+
+    def _deliver(self, rows):
+        started = time.perf_counter()
+        try:
+            errors = push_transport.send_batch([
+                {
+                    'title': row.title,
+                    'body': row.body,
+                    'data': json.loads(row.data) if row.data else None,
+                    row.target_type: row.target,
+                }
+                for row in rows
+            ])
+        except Exception as e:
+            # The request as a whole failed, so every row in it did
+            errors = [e] * len(rows)
+        elapsed = time.perf_counter() - started
+
+        now = datetime.utcnow()
+        sent = 0
+        invalid_tokens = set()
+        for row, error in zip(rows, errors):
+            if error is not None and row.target_type == 'token' and is_invalid_token_error(error):
+                invalid_tokens.add(row.target)
+            row.attempts += 1
+            row.locked_until = None
+            if error is not None:
+                self._failed(row, error)
+                continue
+            row.status = 'sent'
+            row.sent_at = now
+            row.last_error = None
+            sent += 1
+        with self._lock:
+            self.sent += sent
+            self.batches += 1
+            self.batched_messages += len(rows)
+            self.batch_seconds += elapsed
+            self.max_batch_seconds = max(self.max_batch_seconds, elapsed)
+        logger.info(f"Delivered {sent}/{len(rows)} notifications in one batch ({elapsed * 1000:.0f}ms)")
+        if invalid_tokens:
+            self._forget_tokens(invalid_tokens)
+
+    def _forget_tokens(self, tokens):
+        """Drop device tokens FCM rejected, and the pushes still queued for them"""
+        forget_invalid_tokens(tokens)
+        NotificationOutbox.query.filter(
+            NotificationOutbox.target_type == 'token',
+            NotificationOutbox.target.in_(list(tokens)),
+            NotificationOutbox.status == 'pending'
+        ).update({
+            NotificationOutbox.status: 'dead',
+            NotificationOutbox.last_error: 'Device token is no longer registered',
+        }, synchronize_session=False)
+        with self._lock:
+            self.tokens_pruned += len(tokens)
+
+    def _failed(self, row, error):
+        row.last_error = str(error)[:1000]
+        if is_permanent_error(error) or row.attempts >= self.max_attempts:
+            row.status = 'dead'
+            logger.warning(f"Dead-lettered notification {row.id} after {row.attempts} attempts: {row.last_error}")
+            with self._lock:
+                self.dead += 1
+            return
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (row.attempts - 1))
+        row.status = 'pending'
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=random.uniform(delay / 2, delay))
+        logger.info(f"Notification {row.id} failed (attempt {row.attempts}), retrying: {row.last_error}")
+        with self._lock:
+            self.retried += 1
+
+    def metrics(self):
+        batches = self.batches or 1
+        return {
+            'workers': self.workers,
+            'sent': self.sent,
+            'retried': self.retried,
+            'dead': self.dead,
+            'batches': self.batches,
+            'avg_batch_size': round(self.batched_messages / batches, 1),
+            'avg_batch_ms': round(self.batch_seconds / batches * 1000, 1),
+            'max_batch_ms': round(self.max_batch_seconds * 1000, 1),
+            'rate_limited': self.rate_limited,
+            'tokens_pruned': self.tokens_pruned,
+        }
+
+notification_dispatcher = NotificationDispatcher()
+
+def requeue_dead_notifications():
+    """Give every dead-lettered notification a fresh set of attempts"""
+    count = NotificationOutbox.query.filter_by(status='dead').update({
+        NotificationOutbox.status: 'pending',
+        NotificationOutbox.attempts: 0,
+        NotificationOutbox.next_attempt_at: datetime.utcnow(),
+    }, synchronize_session=False)
+    db.session.commit()
+    notification_dispatcher.wake()
+    return count
+
+def prune_notification_outbox(now=None):
+    """Delete sent and dead-lettered notifications older than NOTIFICATION_RETENTION_HOURS"""
+    retention_hours = current_app.config.get('NOTIFICATION_RETENTION_HOURS', RETENTION_HOURS)
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=retention_hours)
+    deleted = NotificationOutbox.query.filter(
+        NotificationOutbox.status.in_(['sent', 'dead']),
+        NotificationOutbox.updated_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} delivered notifications")
+    return deleted
+
+@db.event.listens_for(db.session, 'after_commit')
+def _wake_dispatcher(session):
+    # Only once the rows are committed, so workers never look for rows they cannot see yet
+    if session.info.pop('notifications_enqueued', None):
+        notification_dispatcher.wake()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_enqueued(session):
+    session.info.pop('notifications_enqueued', None)
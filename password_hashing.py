@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import ServiceUnavailable
+import os
+import threading
+import logging
+from extensions import bcrypt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_POOL_SIZE = 4
+DEFAULT_QUEUE_LIMIT = 32
+
+class HasherBusy(ServiceUnavailable):
+    """Raised when the bcrypt pool and its queue are full; rendered as a 503"""
+    description = "Server is busy, please retry shortly."
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small thread pool shared by all requests in a worker.
+
+    bcrypt releases the GIL, so POOL_SIZE threads use up to POOL_SIZE cores while
+    request threads wait. At most POOL_SIZE + QUEUE_LIMIT hashes are accepted at once;
+    beyond that callers get HasherBusy straight away instead of piling up behind a burst.
+    """
+
+    def __init__(self, log_rounds=DEFAULT_LOG_ROUNDS, pool_size=DEFAULT_POOL_SIZE, queue_limit=DEFAULT_QUEUE_LIMIT):
+        self.log_rounds = log_rounds
+        self.pool_size = pool_size
+        self.queue_limit = queue_limit
+        self._slots = threading.BoundedSemaphore(pool_size + queue_limit)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def configure(self, app):
+        """Read BCRYPT_LOG_ROUNDS, BCRYPT_POOL_SIZE and BCRYPT_QUEUE_LIMIT from the app config"""
+        self.__init__(
+            log_rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS),
+            pool_size=app.config.get('BCRYPT_POOL_SIZE', DEFAULT_POOL_SIZE),
+            queue_limit=app.config.get('BCRYPT_QUEUE_LIMIT', DEFAULT_QUEUE_LIMIT)
+        )
+
+    def _get_executor(self):
+        # Threads do not survive fork, so each worker process starts its own pool
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='bcrypt')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            logger.warning("Password hashing pool is full, rejecting request")
+            raise HasherBusy()
+        try:
+            result = self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def hash(self, password):
+        """bcrypt hash of password at the configured cost, as a str"""
+        return self._run(bcrypt.generate_password_hash, password, self.log_rounds).decode('utf-8')
+
+    def check(self, password_hash, password):
+        return self._run(bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the stored hash was made with a different cost than the configured one"""
+        try:
+            return int(password_hash.split('$')[2]) != self.log_rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+    def verify_and_update(self, user, password):
+        """
+        Check password against user.password, rehashing it at the configured cost
+        when it matches but was hashed with another. The caller commits.
+        """
+        if not self.check(user.password, password):
+            return False
+        if self.needs_rehash(user.password):
+            user.password = self.hash(password)
+            with self._lock:
+                self.rehashed += 1
+            logger.info(f"Rehashed password for {type(user).__name__} {user.id} at cost {self.log_rounds}")
+        return True
+
+    def metrics(self):
+        return {
+            'log_rounds': self.log_rounds,
+            'pool_size': self.pool_size,
+            'queue_limit': self.queue_limit,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'rehashed': self.rehashed,
+        }
+
+password_hasher = PasswordHasher()
@@ -1,8 +1,13 @@
 from flask_restful import Resource
 from flask import jsonify, make_response, request
 from models import Payment, Booking, Client, Admin, db
-from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
-import datetime
+from flask_jwt_extended import jwt_required
+from principal import current_principal
+from validation import Schema, Field
+from notifications import notify_admins
+from email_utils import queue_payment_receipt_email
+from booking_state import InvalidTransition, apply_transition, commit_with_retry, conflict_response
+from sqlalchemy.orm.exc import StaleDataError
 import logging
 import json
 from mpesa import initiate_mpesa_payment, wait_for_payment_confirmation, SHORTCODE, CALLBACK_URL
@@ -10,9 +15,6 @@ import os
 
 logger = logging.getLogger(__name__)
 
-def is_admin(user_id):
-    return Admin.query.filter_by(id=user_id).first() is not None
-
 def format_phone_number(phone_number):
     # Remove any non-digit characters
     phone_number = ''.join(filter(str.isdigit, phone_number))
@@ -30,21 +32,14 @@ def wait_for_payment_confirmation(checkout_request_id):
         'status': 'success'
     }
 
-def send_payment_receipt_email(booking, payment, client):
-    # Implement payment receipt email sending logic here
-    pass
-
-def notify_admin(message):
-    # Implement admin notification logic here
-    pass
-
 class PaymentsResource(Resource):
     @jwt_required()
     def get(self):
-        current_user_id = get_jwt_identity()  # Get the ID of the currently authenticated user
+        principal = current_principal()
+        current_user_id = principal.id  # Get the ID of the currently authenticated user
 
         # Check if the current user is an admin
-        is_admin = Admin.query.filter_by(id=current_user_id).first() is not None
+        is_admin = principal.is_admin
 
         if is_admin:
             # If the user is an admin, fetch all payments
@@ -85,25 +80,22 @@ class PaymentsResource(Resource):
                     })
             return make_response(jsonify(payment_details), 200)
 
+payment_schema = Schema({
+    'phone_number': Field(str, required=True, min_length=1),
+})
+
 class PaymentResource(Resource):
     @jwt_required()
     def post(self, id):
+        data = payment_schema.parse()
         try:
-            verify_jwt_in_request()
-            user_id = get_jwt_identity()
-            
-            data = request.get_json()
-            
-            # Validate required fields
-            required_fields = ['phone_number']
-            if not all(field in data for field in required_fields):
-                return {"error": "Missing required fields"}, 400
+            principal = current_principal()
             
             # Get booking
             booking = Booking.query.get_or_404(id)
             
             # Check if user is authorized
-            if not is_admin(user_id) and booking.client_id != user_id:
+            if not principal.can_access(booking):
                 return {"error": "Unauthorized"}, 403
             
             # Check if booking is already paid
@@ -150,37 +142,39 @@ class PaymentResource(Resource):
                     logger.error("No CheckoutRequestID in M-Pesa response")
                     return {'message': 'Payment initiation failed: No checkout request ID received'}, 500
                 
-                # Update booking with checkout request ID
-                booking.checkout_request_id = checkout_request_id
-                booking.payment_phone = formatted_phone
-                booking.payment_status = 'pending'
+                # Record the payment and link it to the booking
+                payment = Payment(
+                    amount=amount,
+                    phone_number=formatted_phone,
+                    merchant_request_id=mpesa_response.get('MerchantRequestID'),
+                    checkout_request_id=checkout_request_id,
+                    payment_status='pending'
+                )
+                db.session.add(payment)
+                db.session.flush()
+                booking.payment_id = payment.id
                 db.session.commit()
                 
                 # Wait for payment confirmation
                 logger.info(f"Waiting for payment confirmation for booking {booking.id}")
-                payment = Payment.query.get(booking.payment_id)
-                checkout_request_id = payment.checkout_request_id  # This is the string from M-Pesa
                 payment_status = wait_for_payment_confirmation(checkout_request_id)
                 
                 # Handle payment status
                 if payment_status.get('status') == 'success':
-                    # Update booking status
-                    booking.status = 'paid'
-                    booking.payment_status = 'completed'
-                    booking.payment_date = datetime.datetime.now()
-                    db.session.commit()
-                    
-                    # Send payment receipt email
+                    # The payment has been taken, so re-apply rather than fail if the booking moved on meanwhile
+                    # The receipt is queued in the same transaction and sent in the background
                     client = Client.query.get(booking.client_id)
-                    send_payment_receipt_email(booking, booking, client)
-                    
-                    # Notify admin
-                    notify_admin(f"Payment received for booking #{booking.id}")
+                    def mark_paid(booking):
+                        payment.payment_status = 'success'
+                        booking.payment_id = payment.id
+                        apply_transition(booking, status='paid')
+                        notify_admins(f"Payment received for booking #{booking.id}")
+                        queue_payment_receipt_email(booking, payment, client)
+                    commit_with_retry(booking, mark_paid)
                     
                     return {'message': 'Payment successful', 'booking': booking.to_dict()}, 200
                 elif payment_status.get('status') == 'failed':
-                    # Update booking payment status
-                    booking.payment_status = 'failed'
+                    payment.payment_status = 'failed'
                     db.session.commit()
                     
                     error_details = payment_status.get('details', {})
@@ -195,7 +189,13 @@ class PaymentResource(Resource):
                         'checkout_request_id': checkout_request_id
                     }, 200
                     
+            except InvalidTransition as e:
+                logger.error(f"Payment taken for booking {id} that can no longer be paid: {str(e)}")
+                return conflict_response(id, str(e))
+            except StaleDataError:
+                return conflict_response(id)
             except Exception as e:
+                db.session.rollback()
                 logger.error(f"Error processing M-Pesa payment: {str(e)}")
                 return {'message': f'Payment processing error: {str(e)}'}, 500
                 
@@ -0,0 +1,169 @@
+from flask import g, current_app
+from flask_jwt_extended import current_user
+from models import Client, Admin
+from principal_cache import principal_cache, snapshot_of
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Values of the 'role' claim
+CLIENT_ROLE = 'user'
+ADMIN_ROLE = 'admin'
+
+# Prefixes of typed token subjects, e.g. 'c:123' for client 123 and 'a:7' for admin 7
+SUBJECT_PREFIXES = {'client': 'c', 'admin': 'a'}
+SUBJECT_TYPES = {prefix: principal_type for principal_type, prefix in SUBJECT_PREFIXES.items()}
+
+# Attributes served from the shared principal cache instead of the row
+SNAPSHOT_FIELDS = ('name', 'email')
+
+class Principal:
+    """
+    The authenticated caller, built from signed token claims.
+
+    Authorization checks (is_admin, is_superadmin, owns) use only the claims and
+    cost no queries. name and email come from the cross-request
+    principal cache; the Client/Admin row itself is only loaded when a handler
+    asks for .row (e.g. to modify it) or another attribute.
+    """
+
+    def __init__(self, id, type, is_superadmin=None, row=None):
+        self.id = id
+        self.type = type
+        self._is_superadmin = is_superadmin  # None when the token predates the claim
+        self._row = row
+        self._snapshot = None
+
+    @property
+    def is_admin(self):
+        return self.type == 'admin'
+
+    @property
+    def is_client(self):
+        return self.type == 'client'
+
+    @property
+    def is_superadmin(self):
+        if not self.is_admin:
+            return False
+        if self._is_superadmin is None:
+            snapshot = self.snapshot
+            self._is_superadmin = bool(snapshot and snapshot['is_superadmin'])
+        return self._is_superadmin
+
+    @property
+    def snapshot(self):
+        """Cached copy of the row's display fields, or None if the row no longer exists"""
+        if self._snapshot is None:
+            self._snapshot = principal_cache.get(self.type, self.id, self._load_snapshot)
+        return self._snapshot
+
+    def _load_snapshot(self):
+        row = self.row
+        return snapshot_of(self.type, row) if row is not None else None
+
+    @property
+    def row(self):
+        """The Client or Admin row, loaded once on demand"""
+        if self._row is None:
+            model = Admin if self.is_admin else Client
+            self._row = model.query.get(self.id)
+        return self._row
+
+    def owns(self, booking):
+        return self.is_client and booking.client_id == self.id
+
+    def can_access(self, booking):
+        return self.is_admin or self.owns(booking)
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set above, e.g. name, email
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in SNAPSHOT_FIELDS:
+            snapshot = self.snapshot
+            if snapshot is None:
+                raise AttributeError(name)
+            return snapshot[name]
+        row = self.row
+        if row is None:
+            raise AttributeError(name)
+        return getattr(row, name)
+
+    def __repr__(self):
+        return f"Principal ({self.type}:{self.id})"
+
+def subject_for(user):
+    """Typed token subject for a Client or Admin"""
+    principal_type = 'admin' if isinstance(user, Admin) else 'client'
+    return f"{SUBJECT_PREFIXES[principal_type]}:{user.id}"
+
+def parse_subject(subject):
+    """
+    Split a token subject into (principal_type, id).
+
+    Returns (None, id) for bare-integer subjects issued before typed subjects,
+    and None if the subject is malformed.
+    """
+    prefix, _, raw_id = str(subject).rpartition(':')
+    if prefix and prefix not in SUBJECT_TYPES:
+        return None
+    try:
+        principal_id = int(raw_id)
+    except ValueError:
+        return None
+    return SUBJECT_TYPES.get(prefix), principal_id
+
+def principal_claims(user):
+    """Claims to embed in tokens issued for a Client or Admin"""
+    if isinstance(user, Admin):
+        return {'role': ADMIN_ROLE, 'is_superadmin': bool(user.is_superadmin), 'email': user.email}
+    return {'role': CLIENT_ROLE, 'email': user.email}
+
+def _legacy_principal(identity):
+    """Tokens issued without a role claim: probe both tables as before"""
+    logger.info(f"Resolving legacy token without role claim for identity {identity}")
+    client = Client.query.get(identity)
+    if client:
+        return Principal(client.id, 'client', row=client)
+    admin = Admin.query.get(identity)
+    if admin:
+        return Principal(admin.id, 'admin', is_superadmin=admin.is_superadmin, row=admin)
+    return None
+
+def principal_from_claims(jwt_data):
+    """Build the request principal from decoded token data, reusing it within a request"""
+    cached = g.get('_principal')
+    if cached is not None and cached[0] == jwt_data.get('jti'):
+        return cached[1]
+
+    parsed = parse_subject(jwt_data.get('sub'))
+    if parsed is None:
+        logger.error(f"Invalid user_id format: {jwt_data.get('sub')}")
+        return None
+    principal_type, identity = parsed
+
+    if principal_type is None:
+        # Bare-integer subject from a token issued before typed subjects
+        if not current_app.config.get('JWT_ACCEPT_LEGACY_SUBJECTS', True):
+            logger.warning(f"Rejecting token with legacy subject {identity}")
+            return None
+        role = jwt_data.get('role')
+        if role == ADMIN_ROLE:
+            principal_type = 'admin'
+        elif role == CLIENT_ROLE:
+            principal_type = 'client'
+
+    if principal_type == 'admin':
+        principal = Principal(identity, 'admin', is_superadmin=jwt_data.get('is_superadmin'))
+    elif principal_type == 'client':
+        principal = Principal(identity, 'client')
+    else:
+        principal = _legacy_principal(identity)
+
+    g._principal = (jwt_data.get('jti'), principal)
+    return principal
+
+def current_principal():
+    """The principal for the current request; requires a verified JWT"""
+    return current_user
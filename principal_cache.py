@@ -0,0 +1,125 @@
+from cachetools import TTLCache
+from importlib import import_module
+import threading
+import logging
+from models import db, Client, Admin
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL_SECONDS = 60
+
+class LocalCacheBackend:
+    """Bounded LRU cache with a TTL, private to this worker process"""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+
+    def delete(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def __len__(self):
+        return len(self._cache)
+
+class PrincipalCache:
+    """
+    Snapshots of Client/Admin rows shared by all requests in a worker.
+
+    Snapshots are plain dicts so a shared backend (anything with get/set/delete,
+    e.g. a Redis wrapper) can hold them for several workers. Entries are dropped
+    when a committed session changes or deletes the row; with the local backend,
+    other workers see such changes once the TTL expires.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalCacheBackend()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def configure(self, app):
+        """Build the backend from PRINCIPAL_CACHE_BACKEND (dotted path to a class), _SIZE and _TTL"""
+        backend_path = app.config.get('PRINCIPAL_CACHE_BACKEND')
+        backend_class = LocalCacheBackend
+        if backend_path:
+            module_name, class_name = backend_path.rsplit('.', 1)
+            backend_class = getattr(import_module(module_name), class_name)
+        self.backend = backend_class(
+            maxsize=app.config.get('PRINCIPAL_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+            ttl=app.config.get('PRINCIPAL_CACHE_TTL', DEFAULT_CACHE_TTL_SECONDS)
+        )
+
+    @staticmethod
+    def key(principal_type, principal_id):
+        return f"principal:{principal_type}:{principal_id}"
+
+    def get(self, principal_type, principal_id, loader):
+        """Return the cached snapshot, calling loader() to build it on a miss"""
+        key = self.key(principal_type, principal_id)
+        snapshot = self.backend.get(key)
+        if snapshot is not None:
+            with self._lock:
+                self.hits += 1
+            return snapshot
+        with self._lock:
+            self.misses += 1
+        snapshot = loader()
+        if snapshot is not None:
+            self.backend.set(key, snapshot)
+        return snapshot
+
+    def invalidate(self, principal_type, principal_id):
+        self.backend.delete(self.key(principal_type, principal_id))
+        with self._lock:
+            self.invalidations += 1
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+def snapshot_of(principal_type, row):
+    """The cached fields of a Client or Admin row"""
+    return {
+        'id': row.id,
+        'type': principal_type,
+        'is_superadmin': bool(getattr(row, 'is_superadmin', False)),
+        'name': row.name,
+        'email': row.email,
+    }
+
+principal_cache = PrincipalCache()
+
+@db.event.listens_for(db.session, 'after_flush')
+def _collect_principal_changes(session, flush_context):
+    changed = session.info.setdefault('principal_changes', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Client):
+            changed.add(('client', obj.id))
+        elif isinstance(obj, Admin):
+            changed.add(('admin', obj.id))
+
+@db.event.listens_for(db.session, 'after_commit')
+def _invalidate_principals(session):
+    # Covers login/logout token writes, profile edits, deletes and password resets alike
+    for principal_type, principal_id in session.info.pop('principal_changes', ()):
+        principal_cache.invalidate(principal_type, principal_id)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _discard_principal_changes(session):
+    session.info.pop('principal_changes', None)
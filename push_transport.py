@@ -0,0 +1,170 @@
+from importlib import import_module
+import random
+import threading
+import time
+import logging
+import firebase_notification
+
+logger = logging.getLogger(__name__)
+
+class FCMTransport:
+    """Sends through Firebase Cloud Messaging (firebase_notification)"""
+
+    name = 'fcm'
+
+    @classmethod
+    def from_config(cls, config):
+        return cls()
+
+    def send_batch(self, notifications):
+        return firebase_notification.send_batch(notifications)
+
+    def update_topic_membership(self, tokens, topic, subscribe=True):
+        return firebase_notification.update_topic_membership(tokens, topic, subscribe)
+
+class FakeTransport:
+    """
+    In-process stand-in for FCM that records what it is asked to send.
+
+    Each request sleeps for latency_ms (plus up to jitter_ms), so dispatcher and
+    benchmark timings are realistic without a Firebase project. quota caps
+    accepted messages per second the way FCM's project quota does; messages over
+    it fail with a retryable QuotaExceededError. token_errors maps a token to
+    'unregistered', 'invalid' or 'unavailable', and error_rate fails that share
+    of the other messages with a transient error. The errors are the real
+    firebase_admin exceptions, so they are classified exactly as FCM's are.
+    """
+
+    name = 'fake'
+    TOPIC_REASONS = {'unregistered': 'NOT_FOUND', 'invalid': 'INVALID_ARGUMENT', 'unavailable': 'INTERNAL'}
+
+    def __init__(self, latency_ms=0, jitter_ms=0, quota=None, token_errors=None, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.quota = quota
+        self.token_errors = dict(token_errors or {})
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._quota_window = None  # (second, messages accepted in it)
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            latency_ms=config.get('NOTIFICATION_FAKE_LATENCY_MS', 0),
+            jitter_ms=config.get('NOTIFICATION_FAKE_JITTER_MS', 0),
+            quota=config.get('NOTIFICATION_FAKE_QUOTA'),
+            error_rate=config.get('NOTIFICATION_FAKE_ERROR_RATE', 0.0),
+        )
+
+    def reset(self):
+        with self._lock:
+            self.messages = []  # (monotonic time received, notification dict)
+            self.requests = 0
+            self.topics = {}  # topic -> set of tokens
+
+    def _wait(self):
+        delay = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+    def _take_quota(self, now):
+        """True if one more message fits in this second's quota"""
+        if not self.quota:
+            return True
+        second = int(now)
+        if self._quota_window is None or self._quota_window[0] != second:
+            self._quota_window = (second, 0)
+        if self._quota_window[1] >= self.quota:
+            return False
+        self._quota_window = (second, self._quota_window[1] + 1)
+        return True
+
+    def _error(self, kind, target):
+        from firebase_admin import exceptions, messaging
+        if kind == 'unregistered':
+            return messaging.UnregisteredError(f'Requested entity was not found: {target}')
+        if kind == 'invalid':
+            return exceptions.InvalidArgumentError('The registration token is not a valid FCM registration token')
+        if kind == 'quota':
+            return messaging.QuotaExceededError('Sending quota exceeded')
+        return exceptions.UnavailableError('The server is temporarily unavailable')
+
+    def send_batch(self, notifications):
+        if len(notifications) > firebase_notification.FCM_BATCH_LIMIT:
+            raise ValueError(f'send_each accepts at most {firebase_notification.FCM_BATCH_LIMIT} messages')
+        self._wait()
+        results = []
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            for notification in notifications:
+                target = notification.get('token') or notification.get('topic')
+                kind = self.token_errors.get(target)
+                if kind is None and self.error_rate and self._random.random() < self.error_rate:
+                    kind = 'unavailable'
+                if kind is None and not self._take_quota(time.time()):
+                    kind = 'quota'
+                if kind is not None:
+                    results.append(self._error(kind, target))
+                    continue
+                self.messages.append((now, notification))
+                results.append(None)
+        return results
+
+    def update_topic_membership(self, tokens, topic, subscribe=True):
+        if len(tokens) > firebase_notification.FCM_TOPIC_BATCH_LIMIT:
+            raise ValueError(f'Topic requests accept at most {firebase_notification.FCM_TOPIC_BATCH_LIMIT} tokens')
+        self._wait()
+        errors = []
+        with self._lock:
+            self.requests += 1
+            members = self.topics.setdefault(topic, set())
+            for index, token in enumerate(tokens):
+                kind = self.token_errors.get(token)
+                if kind is not None:
+                    errors.append((index, self.TOPIC_REASONS.get(kind, 'INTERNAL')))
+                elif subscribe:
+                    members.add(token)
+                else:
+                    members.discard(token)
+        return errors
+
+    def metrics(self):
+        return {'requests': self.requests, 'messages': len(self.messages)}
+
+class PushTransport:
+    """
+    Where notifications and topic changes are sent.
+
+    NOTIFICATION_TRANSPORT may name another class with the same send_batch and
+    update_topic_membership methods (dotted path), e.g. push_transport.FakeTransport
+    to run the whole pipeline locally without a Firebase project. FCM is the default.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or FCMTransport()
+
+    def configure(self, app):
+        backend_path = app.config.get('NOTIFICATION_TRANSPORT')
+        backend_class = FCMTransport
+        if backend_path:
+            module_name, class_name = backend_path.rsplit('.', 1)
+            backend_class = getattr(import_module(module_name), class_name)
+        self.backend = backend_class.from_config(app.config)
+        if backend_class is not FCMTransport:
+            logger.warning(f"Push notifications go to {backend_path}, not FCM")
+
+    def send_batch(self, notifications):
+        return self.backend.send_batch(notifications)
+
+    def update_topic_membership(self, tokens, topic, subscribe=True):
+        return self.backend.update_topic_membership(tokens, topic, subscribe)
+
+    def metrics(self):
+        name = getattr(self.backend, 'name', type(self.backend).__name__)
+        backend_metrics = getattr(self.backend, 'metrics', None)
+        return {'backend': name, **(backend_metrics() if backend_metrics else {})}
+
+push_transport = PushTransport()
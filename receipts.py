@@ -0,0 +1,117 @@
+from flask import request, current_app
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required
+from models import Booking, Payment, Client
+from principal import current_principal
+from email_templates import email_templates
+from email_utils import payment_receipt_context
+import os
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_TEMPLATE = 'payment_receipt.html'
+RECEIPT_STATUSES = ('paid', 'confirmed')
+DEFAULT_CACHE_SECONDS = 86400
+
+class ReceiptArchive:
+    """
+    Rendered payment receipts, one HTML file per payment and template version.
+
+    A receipt is rendered the first time it is asked for and written to
+    RECEIPT_ARCHIVE_DIR/<payment id>/<template version>.html; every later
+    download is a file read. The version is a hash of the compiled template,
+    so editing payment_receipt.html makes the next download render a new file
+    (and remove the old one) without any explicit invalidation. The name of the
+    file is also its ETag, so a client revalidating a copy it already has is
+    answered from a stat.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.cache_seconds = DEFAULT_CACHE_SECONDS
+        self._lock = threading.Lock()
+        self.served = 0
+        self.not_modified = 0
+        self.rendered = 0
+
+    def configure(self, app):
+        self.directory = app.config.get('RECEIPT_ARCHIVE_DIR') or os.path.join(app.instance_path, 'receipts')
+        self.cache_seconds = app.config.get('RECEIPT_CACHE_SECONDS', DEFAULT_CACHE_SECONDS)
+
+    def path(self, payment_id, version):
+        return os.path.join(self.directory, str(payment_id), f"{version}.html")
+
+    def get(self, booking, payment, client):
+        """The receipt's path, rendering and storing it first if this template version has none"""
+        template = email_templates.get(RECEIPT_TEMPLATE)
+        path = self.path(payment.id, template.version)
+        if os.path.exists(path):
+            return path
+        # The receipt is dated when the payment was completed, so a re-render only differs by template
+        context = payment_receipt_context(booking, payment, client, payment.updated_at or payment.created_at)
+        html = email_templates.render(RECEIPT_TEMPLATE, context)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written under a temporary name and renamed, so a concurrent download never reads half a file
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(temporary, path)
+        with self._lock:
+            self.rendered += 1
+        self._prune(directory, keep=os.path.basename(path))
+        logger.info(f"Archived receipt for payment {payment.id} (template {template.version})")
+        return path
+
+    def _prune(self, directory, keep):
+        """Remove receipts rendered from earlier template versions"""
+        for name in os.listdir(directory):
+            if name != keep and name.endswith('.html'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def response(self, booking, payment, client):
+        version = email_templates.get(RECEIPT_TEMPLATE).version
+        etag = f"{payment.id}-{version}"
+        if request.if_none_match.contains(etag) and os.path.exists(self.path(payment.id, version)):
+            with self._lock:
+                self.not_modified += 1
+            response = current_app.response_class(status=304)
+        else:
+            with open(self.get(booking, payment, client), 'rb') as f:
+                response = current_app.response_class(f.read(), mimetype='text/html')
+            with self._lock:
+                self.served += 1
+        response.set_etag(etag)
+        # Receipts belong to one client, so only their own browser may keep a copy
+        response.cache_control.private = True
+        response.cache_control.max_age = self.cache_seconds
+        return response
+
+    def metrics(self):
+        return {'served': self.served, 'not_modified': self.not_modified, 'rendered': self.rendered}
+
+receipt_archive = ReceiptArchive()
+
+class ReceiptResource(Resource):
+    @jwt_required()
+    def get(self, booking_id):
+        """The payment receipt of a paid booking, as HTML"""
+        booking = Booking.query.get_or_404(booking_id)
+        if not current_principal().can_access(booking):
+            return {"error": "Unauthorized"}, 403
+
+        payment = Payment.query.get(booking.payment_id) if booking.payment_id else None
+        if booking.status not in RECEIPT_STATUSES or payment is None:
+            return {"error": "No receipt for this booking"}, 404
+
+        try:
+            return receipt_archive.response(booking, payment, Client.query.get(booking.client_id))
+        except Exception as e:
+            logger.error(f"Error serving receipt for booking {booking_id}: {str(e)}")
+            return {"error": "Error generating receipt"}, 500
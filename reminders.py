@@ -0,0 +1,317 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from sqlalchemy import and_, inspect
+from sqlalchemy.exc import IntegrityError
+import heapq
+import itertools
+import threading
+import time
+import logging
+from models import db, Booking, BookingReminder, Client, booking_now, DEFAULT_BOOKING_TIMEZONE
+from notifications import enqueue_user_notifications
+from email_queue import enqueue_email
+
+logger = logging.getLogger(__name__)
+
+# Reminders go out this many minutes before a paid flight
+REMINDER_OFFSETS_MINUTES = (24 * 60, 2 * 60)
+REMINDER_STATUSES = ('paid', 'confirmed')
+# Reminders due within this many minutes are held in memory; the rest stay in the database
+HORIZON_MINUTES = 6 * 60
+REFRESH_SECONDS = 600
+BATCH_SIZE = 500
+
+class ReminderScheduler:
+    """
+    Sends pre-flight reminders for paid bookings from an in-memory heap.
+
+    Only reminders due within the next REMINDER_HORIZON_MINUTES are held, ordered
+    by due time, so the thread sleeps until the earliest one instead of polling
+    the bookings table. Every REMINDER_REFRESH_SECONDS (and on start) the window
+    is reloaded with one range query per offset on the (status, scheduled_at)
+    index, skipping reminders already in booking_reminders. Bookings paid or
+    rescheduled in this worker are added as soon as their session commits.
+
+    Entries are never removed when a booking changes: each due batch is checked
+    against the database before sending, so a cancelled or rescheduled booking's
+    old entry is simply dropped. A reminder that is late (e.g. the worker was
+    down) is still sent until the flight is halfway to the next, closer reminder.
+    The unique key on booking_reminders keeps workers from sending the same
+    reminder twice. Due times are on the booking's own clock: scheduled_at is
+    wall-clock time in BOOKING_TIMEZONE, so "now" is taken there too.
+    """
+
+    def __init__(self):
+        self.offsets = sorted(REMINDER_OFFSETS_MINUTES, reverse=True)
+        self.horizon = timedelta(minutes=HORIZON_MINUTES)
+        self.refresh_seconds = REFRESH_SECONDS
+        self.batch_size = BATCH_SIZE
+        self.timezone = ZoneInfo(DEFAULT_BOOKING_TIMEZONE)
+        self._heap = []  # (due_at, sequence, booking_id, offset_minutes, scheduled_at)
+        self._queued = set()  # (booking_id, offset_minutes, scheduled_at) in the heap
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._app = None
+        self._stopped = False
+        self._loaded_until = None
+        self._refresh_due = 0
+        self.sent = 0
+        self.skipped = 0
+        self.batches = 0
+        self.refreshes = 0
+        self.refresh_seconds_last = 0.0
+
+    def configure(self, app):
+        self.offsets = sorted(app.config.get('REMINDER_OFFSETS_MINUTES', REMINDER_OFFSETS_MINUTES), reverse=True)
+        self.horizon = timedelta(minutes=app.config.get('REMINDER_HORIZON_MINUTES', HORIZON_MINUTES))
+        self.refresh_seconds = app.config.get('REMINDER_REFRESH_SECONDS', REFRESH_SECONDS)
+        self.batch_size = app.config.get('REMINDER_BATCH_SIZE', BATCH_SIZE)
+        self.timezone = ZoneInfo(app.config.get('BOOKING_TIMEZONE') or DEFAULT_BOOKING_TIMEZONE)
+
+    def start(self, app):
+        """Start the reminder thread; call after forking so each worker process gets its own"""
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._stopped = False
+            self._refresh_due = 0
+            self._thread = threading.Thread(target=self._run, name='heli-reminders', daemon=True)
+            self._thread.start()
+        logger.info(f"Reminder scheduler started for offsets {self.offsets} minutes")
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def now(self):
+        """Current wall-clock time in BOOKING_TIMEZONE, the clock scheduled_at and due times are on"""
+        return booking_now(self.timezone)
+
+    def _cutoff(self, offset):
+        """
+        How close to the flight a late reminder may still go out: halfway to the
+        next, closer reminder (or to departure for the last one). A booking paid
+        three hours before its flight gets the 2h reminder, not a late 24h one too.
+        """
+        closer = max((o for o in self.offsets if o < offset), default=0)
+        return timedelta(minutes=(offset + closer) / 2)
+
+    def _push(self, booking_id, offset, scheduled_at):
+        key = (booking_id, offset, scheduled_at)
+        if key not in self._queued:
+            self._queued.add(key)
+            heapq.heappush(self._heap, (scheduled_at - timedelta(minutes=offset), next(self._sequence), *key))
+
+    def refresh(self, now=None):
+        """Load every unsent reminder due before now + horizon; returns how many were loaded"""
+        started = time.perf_counter()
+        now = now or self.now()
+        until = now + self.horizon
+        entries = []
+        for offset in self.offsets:
+            sent = and_(
+                BookingReminder.booking_id == Booking.id,
+                BookingReminder.offset_minutes == offset,
+                BookingReminder.scheduled_at == Booking.scheduled_at
+            )
+            entries.extend(
+                (booking_id, offset, scheduled_at)
+                for booking_id, scheduled_at in db.session.query(Booking.id, Booking.scheduled_at).outerjoin(
+                    BookingReminder, sent
+                ).filter(
+                    Booking.status.in_(REMINDER_STATUSES),
+                    Booking.scheduled_at > now + self._cutoff(offset),
+                    Booking.scheduled_at <= until + timedelta(minutes=offset),
+                    BookingReminder.id.is_(None)
+                )
+            )
+        with self._condition:
+            for entry in entries:
+                self._push(*entry)
+            self._loaded_until = until
+            self.refreshes += 1
+            self.refresh_seconds_last = time.perf_counter() - started
+            self._condition.notify()
+        logger.info(f"Loaded {len(entries)} reminders due before {until:%Y-%m-%d %H:%M} "
+                    f"({self.refresh_seconds_last * 1000:.0f}ms)")
+        return len(entries)
+
+    def update_booking(self, booking_id, status, scheduled_at, now=None):
+        """Queue the reminders of a committed paid booking that fall within the loaded window"""
+        if status not in REMINDER_STATUSES or scheduled_at is None:
+            return
+        now = now or self.now()
+        with self._condition:
+            if self._loaded_until is None:
+                return
+            for offset in self.offsets:
+                if (scheduled_at - timedelta(minutes=offset) <= self._loaded_until
+                        and scheduled_at - now > self._cutoff(offset)):
+                    self._push(booking_id, offset, scheduled_at)
+            self._condition.notify()
+
+    def _pop_due(self, now):
+        with self._condition:
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                key = heapq.heappop(self._heap)[2:]
+                self._queued.discard(key)
+                batch.append(key)
+            return batch
+
+    def send_due(self, now=None):
+        """Send every reminder that is due, a batch at a time; returns the number sent"""
+        now = now or self.now()
+        sent = 0
+        while True:
+            batch = self._pop_due(now)
+            if not batch:
+                return sent
+            sent += self._send(batch, now)
+
+    def _send(self, batch, now, retry=True):
+        ids = {booking_id for booking_id, _, _ in batch}
+        bookings = {
+            row.id: row for row in db.session.query(
+                Booking.id, Booking.client_id, Booking.scheduled_at
+            ).filter(Booking.id.in_(ids), Booking.status.in_(REMINDER_STATUSES))
+        }
+        already_sent = set(map(tuple, db.session.query(
+            BookingReminder.booking_id, BookingReminder.offset_minutes, BookingReminder.scheduled_at
+        ).filter(BookingReminder.booking_id.in_(ids))))
+        # Drop entries for bookings cancelled, rescheduled or reminded (by another worker) since they were queued
+        due = [
+            (booking_id, offset, scheduled_at) for booking_id, offset, scheduled_at in batch
+            if booking_id in bookings
+            and bookings[booking_id].scheduled_at == scheduled_at
+            and (booking_id, offset, scheduled_at) not in already_sent
+            and scheduled_at - now > self._cutoff(offset)
+        ]
+        if due:
+            # Bookkeeping timestamps are UTC like every other table's; only flight times are local
+            created_at = datetime.utcnow()
+            db.session.bulk_insert_mappings(BookingReminder, [
+                {'booking_id': booking_id, 'offset_minutes': offset, 'scheduled_at': scheduled_at,
+                 'created_at': created_at, 'updated_at': created_at}
+                for booking_id, offset, scheduled_at in due
+            ])
+            self._notify([bookings[booking_id] for booking_id, _, _ in due], now)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker reminded some of these first; the retry's ledger check leaves them out
+            db.session.rollback()
+            if not retry:
+                raise
+            return self._send(batch, now, retry=False)
+        with self._condition:
+            self.sent += len(due)
+            self.skipped += len(batch) - len(due)
+            self.batches += 1
+        if due:
+            logger.info(f"Queued {len(due)} flight reminders")
+        return len(due)
+
+    def _notify(self, bookings, now):
+        """Queue a push and an email per reminder; committed with the ledger rows"""
+        emails = dict(db.session.query(Client.id, Client.email).filter(
+            Client.id.in_({booking.client_id for booking in bookings})
+        ))
+        notifications = []
+        for booking in bookings:
+            hours = max(1, round((booking.scheduled_at - now).total_seconds() / 3600))
+            body = (f"Your flight for booking #{booking.id} departs in about {hours} hour{'s' if hours != 1 else ''}, "
+                    f"at {booking.scheduled_at:%H:%M} on {booking.scheduled_at:%Y-%m-%d}")
+            notifications.append((
+                f"c:{booking.client_id}",
+                'Flight reminder',
+                body,
+                {'type': 'flight_reminder', 'booking_id': booking.id}
+            ))
+            enqueue_email(emails.get(booking.client_id), f"Flight Reminder - Booking #{booking.id}", body=body)
+        enqueue_user_notifications(notifications)
+
+    def _next_wait(self):
+        """Seconds until the earliest reminder or the next refresh, whichever comes first"""
+        wait = self._refresh_due - time.monotonic()
+        if self._heap:
+            wait = min(wait, (self._heap[0][0] - self.now()).total_seconds())
+        return wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and self._next_wait() > 0:
+                    self._condition.wait(self._next_wait())
+                if self._stopped:
+                    return
+                refresh = time.monotonic() >= self._refresh_due
+                if refresh:
+                    self._refresh_due = time.monotonic() + self.refresh_seconds
+            with self._app.app_context():
+                try:
+                    if refresh:
+                        self.refresh()
+                    self.send_due()
+                except Exception as e:
+                    logger.error(f"Sending flight reminders failed: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def metrics(self):
+        return {
+            'queued': len(self._heap),
+            'loaded_until': self._loaded_until.isoformat() if self._loaded_until else None,
+            'refreshes': self.refreshes,
+            'last_refresh_ms': round(self.refresh_seconds_last * 1000, 1),
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'batches': self.batches,
+        }
+
+reminder_scheduler = ReminderScheduler()
+
+def send_reminders():
+    """Load and send every due reminder once, e.g. from cron when the scheduler thread is off"""
+    reminder_scheduler.refresh()
+    return reminder_scheduler.send_due()
+
+def prune_booking_reminders(now=None):
+    """Forget reminders of flights that have departed"""
+    deleted = BookingReminder.query.filter(
+        BookingReminder.scheduled_at < (now or booking_now())
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} sent flight reminders")
+    return deleted
+
+@db.event.listens_for(db.session, 'after_flush')
+def _collect_reminder_changes(session, flush_context):
+    # Snapshot values now, tagged with the savepoint, as the availability calendar does
+    savepoint = session.get_nested_transaction()
+    changes = session.info.setdefault('reminder_changes', [])
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Booking) or obj.status not in REMINDER_STATUSES:
+            continue
+        # Only payments and reschedules; other edits (e.g. chat activity) leave the reminders as they were
+        attrs = inspect(obj).attrs
+        if obj in session.new or attrs.status.history.has_changes() or attrs.scheduled_at.history.has_changes():
+            changes.append((savepoint, obj.id, obj.status, obj.scheduled_at))
+
+@db.event.listens_for(db.session, 'after_commit')
+def _apply_reminder_changes(session):
+    for _, booking_id, status, scheduled_at in session.info.pop('reminder_changes', []):
+        reminder_scheduler.update_booking(booking_id, status, scheduled_at)
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def _discard_reminder_changes(session, previous_transaction):
+    if previous_transaction.nested:
+        changes = session.info.get('reminder_changes', [])
+        session.info['reminder_changes'] = [change for change in changes if change[0] is not previous_transaction]
+    else:
+        session.info.pop('reminder_changes', None)
@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from cachetools import TTLCache
+import math
+import threading
+import time
+import logging
+from models import db, RevokedToken
+
+logger = logging.getLogger(__name__)
+
+# Pick up revocations made by other workers at most this many seconds late
+REVOCATION_SYNC_SECONDS = 5
+# Each sync re-reads rows created this long before the previous one, for transactions that committed late
+REVOCATION_SYNC_MARGIN_SECONDS = 60
+DEFAULT_FILTER_CAPACITY = 100000
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+EXACT_CACHE_SIZE = 10000
+EXACT_CACHE_TTL_SECONDS = 300
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings; no false negatives, tunable false positives"""
+
+    def __init__(self, capacity=DEFAULT_FILTER_CAPACITY, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # Double hashing: two 64-bit halves of one digest give all k positions
+        digest = blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+class RevocationList:
+    """
+    Answers "is this jti revoked?" for every authenticated request.
+
+    A Bloom filter of all denylisted jtis answers "no" for almost every token
+    without touching the database. Only filter hits go to an exact cache and then
+    to the revoked_tokens table. New rows from other workers are merged in every
+    REVOCATION_SYNC_SECONDS; the filter is rebuilt after pruning or once it is full.
+
+    Rows are not committed in id or created_at order, so a sync cannot start
+    after the newest row it has seen. Each one reads everything created since
+    REVOCATION_SYNC_MARGIN_SECONDS before the previous sync, and skips the jtis
+    that sync already merged.
+    """
+
+    def __init__(self, sync_seconds=REVOCATION_SYNC_SECONDS, capacity=DEFAULT_FILTER_CAPACITY,
+                 sync_margin_seconds=REVOCATION_SYNC_MARGIN_SECONDS):
+        self.sync_seconds = sync_seconds
+        self.sync_margin = timedelta(seconds=sync_margin_seconds)
+        self.capacity = capacity
+        self._lock = threading.RLock()
+        self._filter = None
+        self._exact = TTLCache(maxsize=EXACT_CACHE_SIZE, ttl=EXACT_CACHE_TTL_SECONDS)  # jti -> revoked?
+        self._window_start = None  # created_at from which the next sync reads
+        self._recent = set()  # jtis merged from that window
+        self._synced_at = None
+        self.checks = 0
+        self.filter_hits = 0
+        self.db_lookups = 0
+        self.false_positives = 0
+
+    def configure(self, app):
+        self.sync_seconds = app.config.get('REVOCATION_SYNC_SECONDS', REVOCATION_SYNC_SECONDS)
+        self.capacity = app.config.get('REVOCATION_FILTER_CAPACITY', DEFAULT_FILTER_CAPACITY)
+        self.sync_margin = timedelta(
+            seconds=app.config.get('REVOCATION_SYNC_MARGIN_SECONDS', REVOCATION_SYNC_MARGIN_SECONDS)
+        )
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._exact.clear()
+            self._window_start = None
+            self._recent = set()
+            self._synced_at = None
+
+    def load(self):
+        """Rebuild the filter from every unexpired denylist row"""
+        started = datetime.utcnow()
+        rows = db.session.query(RevokedToken.jti, RevokedToken.created_at).filter(
+            RevokedToken.expires_at > started
+        ).all()
+        bloom = BloomFilter(max(self.capacity, 2 * len(rows)))
+        for jti, _ in rows:
+            bloom.add(jti)
+        window_start = started - self.sync_margin
+        with self._lock:
+            self._filter = bloom
+            self._exact.clear()
+            self._window_start = window_start
+            self._recent = {jti for jti, created_at in rows if created_at and created_at >= window_start}
+            self._synced_at = time.monotonic()
+        logger.info(f"Loaded {len(rows)} revoked tokens into the revocation filter")
+
+    def _sync(self):
+        """Merge rows added since the last sync, typically by other workers"""
+        if self._filter is None or self._filter.count >= self._filter.capacity:
+            self.load()
+            return
+        started = datetime.utcnow()
+        jtis = {jti for (jti,) in db.session.query(RevokedToken.jti).filter(
+            RevokedToken.created_at >= self._window_start
+        )}
+        with self._lock:
+            for jti in jtis - self._recent:
+                self._filter.add(jti)
+                self._exact[jti] = True
+            # The next window overlaps this one by the margin, so remember what it already merged
+            self._window_start = started - self.sync_margin
+            self._recent = jtis
+            self._synced_at = time.monotonic()
+
+    def is_revoked(self, jti):
+        if self._synced_at is None or time.monotonic() - self._synced_at > self.sync_seconds:
+            self._sync()
+        self.checks += 1
+        if jti not in self._filter:
+            return False
+        self.filter_hits += 1
+        revoked = self._exact.get(jti)
+        if revoked is None:
+            self.db_lookups += 1
+            revoked = db.session.query(RevokedToken.id).filter_by(jti=jti).first() is not None
+            if not revoked:
+                self.false_positives += 1
+            with self._lock:
+                self._exact[jti] = revoked
+        return revoked
+
+    def remember(self, jtis):
+        """Mark newly committed revocations in this worker without waiting for the next sync"""
+        with self._lock:
+            for jti in jtis:
+                if self._filter is not None:
+                    self._filter.add(jti)
+                self._exact[jti] = True
+
+    def metrics(self):
+        return {
+            'checks': self.checks,
+            'filter_hits': self.filter_hits,
+            'db_lookups': self.db_lookups,
+            'false_positives': self.false_positives,
+            'filter_entries': self._filter.count if self._filter is not None else None,
+        }
+
+revocation_list = RevocationList()
+
+def revoke_token(jwt_data):
+    """Denylist a decoded token until it expires; the caller commits"""
+    jti = jwt_data.get('jti')
+    if not jti:
+        return
+    db.session.add(RevokedToken(jti=jti, expires_at=datetime.utcfromtimestamp(jwt_data['exp'])))
+    db.session.info.setdefault('revoked_jtis', []).append(jti)
+
+def prune_revoked_tokens(now=None):
+    """Delete denylist rows for tokens that have expired anyway, then rebuild this worker's filter"""
+    now = now or datetime.utcnow()
+    deleted = RevokedToken.query.filter(RevokedToken.expires_at < now).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} expired revoked tokens")
+        revocation_list.load()
+    return deleted
+
+@db.event.listens_for(db.session, 'after_commit')
+def _remember_revoked(session):
+    # Applied only once the rows are committed, so a rolled-back logout revokes nothing
+    jtis = session.info.pop('revoked_jtis', None)
+    if jtis:
+        revocation_list.remember(jtis)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_revoked(session):
+    session.info.pop('revoked_jtis', None)
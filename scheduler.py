@@ -0,0 +1,81 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+class Scheduler:
+    """
+    Runs periodic background jobs on a single thread.
+
+    Jobs sit in a heap ordered by their next run time, so the thread sleeps until
+    the earliest one is due instead of polling. Each run gets its own app context
+    and database session.
+    """
+
+    def __init__(self):
+        self._heap = []  # (next_run, sequence, job)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._app = None
+        self._stopped = False
+
+    def add_job(self, name, func, interval_seconds, initial_delay=None):
+        """Run func() every interval_seconds, first after initial_delay (defaults to the interval)"""
+        job = {'name': name, 'func': func, 'interval': interval_seconds}
+        delay = interval_seconds if initial_delay is None else initial_delay
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), job))
+            self._condition.notify()
+
+    def start(self, app):
+        """Start the worker thread; call after forking so each worker process gets its own"""
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='heli-scheduler', daemon=True)
+            self._thread.start()
+        logger.info(f"Scheduler started with {len(self._heap)} jobs")
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _next_due(self):
+        with self._condition:
+            while not self._stopped:
+                if self._heap:
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._heap)[2]
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+            return None
+
+    def _run(self):
+        while True:
+            job = self._next_due()
+            if job is None:
+                return
+            started = time.monotonic()
+            with self._app.app_context():
+                try:
+                    job['func']()
+                except Exception as e:
+                    logger.error(f"Scheduled job {job['name']} failed: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            logger.debug(f"Scheduled job {job['name']} took {time.monotonic() - started:.3f}s")
+            with self._condition:
+                heapq.heappush(self._heap, (started + job['interval'], next(self._sequence), job))
+
+scheduler = Scheduler()
@@ -0,0 +1,238 @@
+from flask import current_app
+from flask_restful import Resource
+from jwt import PyJWK, InvalidTokenError
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+import json
+import os
+import secrets
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How often each worker checks the JWKS file for a rotated key
+KEY_RELOAD_SECONDS = 30
+# How long verifiers may cache GET /.well-known/jwks.json
+JWKS_MAX_AGE_SECONDS = 300
+# A rotated key is published at once but only signs after this long, by when every worker serves it
+# and no verifier still holds a cached key set without it
+KEY_PROMOTION_SECONDS = KEY_RELOAD_SECONDS + JWKS_MAX_AGE_SECONDS
+SUPPORTED_ALGORITHMS = ('RS256', 'EdDSA')
+SYMMETRIC_ALGORITHM = 'HS256'
+
+def generate_jwk(algorithm='EdDSA'):
+    """A new private JWK (dict) with a random kid"""
+    if algorithm == 'EdDSA':
+        jwk = OKPAlgorithm.to_jwk(ed25519.Ed25519PrivateKey.generate(), as_dict=True)
+    elif algorithm == 'RS256':
+        jwk = RSAAlgorithm.to_jwk(rsa.generate_private_key(public_exponent=65537, key_size=2048), as_dict=True)
+    else:
+        raise ValueError(f"Unsupported signing algorithm {algorithm}; use one of {', '.join(SUPPORTED_ALGORITHMS)}")
+    jwk.pop('key_ops', None)
+    jwk.update({'kid': uuid.uuid4().hex[:16], 'alg': algorithm, 'use': 'sig'})
+    return jwk
+
+def public_jwk(jwk):
+    """The public half of a private JWK"""
+    key = PyJWK(jwk).key.public_key()
+    if jwk['alg'] == 'EdDSA':
+        public = OKPAlgorithm.to_jwk(key, as_dict=True)
+    else:
+        public = RSAAlgorithm.to_jwk(key, as_dict=True)
+    public.pop('key_ops', None)
+    public.update({'kid': jwk['kid'], 'alg': jwk['alg'], 'use': 'sig'})
+    return public
+
+class SigningKeys:
+    """
+    Keys used to sign and verify JWTs.
+
+    With JWT_JWKS_FILE set, tokens are signed with the first (private) key in that
+    JWKS file and carry its kid; every key in the file is accepted for verification,
+    so a new key can be prepended while tokens signed with older ones stay valid.
+    A key with a signs_from time (Unix seconds) is verify-only until then, which
+    gives verifiers time to fetch it before any token is signed with it. Parsed
+    keys are cached and the file is re-read only when it changes.
+
+    Without it, tokens are HS256-signed with JWT_SECRET_KEY. While migrating, a
+    configured JWT_SECRET_KEY still verifies HS256 tokens that carry no kid.
+    """
+
+    def __init__(self):
+        self.jwks_file = None
+        self.secret = None
+        self.accept_symmetric = True
+        self._lock = threading.Lock()
+        self._active = None  # (kid, algorithm, private key)
+        self._signers = []  # (signs_from, kid, algorithm, private key), in file order
+        self._public_keys = {}  # kid -> (algorithm, public key)
+        self._public_jwks = {'keys': []}
+        self._mtime = None
+        self._checked_at = None
+
+    @property
+    def asymmetric(self):
+        return bool(self.jwks_file)
+
+    def configure(self, app):
+        self.jwks_file = app.config.get('JWT_JWKS_FILE')
+        if self.jwks_file and not os.path.exists(self.jwks_file):
+            logger.error(f"JWT_JWKS_FILE {self.jwks_file} does not exist; falling back to HS256. "
+                         "Create it with `flask rotate-signing-key`.")
+            self.jwks_file = None
+        self.secret = app.config.get('JWT_SECRET_KEY')
+        self.accept_symmetric = bool(self.secret)
+        if not self.secret:
+            if not self.asymmetric and not (app.debug or app.testing):
+                # A per-process key would make tokens fail at random across workers and after restarts
+                raise RuntimeError("JWT_SECRET_KEY is not set; set it, or JWT_JWKS_FILE to sign with EdDSA/RS256")
+            if not self.asymmetric:
+                logger.warning("JWT_SECRET_KEY is not set; using a random per-process key for development.")
+            # With a JWKS file HS256 tokens are refused, so this key never signs or verifies anything
+            app.config['JWT_SECRET_KEY'] = self.secret = secrets.token_urlsafe(32)
+            self.accept_symmetric = not self.asymmetric
+        if self.asymmetric:
+            self.load(app)
+        else:
+            app.config['JWT_ALGORITHM'] = SYMMETRIC_ALGORITHM
+
+    def load(self, app=None):
+        """Parse the JWKS file; the first key past its signs_from time signs, all keys verify"""
+        with open(self.jwks_file) as f:
+            jwks = json.load(f)
+        keys = jwks.get('keys') or []
+        if not keys:
+            raise ValueError(f"{self.jwks_file} contains no keys")
+
+        public_keys = {}
+        signers = []
+        for jwk in keys:
+            if jwk.get('alg') not in SUPPORTED_ALGORITHMS or not jwk.get('kid'):
+                raise ValueError(f"Every key in {self.jwks_file} needs a kid and an alg of {', '.join(SUPPORTED_ALGORITHMS)}")
+            private_key = PyJWK(jwk).key
+            public_keys[jwk['kid']] = (jwk['alg'], private_key.public_key())
+            signers.append((jwk.get('signs_from', 0), jwk['kid'], jwk['alg'], private_key))
+
+        with self._lock:
+            self._signers = signers
+            self._active = None
+            self._public_keys = public_keys
+            self._public_jwks = {'keys': [public_jwk(jwk) for jwk in keys]}
+            self._mtime = os.path.getmtime(self.jwks_file)
+            self._checked_at = time.monotonic()
+
+        config = (app or current_app).config
+        algorithms = sorted({algorithm for algorithm, _ in public_keys.values()})
+        config['JWT_DECODE_ALGORITHMS'] = algorithms + ([SYMMETRIC_ALGORITHM] if self.accept_symmetric else [])
+        logger.info(f"Loaded {len(public_keys)} JWT signing keys")
+        self._promote(config)
+
+    def _promote(self, config=None):
+        """Sign with the first key whose signs_from time has passed, or the earliest one if none has"""
+        now = time.time()
+        signs_from, kid, algorithm, private_key = next(
+            (signer for signer in self._signers if signer[0] <= now), min(self._signers, key=lambda signer: signer[0])
+        )
+        if self._active is not None and self._active[0] == kid:
+            return
+        with self._lock:
+            self._active = (kid, algorithm, private_key)
+        (config or current_app.config)['JWT_ALGORITHM'] = algorithm
+        logger.info(f"Signing JWTs with kid {kid} ({algorithm})")
+
+    def _maybe_reload(self, force=False):
+        if not self.asymmetric:
+            return
+        if not force and time.monotonic() - self._checked_at < KEY_RELOAD_SECONDS:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            if os.path.getmtime(self.jwks_file) != self._mtime:
+                self.load()
+            else:
+                self._promote()
+        except (OSError, ValueError) as e:
+            logger.error(f"Keeping current JWT keys, could not reload {self.jwks_file}: {str(e)}")
+
+    def signing_key(self):
+        if not self.asymmetric:
+            return self.secret
+        return self._active[2]
+
+    def headers(self):
+        """Extra JWT headers: the kid of the signing key"""
+        if not self.asymmetric:
+            return {}
+        # Headers are built before the key is asked for, so a reload here keeps the kid and key in step
+        self._maybe_reload()
+        return {'kid': self._active[0]}
+
+    def verification_key(self, jwt_header):
+        """Key for a token's header, refusing any algorithm other than the one the key was made for"""
+        kid = jwt_header.get('kid')
+        algorithm = jwt_header.get('alg')
+        if kid is None:
+            if algorithm == SYMMETRIC_ALGORITHM and self.accept_symmetric:
+                return self.secret
+            raise InvalidTokenError("Token has no key id")
+
+        self._maybe_reload()
+        entry = self._public_keys.get(kid)
+        if entry is None:
+            # Possibly rotated by another worker since our last check
+            self._maybe_reload(force=True)
+            entry = self._public_keys.get(kid)
+        if entry is None:
+            raise InvalidTokenError("Unknown key id")
+        key_algorithm, public_key = entry
+        if algorithm != key_algorithm:
+            raise InvalidTokenError("Token algorithm does not match its key")
+        return public_key
+
+    def public_jwks(self):
+        self._maybe_reload()
+        return self._public_jwks
+
+signing_keys = SigningKeys()
+
+def rotate_jwks_file(path, algorithm='EdDSA', keep=2, delay=KEY_PROMOTION_SECONDS):
+    """
+    Prepend a new key to the JWKS file at path (creating it if needed), keeping the
+    newest `keep` older keys for verification. The new key is published at once but
+    only signs `delay` seconds later; the first key of a new file signs straight away.
+
+    Returns the new kid and the Unix time it starts signing.
+    """
+    keys = []
+    if os.path.exists(path):
+        with open(path) as f:
+            keys = json.load(f).get('keys', [])
+    jwk = generate_jwk(algorithm)
+    signs_from = int(time.time())
+    if keys:
+        signs_from += delay
+        jwk['signs_from'] = signs_from
+    # Keys still waiting to sign are kept whatever `keep` says, so the current signer is never dropped for one
+    now = time.time()
+    pending = [key for key in keys if key.get('signs_from', 0) > now]
+    keys = [jwk] + pending + [key for key in keys if key.get('signs_from', 0) <= now][:keep]
+    tmp_path = f"{path}.tmp"
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump({'keys': keys}, f, indent=2)
+    os.replace(tmp_path, path)
+    return jwk['kid'], signs_from
+
+def write_public_jwks(path, private_path):
+    """Write the public keys of private_path to path, for services that verify tokens"""
+    with open(private_path) as f:
+        keys = json.load(f)['keys']
+    with open(path, 'w') as f:
+        json.dump({'keys': [public_jwk(jwk) for jwk in keys]}, f, indent=2)
+
+class JWKSResource(Resource):
+    def get(self):
+        """Public verification keys; other services may also read the exported JWKS file directly"""
+        return signing_keys.public_jwks(), 200, {'Cache-Control': f'public, max-age={JWKS_MAX_AGE_SECONDS}'}
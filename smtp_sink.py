@@ -0,0 +1,147 @@
+"""
+A local SMTP server that accepts mail and keeps it in memory, for development and benchmarks.
+
+    python smtp_sink.py --port 8025
+    MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=False python app.py
+
+It speaks just enough SMTP for smtplib: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP
+and QUIT, with no TLS or authentication. reject maps a recipient address to an
+SMTP reply code (e.g. 550), and latency_ms delays the greeting the way a remote
+server's handshake does.
+"""
+import argparse
+import socketserver
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        sink = self.server.sink
+        with sink._lock:
+            sink.connections += 1
+        if sink.latency_ms:
+            time.sleep(sink.latency_ms / 1000)
+        self.reply('220 smtp-sink ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                self.reply('250-smtp-sink')
+                self.reply('250-8BITMIME')
+                self.reply('250 SIZE 10485760')
+            elif verb == 'HELO':
+                self.reply('250 smtp-sink')
+            elif verb == 'MAIL':
+                sender, recipients = _address(command), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = _address(command)
+                code = sink.reject.get(recipient)
+                if code:
+                    self.reply(f'{code} Recipient rejected')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply('503 No valid recipients')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = self._read_data()
+                sink._received(sender, recipients, data)
+                sender, recipients = None, []
+                self.reply('250 OK queued')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                return b''.join(lines)
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b'..') else line)
+
+def _address(command):
+    _, _, rest = command.partition(':')
+    return rest.strip().split(' ')[0].strip('<>')
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class SMTPSink:
+    """An SMTP server on a background thread; messages holds (sender, recipients, raw bytes)"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, reject=None):
+        self.latency_ms = latency_ms
+        self.reject = dict(reject or {})
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _SMTPHandler)
+        self._server.sink = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _received(self, sender, recipients, data):
+        with self._lock:
+            self.messages.append((sender, recipients, data))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        logger.info(f"SMTP sink listening on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP server that keeps mail in memory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    sink = SMTPSink(args.host, args.port, args.latency_ms).start()
+    try:
+        while True:
+            count = len(sink.messages)
+            time.sleep(5)
+            if len(sink.messages) != count:
+                logger.info(f"{len(sink.messages)} messages received over {sink.connections} connections")
+    except KeyboardInterrupt:
+        sink.stop()
+
+if __name__ == '__main__':
+    main()
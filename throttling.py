@@ -0,0 +1,119 @@
+from functools import wraps
+from importlib import import_module
+from flask import request
+from validation import request_body
+from cachetools import TTLCache
+import math
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# scope -> {'ip': (capacity, period_seconds), 'account': (capacity, period_seconds)}.
+# Each bucket holds `capacity` attempts and refills completely over `period_seconds`.
+DEFAULT_LIMITS = {
+    'login': {'ip': (20, 60), 'account': (5, 60)},
+    'admin_login': {'ip': (10, 60), 'account': (5, 60)},
+    'forgot_password': {'ip': (5, 3600), 'account': (3, 3600)},
+}
+DEFAULT_STORE_SIZE = 100000
+
+class LocalBucketStore:
+    """
+    Token buckets kept in this worker's memory.
+
+    A bucket left alone for a full period is full again, so idle buckets simply
+    expire from a TTL cache per period and memory stays bounded.
+    """
+
+    def __init__(self, maxsize=DEFAULT_STORE_SIZE):
+        self.maxsize = maxsize
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, period):
+        """Take one token from the bucket; returns seconds to wait, or 0 if allowed"""
+        now = time.monotonic()
+        rate = capacity / period
+        with self._lock:
+            cache = self._caches.get(period)
+            if cache is None:
+                cache = self._caches[period] = TTLCache(maxsize=self.maxsize, ttl=period)
+            tokens, updated = cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < 1:
+                cache[key] = (tokens, now)
+                return (1 - tokens) / rate
+            cache[key] = (tokens - 1, now)
+            return 0
+
+class Throttle:
+    """
+    Per-IP and per-account token buckets for unauthenticated, expensive endpoints.
+
+    The store is pluggable (THROTTLE_STORE, a dotted path to a class with the same
+    consume(key, capacity, period) method, e.g. backed by Redis) so several workers
+    can share limits; the default store is per worker.
+    """
+
+    def __init__(self, store=None, limits=None):
+        self.store = store or LocalBucketStore()
+        self.limits = limits or DEFAULT_LIMITS
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def configure(self, app):
+        """Read THROTTLE_ENABLED, THROTTLE_LIMITS, THROTTLE_STORE and THROTTLE_STORE_SIZE from the app config"""
+        store_path = app.config.get('THROTTLE_STORE')
+        store_class = LocalBucketStore
+        if store_path:
+            module_name, class_name = store_path.rsplit('.', 1)
+            store_class = getattr(import_module(module_name), class_name)
+        self.store = store_class(maxsize=app.config.get('THROTTLE_STORE_SIZE', DEFAULT_STORE_SIZE))
+        self.limits = app.config.get('THROTTLE_LIMITS') or DEFAULT_LIMITS
+        self.enabled = app.config.get('THROTTLE_ENABLED', True)
+
+    def check(self, scope, ip, account=None):
+        """Seconds the caller must wait before trying again, or 0 if the attempt may proceed"""
+        if not self.enabled:
+            return 0
+        limits = self.limits[scope]
+        # The IP bucket goes first so a blocked address cannot drain an account's bucket
+        retry_after = self.store.consume(f"{scope}:ip:{ip}", *limits['ip'])
+        if not retry_after and account:
+            retry_after = self.store.consume(f"{scope}:account:{account}", *limits['account'])
+        with self._lock:
+            if retry_after:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        return retry_after
+
+    def metrics(self):
+        return {'allowed': self.allowed, 'rejected': self.rejected}
+
+throttle = Throttle()
+
+def throttled(scope):
+    """Reject the request with a 429 before the handler runs if the caller's IP or email is over its limit"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Read like Schema.parse does, so form-encoded logins count against the account too
+            data = request_body()
+            email = data.get('email') if isinstance(data, dict) else None
+            account = email.strip().lower() if isinstance(email, str) else None
+            retry_after = throttle.check(scope, request.remote_addr, account)
+            if retry_after:
+                logger.warning(f"Throttled {scope} attempt from {request.remote_addr} for {account}")
+                return (
+                    {"message": "Too many attempts, please try again later."},
+                    429,
+                    {'Retry-After': str(math.ceil(retry_after))}
+                )
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
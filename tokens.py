@@ -0,0 +1,94 @@
+from datetime import datetime
+from flask import current_app
+from flask_jwt_extended import create_access_token, create_refresh_token
+import logging
+from models import db, RefreshTokenFamily
+from principal import principal_claims, subject_for
+
+logger = logging.getLogger(__name__)
+
+def _refresh_expires_at(now):
+    return now + current_app.config['JWT_REFRESH_TOKEN_EXPIRES']
+
+def _create_tokens(user, family_id, generation):
+    claims = principal_claims(user)
+    claims['fam'] = family_id
+    subject = subject_for(user)
+    access_token = create_access_token(identity=subject, additional_claims=claims)
+    refresh_token = create_refresh_token(identity=subject, additional_claims={**claims, 'gen': generation})
+    return access_token, refresh_token
+
+def issue_tokens(user):
+    """
+    Start a new session for a Client or Admin and return (access_token, refresh_token).
+
+    Adds the session's RefreshTokenFamily to the current transaction; the caller commits.
+    """
+    now = datetime.utcnow()
+    family = RefreshTokenFamily(subject=subject_for(user), generation=0, expires_at=_refresh_expires_at(now))
+    db.session.add(family)
+    db.session.flush()
+    return _create_tokens(user, family.id, family.generation)
+
+def rotate_tokens(user, jwt_data):
+    """
+    Exchange a refresh token for a new (access_token, refresh_token) pair.
+
+    The session moves to the next generation with one conditional UPDATE, so
+    each refresh token works once. Presenting a spent or unknown one revokes the
+    session and returns None.
+    """
+    family_id = jwt_data.get('fam')
+    generation = jwt_data.get('gen')
+    if family_id is None or generation is None:
+        logger.info(f"Refresh token for {jwt_data.get('sub')} predates rotation; login required")
+        return None
+
+    now = datetime.utcnow()
+    rotated = RefreshTokenFamily.query.filter(
+        RefreshTokenFamily.id == family_id,
+        RefreshTokenFamily.subject == jwt_data['sub'],
+        RefreshTokenFamily.generation == generation,
+        RefreshTokenFamily.revoked_at.is_(None),
+        RefreshTokenFamily.expires_at > now
+    ).update({
+        RefreshTokenFamily.generation: generation + 1,
+        RefreshTokenFamily.expires_at: _refresh_expires_at(now),
+        RefreshTokenFamily.updated_at: now
+    }, synchronize_session=False)
+    if not rotated:
+        logger.warning(f"Reuse of refresh token for session {family_id} ({jwt_data['sub']}); revoking session")
+        revoke_family(family_id, now)
+        db.session.commit()
+        return None
+
+    tokens = _create_tokens(user, family_id, generation + 1)
+    db.session.commit()
+    return tokens
+
+def revoke_family(family_id, now=None):
+    """End one session so its refresh tokens stop working; the caller commits"""
+    if family_id is None:
+        return
+    RefreshTokenFamily.query.filter(
+        RefreshTokenFamily.id == family_id,
+        RefreshTokenFamily.revoked_at.is_(None)
+    ).update({RefreshTokenFamily.revoked_at: now or datetime.utcnow()}, synchronize_session=False)
+
+def revoke_all_families(user, now=None):
+    """End every session of a Client or Admin, e.g. after a password reset; the caller commits"""
+    RefreshTokenFamily.query.filter(
+        RefreshTokenFamily.subject == subject_for(user),
+        RefreshTokenFamily.revoked_at.is_(None)
+    ).update({RefreshTokenFamily.revoked_at: now or datetime.utcnow()}, synchronize_session=False)
+
+def prune_refresh_token_families(now=None):
+    """Delete expired and revoked sessions; an unknown session is rejected just like a revoked one"""
+    now = now or datetime.utcnow()
+    deleted = RefreshTokenFamily.query.filter(
+        (RefreshTokenFamily.expires_at < now) | RefreshTokenFamily.revoked_at.isnot(None)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} refresh token sessions")
+    return deleted
@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+import threading
+import uuid
+import logging
+from models import db, TopicSubscription, DeviceToken
+from firebase_notification import FirebaseUnavailable, FCM_TOPIC_BATCH_LIMIT, INVALID_TOKEN_REASONS
+from push_transport import push_transport
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+LEASE_SECONDS = 120
+
+def _pending(now):
+    return (
+        TopicSubscription.synced_at.is_(None) &
+        (TopicSubscription.locked_until.is_(None) | (TopicSubscription.locked_until < now))
+    )
+
+def _set_membership(tokens, topic, subscribed):
+    """Record the wanted state and queue it for the next sync; clearing the claim makes an in-flight sync skip the row"""
+    tokens = set(tokens)
+    if not tokens:
+        return
+    changes = {
+        TopicSubscription.subscribed: subscribed,
+        TopicSubscription.synced_at: None,
+        TopicSubscription.attempts: 0,
+        TopicSubscription.locked_until: None,
+        TopicSubscription.claimed_by: None,
+        TopicSubscription.updated_at: datetime.utcnow(),
+    }
+    query = TopicSubscription.query.filter(TopicSubscription.token.in_(list(tokens)))
+    if topic is not None:
+        query = query.filter(TopicSubscription.topic == topic)
+    # Rows already in the wanted state are left alone unless they never synced, which retries them
+    query.filter(
+        (TopicSubscription.subscribed != subscribed) | TopicSubscription.synced_at.is_(None)
+    ).update(changes, synchronize_session=False)
+    if subscribed:
+        existing = {token for (token,) in db.session.query(TopicSubscription.token).filter(
+            TopicSubscription.token.in_(list(tokens)), TopicSubscription.topic == topic
+        )}
+        for token in tokens - existing:
+            db.session.add(TopicSubscription(token=token, topic=topic, subscribed=True, attempts=0))
+
+def subscribe_tokens(tokens, topic):
+    """Subscribe device tokens to topic at the next sync; the caller commits"""
+    _set_membership(tokens, topic, True)
+
+def unsubscribe_tokens(tokens, topic=None):
+    """Unsubscribe device tokens from topic (every topic when None) at the next sync; the caller commits"""
+    _set_membership(tokens, topic, False)
+
+class TopicSync:
+    """
+    Brings FCM topic membership in line with the topic_subscriptions table.
+
+    Handlers only record the wanted state. This job, run by the scheduler in every
+    worker, leases pending rows per (topic, subscribe/unsubscribe) and sends them
+    to FCM in batches of up to FCM_TOPIC_BATCH_LIMIT tokens, so two workers never
+    send the same rows. Tokens FCM rejects are deleted together with their device
+    registration; other failures are retried on later runs up to max_attempts.
+    """
+
+    def __init__(self):
+        self.batch_size = FCM_TOPIC_BATCH_LIMIT
+        self.max_attempts = MAX_ATTEMPTS
+        self.lease_seconds = LEASE_SECONDS
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.synced = 0
+        self.failed = 0
+        self.tokens_pruned = 0
+
+    def configure(self, app):
+        self.batch_size = min(FCM_TOPIC_BATCH_LIMIT, app.config.get('TOPIC_SYNC_BATCH_SIZE', FCM_TOPIC_BATCH_LIMIT))
+        self.max_attempts = app.config.get('TOPIC_SYNC_MAX_ATTEMPTS', MAX_ATTEMPTS)
+
+    def _claim(self, topic, subscribed, now):
+        due = _pending(now) & (TopicSubscription.attempts < self.max_attempts)
+        ids = [row_id for (row_id,) in db.session.query(TopicSubscription.id).filter(
+            due, TopicSubscription.topic == topic, TopicSubscription.subscribed == subscribed
+        ).order_by(TopicSubscription.id).limit(self.batch_size)]
+        if not ids:
+            return None, []
+        claim = uuid.uuid4().hex
+        TopicSubscription.query.filter(TopicSubscription.id.in_(ids), due).update({
+            TopicSubscription.claimed_by: claim,
+            TopicSubscription.locked_until: now + timedelta(seconds=self.lease_seconds),
+        }, synchronize_session=False)
+        db.session.commit()
+        rows = db.session.query(TopicSubscription.id, TopicSubscription.token).filter(
+            TopicSubscription.claimed_by == claim
+        ).order_by(TopicSubscription.id).all()
+        return claim, rows
+
+    def _claimed(self, claim, ids):
+        # Rows changed since the claim have had it cleared and are left for the next run
+        return TopicSubscription.query.filter(TopicSubscription.id.in_(ids), TopicSubscription.claimed_by == claim)
+
+    def _release(self, claim, ids):
+        self._claimed(claim, ids).update({
+            TopicSubscription.locked_until: None,
+            TopicSubscription.claimed_by: None,
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def sync(self):
+        """Send every pending membership change to FCM; returns the number of rows synced"""
+        now = datetime.utcnow()
+        groups = db.session.query(TopicSubscription.topic, TopicSubscription.subscribed).filter(
+            _pending(now), TopicSubscription.attempts < self.max_attempts
+        ).distinct().all()
+        total = 0
+        for topic, subscribed in groups:
+            while True:
+                claim, rows = self._claim(topic, subscribed, now)
+                if not rows:
+                    break
+                try:
+                    errors = push_transport.update_topic_membership([token for _, token in rows], topic, subscribed)
+                except FirebaseUnavailable:
+                    self._release(claim, [row_id for row_id, _ in rows])
+                    logger.warning("Firebase is not configured; topic subscriptions stay pending")
+                    return total
+                except Exception as e:
+                    # The request as a whole failed, so every row in it did
+                    errors = [(index, str(e)) for index in range(len(rows))]
+                total += self._apply(claim, rows, dict(errors), subscribed)
+                if len(rows) < self.batch_size:
+                    break
+        return total
+
+    def _apply(self, claim, rows, errors, subscribed):
+        now = datetime.utcnow()
+        synced_ids = []
+        failed = {}  # reason -> ids
+        invalid_tokens = set()
+        for index, (row_id, token) in enumerate(rows):
+            reason = errors.get(index)
+            if reason is None:
+                synced_ids.append(row_id)
+            elif reason in INVALID_TOKEN_REASONS:
+                invalid_tokens.add(token)
+            else:
+                failed.setdefault(str(reason)[:1000], []).append(row_id)
+
+        synced = 0
+        if synced_ids and subscribed:
+            synced = self._claimed(claim, synced_ids).update({
+                TopicSubscription.synced_at: now,
+                TopicSubscription.last_error: None,
+                TopicSubscription.locked_until: None,
+                TopicSubscription.claimed_by: None,
+            }, synchronize_session=False)
+        elif synced_ids:
+            # Nothing left to remember about a membership FCM has removed
+            synced = self._claimed(claim, synced_ids).delete(synchronize_session=False)
+        for reason, ids in failed.items():
+            self._claimed(claim, ids).update({
+                TopicSubscription.attempts: TopicSubscription.attempts + 1,
+                TopicSubscription.last_error: reason,
+                TopicSubscription.locked_until: None,
+                TopicSubscription.claimed_by: None,
+            }, synchronize_session=False)
+            logger.warning(f"Topic membership update failed for {len(ids)} tokens: {reason}")
+        if invalid_tokens:
+            # FCM no longer knows these tokens, so there is no membership left to undo
+            TopicSubscription.query.filter(TopicSubscription.token.in_(list(invalid_tokens))).delete(synchronize_session=False)
+            DeviceToken.query.filter(DeviceToken.token.in_(list(invalid_tokens))).delete(synchronize_session=False)
+        db.session.commit()
+        action = 'Subscribed' if subscribed else 'Unsubscribed'
+        logger.info(f"{action} {synced}/{len(rows)} tokens in one topic batch")
+        with self._lock:
+            self.batches += 1
+            self.synced += synced
+            self.failed += sum(len(ids) for ids in failed.values())
+            self.tokens_pruned += len(invalid_tokens)
+        return synced
+
+    def metrics(self):
+        pending = TopicSubscription.query.filter(
+            TopicSubscription.synced_at.is_(None), TopicSubscription.attempts < self.max_attempts
+        ).count()
+        return {
+            'pending': pending,
+            'batches': self.batches,
+            'synced': self.synced,
+            'failed': self.failed,
+            'tokens_pruned': self.tokens_pruned,
+        }
+
+topic_sync = TopicSync()
+
+def sync_topic_subscriptions():
+    return topic_sync.sync()
@@ -0,0 +1,187 @@
+from datetime import datetime
+from flask import request
+from werkzeug.exceptions import BadRequest
+import re
+
+class ValidationError(BadRequest):
+    """
+    400 for a request body that does not match its schema.
+
+    Flask-RESTful renders e.data, so every handler returns the same shape:
+    {"message": <first problem>, "errors": {<field>: <problem>, ...}}
+    """
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+        field, problem = next(iter(errors.items()))
+        self.data = {'message': f"{field} {problem}", 'errors': errors}
+
+class Field:
+    """
+    Declarative description of one request field.
+
+    type is one of str, int, bool, list, dict, 'date' (YYYY-MM-DD) or 'time' (HH:MM:SS).
+    ints also accept integral floats and digit strings, and strs accept numbers, as
+    reqparse did. Constraints are checked in order; the first failure is reported.
+    """
+
+    def __init__(self, type=str, required=False, nullable=False, default=None, min=None, max=None,
+                 min_length=None, max_length=None, choices=None, pattern=None, pattern_message=None):
+        self.type = type
+        self.required = required
+        self.nullable = nullable
+        self.default = default
+        self.min = min
+        self.max = max
+        self.min_length = min_length
+        self.max_length = max_length
+        self.choices = tuple(choices) if choices is not None else None
+        self.pattern = re.compile(pattern) if pattern else None
+        self.pattern_message = pattern_message or 'has an invalid format'
+
+    def compile(self):
+        """Build a converter: value -> (converted, None) or (None, problem)"""
+        convert = _CONVERTERS[self.type]
+        checks = []
+        if self.min is not None:
+            minimum = self.min
+            checks.append(lambda v: None if v >= minimum else f"must be at least {minimum}")
+        if self.max is not None:
+            maximum = self.max
+            checks.append(lambda v: None if v <= maximum else f"must be at most {maximum}")
+        if self.min_length is not None:
+            min_length = self.min_length
+            checks.append(lambda v: None if len(v) >= min_length else
+                          ('must not be empty' if min_length == 1 else f"must have a length of at least {min_length}"))
+        if self.max_length is not None:
+            max_length = self.max_length
+            checks.append(lambda v: None if len(v) <= max_length else f"must have a length of at most {max_length}")
+        if self.choices is not None:
+            choices = self.choices
+            checks.append(lambda v: None if v in choices else f"must be one of {', '.join(map(str, choices))}")
+        if self.pattern is not None:
+            match, message = self.pattern.match, self.pattern_message
+            checks.append(lambda v: None if match(v) else message)
+        nullable = self.nullable
+
+        def run(value):
+            if value is None:
+                return (None, None) if nullable else (None, 'must not be null')
+            value, problem = convert(value)
+            if problem:
+                return None, problem
+            for check in checks:
+                problem = check(value)
+                if problem:
+                    return None, problem
+            return value, None
+        return run
+
+def _to_str(value):
+    if isinstance(value, str):
+        return value, None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value), None
+    return None, 'must be a string'
+
+# ASCII digits only; str.isdigit() also accepts characters such as '²' that int() rejects
+_INTEGER = re.compile(r'-?[0-9]+')
+
+def _to_int(value):
+    if isinstance(value, bool):
+        return None, 'must be an integer'
+    if isinstance(value, int):
+        return value, None
+    if isinstance(value, float) and value.is_integer():
+        return int(value), None
+    if isinstance(value, str) and _INTEGER.fullmatch(value.strip()):
+        return int(value), None
+    return None, 'must be an integer'
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value, None
+    if value in ('true', 'True', '1', 1):
+        return True, None
+    if value in ('false', 'False', '0', 0):
+        return False, None
+    return None, 'must be true or false'
+
+def _of_type(expected, name):
+    def convert(value):
+        return (value, None) if isinstance(value, expected) else (None, f'must be {name}')
+    return convert
+
+def _parser(fmt, name):
+    def convert(value):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            return None, f'must be {name}'
+        return (parsed.date() if fmt == '%Y-%m-%d' else parsed.time()), None
+    return convert
+
+_CONVERTERS = {
+    str: _to_str,
+    int: _to_int,
+    bool: _to_bool,
+    list: _of_type(list, 'a list'),
+    dict: _of_type(dict, 'an object'),
+    'date': _parser('%Y-%m-%d', 'a date (YYYY-MM-DD)'),
+    'time': _parser('%H:%M:%S', 'a time (HH:MM:SS)'),
+}
+
+_MISSING = object()
+
+def request_body():
+    """The current request's JSON body, or its form fields when it has none"""
+    data = request.get_json(silent=True)
+    if data is None:
+        data = request.form.to_dict()
+    return data
+
+class Schema:
+    """
+    A request body schema, compiled once at import into a flat list of converters.
+
+    Unknown keys are dropped, so handlers only ever see fields the schema checked.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._compiled = tuple(
+            (name, field.required, field.default, field.compile()) for name, field in fields.items()
+        )
+
+    def load(self, data):
+        """Validate a dict, returning (cleaned, errors); errors is empty when data is valid"""
+        if not isinstance(data, dict):
+            return None, {'body': 'must be a JSON object'}
+        cleaned = {}
+        errors = {}
+        for name, required, default, run in self._compiled:
+            value = data.get(name, _MISSING)
+            if value is _MISSING:
+                if required:
+                    errors[name] = 'is required'
+                elif default is not None:
+                    cleaned[name] = default
+                continue
+            value, problem = run(value)
+            if problem:
+                errors[name] = problem
+            else:
+                cleaned[name] = value
+        return cleaned, errors
+
+    def validate(self, data):
+        """Validated copy of data, raising ValidationError (a 400) if it does not match"""
+        cleaned, errors = self.load(data)
+        if errors:
+            raise ValidationError(errors)
+        return cleaned
+
+    def parse(self):
+        """Validate the current request's JSON body (or form, as reqparse accepted)"""
+        return self.validate(request_body())